@@ -1,25 +1,31 @@
+import asyncio
 import os 
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_cerebras import ChatCerebras
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, ToolMessage
-from typing import List, Optional
+from langchain_core.messages import SystemMessage, message_chunk_to_message
+from typing import Callable, List, Optional
+
+from src.agent.context_window import ORCAMENTO_PADRAO, janela_de_contexto
+from src.agent.llm_factory import criar_llm
+from src.evo.chunker import ChunkerStreaming
+from src.graph.idempotency import chave_turno, ja_executado, marcar_executado
+from src.metrics.stats import get_metrics
 
 load_dotenv()
 
-MAX_MESSAGES = 20
+# Envia a resposta ao WhatsApp parágrafo a parágrafo enquanto o LLM ainda gera
+STREAM_TO_WHATSAPP = os.getenv('STREAM_TO_WHATSAPP', 'false').lower() == 'true'
+
+# Provedor por LLM_PROVIDER (openai, cerebras, groq ou fake), ver src/agent/llm_factory.py
+llm = criar_llm()
 
-# llm = ChatCerebras(
-#     api_key=os.getenv('CEREBRAS_API_KEY'),
-#     model=os.getenv('CEREBRAS_MODEL'),
-#     temperature=0
-# )
+# Modelo barato que mantém o resumo das mensagens que saíram da janela de contexto
+llm_resumo = criar_llm('resumo')
 
-llm = ChatOpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    model=os.getenv("OPENAI_MODEL", "gpt-4.1"),
-    temperature=0,
-)
+# Tokens de entrada por agente, em cache no provedor ou não:
+# metrics.ratio('<agente>.cached_tokens', '<agente>.uncached_tokens') é a taxa de acerto
+metrics = get_metrics('llm')
 
 class Agent:
     def __init__(
@@ -29,45 +35,288 @@ class Agent:
         llm,
         structured_schema: Optional[object] = None,
         context_providers: Optional[List] = None,
+        stream_sender: Optional[Callable] = None,
+        token_budget: int = ORCAMENTO_PADRAO,
+        turno_isolado: Optional[Callable] = None,
     ):
         self.name = name
         self.prompt = prompt
         self.llm = llm
         self.structured_schema = structured_schema
         self.context_providers = context_providers or []
+        self.stream_sender = stream_sender
+        self.token_budget = token_budget
+        # state -> mensagens do turno, quando ele deve ser respondido sem
+        # histórico, resumo nem context_providers (None: contexto completo)
+        self.turno_isolado = turno_isolado
+
+    def _transmitir_ativo(self) -> bool:
+        return STREAM_TO_WHATSAPP and self.stream_sender is not None and not self.structured_schema
+
+    def _resultado_transmitido(self, response, enviadas: int) -> dict:
+        """
+        Mensagem completa para o state (checkpointer e save_msg_ai) e quantas
+        partes dela já chegaram ao WhatsApp: o sender_message pula essas partes.
+        """
+        if response is None:
+            raise ValueError(f'Agente {self.name}: o LLM terminou o stream sem nenhum chunk')
+
+        message = message_chunk_to_message(response)
+        self._registrar_uso(message)
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+
+        print(f'📡 Agente {self.name} transmitiu {enviadas} parte(s) durante a geração')
+
+        return {
+            "messages": [message],
+            "agent_name": self.name,
+            "streamed": {"id": message.id, "parts": enviadas},
+        }
+
+    @staticmethod
+    def _resposta_de_texto(modo: str | None, chunk) -> str | None:
+        """
+        Decide no primeiro chunk não vazio se a mensagem é uma resposta de texto
+        ('texto': transmite daqui em diante) ou uma chamada de tool ('tool': retém).
+        """
+        if modo is not None:
+            return modo
+        if chunk.tool_call_chunks:
+            return 'tool'
+        if chunk.text:
+            return 'texto'
+        return None
+
+    def _desfazer_marca(self, chave: str | None, ja_enviadas: int):
+        """
+        O modelo começou em texto e terminou chamando tool: as partes já
+        enviadas não são da resposta final, então não contam para o
+        sender_message (volta a marca ao valor do início do stream).
+        """
+        print(f'⚠️ Agente {self.name} chamou tool depois de começar a responder em texto')
+        marcar_executado(chave, str(ja_enviadas))
+
+    def _transmitir(self, messages, state):
+        """
+        Consome o stream do LLM e envia cada parte pronta (ChunkerStreaming)
+        enquanto a geração continua.
+
+        COMO FUNCIONA:
+        - O primeiro chunk não vazio decide: texto é transmitido a partir dali,
+          início de tool call fica retido (o texto de uma chamada de tool não
+          é a resposta final). Se uma tool call aparecer depois, os envios param
+        - Os envios rodam em uma thread própria, em ordem, sem segurar o stream
+        - Cada parte entregue fica marcada em chave_turno('sender_message'),
+          a mesma marca do sender_message: um retry do turno pula as partes
+          já enviadas em vez de mandá-las de novo
+        - Se um envio falhar, os seguintes são cancelados; o sender_message
+          reenvia a partir da primeira parte que não chegou
+        """
+        number = state['number']
+        chave = chave_turno(state, 'sender_message')
+        ja_enviadas = int(ja_executado(chave) or 0)
+        chunker = ChunkerStreaming()
+        falhou = []
+        response = None
+        modo = None
+
+        def enviar(indice, parte):
+            if falhou:
+                return False
+            if indice < ja_enviadas:
+                return True
+            try:
+                self.stream_sender(number=number, text=parte)
+            except Exception as e:
+                print(f'❌ Erro ao transmitir parte para {number}: {e}')
+                falhou.append(e)
+                return False
+            marcar_executado(chave, str(indice + 1))
+            return True
+
+        with ThreadPoolExecutor(max_workers=1) as envio:
+            envios = []
+
+            def submeter(partes):
+                envios.extend(envio.submit(enviar, len(envios), parte) for parte in partes)
+
+            for chunk in self.llm.stream(messages):
+                response = chunk if response is None else response + chunk
+                modo = self._resposta_de_texto(modo, chunk)
+
+                if modo == 'texto' and not response.tool_call_chunks:
+                    submeter(chunker.alimentar(chunk.text))
+
+            if modo == 'texto' and not response.tool_call_chunks:
+                submeter(chunker.finalizar())
+
+            enviadas = 0
+            for futuro in envios:
+                if not futuro.result():
+                    break
+                enviadas += 1
+
+        if envios and response.tool_call_chunks:
+            self._desfazer_marca(chave, ja_enviadas)
+            enviadas = 0
+
+        return self._resultado_transmitido(response, enviadas)
+
+    async def _atransmitir(self, messages, state):
+        """Mesmo fluxo do _transmitir com astream; os envios rodam em uma task."""
+        number = state['number']
+        chave = chave_turno(state, 'sender_message')
+        ja_enviadas = int(await asyncio.to_thread(ja_executado, chave) or 0)
+        chunker = ChunkerStreaming()
+        fila = asyncio.Queue()
+        response = None
+        modo = None
+        total = 0
+
+        async def enviar():
+            enviadas = 0
+            while (parte := await fila.get()) is not None:
+                if enviadas >= ja_enviadas:
+                    try:
+                        await asyncio.to_thread(self.stream_sender, number=number, text=parte)
+                    except Exception as e:
+                        print(f'❌ Erro ao transmitir parte para {number}: {e}')
+                        break
+                    await asyncio.to_thread(marcar_executado, chave, str(enviadas + 1))
+                enviadas += 1
+            return enviadas
+
+        envio = asyncio.create_task(enviar())
+
+        try:
+            async for chunk in self.llm.astream(messages):
+                response = chunk if response is None else response + chunk
+                modo = self._resposta_de_texto(modo, chunk)
+
+                if modo == 'texto' and not response.tool_call_chunks:
+                    for parte in chunker.alimentar(chunk.text):
+                        fila.put_nowait(parte)
+                        total += 1
+
+            if modo == 'texto' and not response.tool_call_chunks:
+                for parte in chunker.finalizar():
+                    fila.put_nowait(parte)
+                    total += 1
+
+        finally:
+            fila.put_nowait(None)
+            enviadas = await envio
+
+        if total and response.tool_call_chunks:
+            await asyncio.to_thread(self._desfazer_marca, chave, ja_enviadas)
+            enviadas = 0
+
+        return self._resultado_transmitido(response, enviadas)
+
+    def _montar_mensagens(self, state):
+        """
+        Monta as mensagens na ordem que aproveita o cache de prompt do provedor
+        (o cache vale para o maior prefixo idêntico a uma chamada anterior).
+
+        COMO FUNCIONA:
+        - Prefixo estável: tools (bind_tools) + prompt renderizado, igual
+          para todos os pacientes
+        - Histórico: entre chamadas do mesmo turno (loop de tools) e entre
+          turnos, só cresce no final
+        - Sufixo volátil em uma SystemMessage no fim: resumo e context_providers,
+          na ordem recebida (do mais estável ao que muda a cada minuto)
+        - Turno isolado (turno_isolado): só o prompt e as mensagens do turno,
+          sem nada do paciente; a resposta pode ser reaproveitada para outros
+        """
+        if self.turno_isolado is not None:
+            turno = self.turno_isolado(state)
+            if turno is not None:
+                return [SystemMessage(content=self.prompt)] + turno
+
+        # Histórico limitado pelo orçamento de tokens do agente, sem separar
+        # tool_calls dos seus ToolMessages
+        _, message_history = janela_de_contexto(state['messages'], self.token_budget)
+
+        context_parts = []
+
+        # O que saiu da janela chega ao agente pelo resumo (nó resumir_contexto)
+        if state.get('summary'):
+            context_parts.append(f"RESUMO DA CONVERSA ATÉ AQUI:\n{state['summary']}")
+
+        context_parts += [provider(state) for provider in self.context_providers]
+
+        messages = [SystemMessage(content=self.prompt)] + message_history
+
+        if context_parts:
+            messages.append(SystemMessage(content="\n\n".join(context_parts)))
+
+        return messages
+
+    def _registrar_uso(self, response):
+        """Soma nas métricas os tokens de entrada que vieram do cache do provedor."""
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return
+
+        entrada = usage.get('input_tokens', 0)
+        cached = (usage.get('input_token_details') or {}).get('cache_read', 0) or 0
+
+        metrics.incr(f'{self.name}.cached_tokens', cached)
+        metrics.incr(f'{self.name}.uncached_tokens', entrada - cached)
+
+        taxa = metrics.ratio(f'{self.name}.cached_tokens', f'{self.name}.uncached_tokens')
+        print(f'💾 Agente {self.name}: {cached}/{entrada} tokens de entrada em cache (acumulado {taxa:.0%})')
+
+    def _estruturado(self, resultado):
+        # include_raw=True: a AIMessage crua traz o usage_metadata
+        self._registrar_uso(resultado['raw'])
+
+        if resultado['parsing_error'] is not None:
+            raise resultado['parsing_error']
+
+        return {
+            "next_agent": resultado['parsed'],
+            "agent_name": self.name
+        }
 
     def __call__(self, state):
         print(f'🤖 Agente {self.name} pensando...')
 
-        context_parts = [provider(state) for provider in self.context_providers]
+        messages = self._montar_mensagens(state)
+
+        if self.structured_schema:
+            llm = self.llm.with_structured_output(self.structured_schema, include_raw=True)
+            return self._estruturado(llm.invoke(messages))
 
-        context_text = "\n".join(context_parts)
+        if self._transmitir_ativo():
+            return self._transmitir(messages, state)
 
-        system_prompt = (
-            f"{self.prompt}\n\n"
-            f"{context_text}"
-        )
+        response = self.llm.invoke(messages)
+        self._registrar_uso(response)
 
-        # 1. Limita o histórico a 20 mensagens
-        message_history = state['messages'][-MAX_MESSAGES:]
+        return {
+            "messages": [response],
+            "agent_name": self.name
+        }
 
-        # 2. Garante que não começa com ToolMessage sem tool_call pareado
-        while message_history and isinstance(message_history[0], ToolMessage):
-            message_history = message_history[1:]
+    async def acall(self, state):
+        """Mesmo fluxo do __call__, usando ainvoke (worker asyncio)."""
+        print(f'🤖 Agente {self.name} pensando...')
 
-        messages = [SystemMessage(content=system_prompt)] + message_history
+        messages = self._montar_mensagens(state)
 
         if self.structured_schema:
-            llm = self.llm.with_structured_output(self.structured_schema)
-            response = llm.invoke(messages)
-            return {
-                "next_agent": response,
-                "agent_name": self.name
-            }
+            llm = self.llm.with_structured_output(self.structured_schema, include_raw=True)
+            return self._estruturado(await llm.ainvoke(messages))
 
-        response = self.llm.invoke(messages)
+        if self._transmitir_ativo():
+            return await self._atransmitir(messages, state)
+
+        response = await self.llm.ainvoke(messages)
+        self._registrar_uso(response)
 
         return {
             "messages": [response],
             "agent_name": self.name
-        }
\ No newline at end of file
+        }
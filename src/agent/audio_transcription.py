@@ -2,18 +2,35 @@ import os
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from src.agent.llm_factory import provedor_fake, transcricao_falsa
+
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_client = None
+
+
+def get_client() -> OpenAI:
+    """Cliente da OpenAI criado no primeiro uso: importar o módulo não exige OPENAI_API_KEY."""
+    global _client
+
+    if _client is None:
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    return _client
+
 
 def audio_transcription(audio_base64: str) -> str:
     import base64
     
     # Decodifica audio
     audio_data = base64.b64decode(audio_base64)
+
+    # Provedor fake (testes de carga): sem Whisper
+    if provedor_fake():
+        return transcricao_falsa(audio_data)
     
     # Transcreve direto (sem salvar arquivo)
-    response = client.audio.transcriptions.create(
+    response = get_client().audio.transcriptions.create(
         model="whisper-1",
         file=("audio.mp3", audio_data),
         language="pt"
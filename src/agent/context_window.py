@@ -0,0 +1,189 @@
+import json
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+load_dotenv()
+
+# Orçamento de tokens do histórico enviado a cada agente (fora o system prompt)
+ORCAMENTO_PADRAO = int(os.getenv('CONTEXT_TOKEN_BUDGET', 6000))
+
+# Só chama o LLM de resumo quando há pelo menos isso de histórico novo fora da janela
+RESUMO_MIN_TOKENS = int(os.getenv('SUMMARY_MIN_TOKENS', 1000))
+RESUMO_MAX_CHARS_TOOL = 500  # resultado de tool entra truncado no resumo
+
+TOKENS_POR_MENSAGEM = 4  # overhead de formatação de cada mensagem no chat completions
+
+# Mensagens recentes que sempre ficam no checkpoint; as anteriores já
+# resumidas saem do state (nó compactar_estado)
+CHECKPOINT_KEEP_MESSAGES = int(os.getenv('CHECKPOINT_KEEP_MESSAGES', 20))
+
+PROMPT_RESUMO = """Você mantém o resumo de uma conversa de WhatsApp entre um paciente e a clínica.
+Atualize o resumo anterior com as mensagens novas. Guarde o que importa para continuar
+o atendimento: dados do paciente, pedidos, decisões, datas, médicos, procedimentos e
+pendências. Seja objetivo, em português, no máximo 15 linhas. Responda só com o resumo."""
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Encoding do tiktoken para o modelo configurado.
+    None se não for possível carregar (ex: sem acesso para baixar o arquivo
+    do encoding): a contagem cai para a estimativa de ~4 chars por token.
+    """
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(os.getenv('OPENAI_MODEL', 'gpt-4.1'))
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+
+    except Exception as e:
+        print(f'⚠️ [CONTEXTO] tiktoken indisponível, estimando tokens por caracteres: {e}')
+        return None
+
+
+def contar_tokens(texto: str) -> int:
+    if not texto:
+        return 0
+
+    encoding = _encoding()
+    if encoding is None:
+        return len(texto) // 4 + 1
+
+    return len(encoding.encode(texto, disallowed_special=()))
+
+
+def tokens_mensagem(message) -> int:
+    conteudo = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    total = TOKENS_POR_MENSAGEM + contar_tokens(conteudo)
+
+    for call in getattr(message, 'tool_calls', None) or []:
+        total += contar_tokens(call['name']) + contar_tokens(json.dumps(call['args'], ensure_ascii=False))
+
+    return total
+
+
+def _agrupar(messages: list) -> list[list]:
+    """
+    Agrupa o histórico em blocos que não podem ser separados:
+    uma AIMessage com tool_calls e os ToolMessages que respondem a ela.
+    ToolMessages soltos no começo (sem a chamada) são descartados.
+    """
+    grupos = []
+
+    for message in messages:
+        if isinstance(message, ToolMessage):
+            if grupos:
+                grupos[-1].append(message)
+            continue
+
+        grupos.append([message])
+
+    return grupos
+
+
+def janela_de_contexto(messages: list, orcamento: int = ORCAMENTO_PADRAO) -> tuple[list, list]:
+    """
+    Divide o histórico em (fora da janela, dentro da janela).
+
+    COMO FUNCIONA:
+    - Percorre do mais recente para o mais antigo, bloco a bloco (_agrupar),
+      enquanto couber no orçamento de tokens
+    - O bloco mais recente sempre entra, mesmo que sozinho passe do orçamento
+    - A janela nunca começa com um ToolMessage sem a tool_call correspondente
+    """
+    grupos = _agrupar(messages)
+    janela = []
+    usados = 0
+
+    for grupo in reversed(grupos):
+        tokens = sum(tokens_mensagem(message) for message in grupo)
+
+        if janela and usados + tokens > orcamento:
+            break
+
+        janela[:0] = grupo
+        usados += tokens
+
+    ids_janela = {id(message) for message in janela}
+    fora = [message for message in messages if id(message) not in ids_janela]
+
+    return fora, janela
+
+
+def pendentes_de_resumo(messages: list, resumo_ate: str | None, orcamento: int = ORCAMENTO_PADRAO) -> list:
+    """
+    Mensagens que já saíram da janela e ainda não entraram no resumo.
+    resumo_ate é o id da última mensagem já resumida (None: nenhuma das presentes).
+    """
+    fora, _ = janela_de_contexto(messages, orcamento)
+
+    if resumo_ate is None:
+        return fora
+
+    ids = [message.id for message in fora]
+    if resumo_ate not in ids:
+        # A última resumida ainda está na janela (ou saiu do state): nada novo
+        return [] if any(message.id == resumo_ate for message in messages) else fora
+
+    return fora[ids.index(resumo_ate) + 1:]
+
+
+def _formatar(message) -> str | None:
+    if isinstance(message, HumanMessage):
+        return f'Paciente: {message.content}'
+
+    if isinstance(message, ToolMessage):
+        conteudo = str(message.content)[:RESUMO_MAX_CHARS_TOOL]
+        return f'Resultado de {message.name or "ferramenta"}: {conteudo}'
+
+    if isinstance(message, AIMessage):
+        partes = []
+        if message.content:
+            partes.append(f'Clínica: {message.content}')
+        for call in message.tool_calls:
+            partes.append(f'Clínica chamou {call["name"]}({json.dumps(call["args"], ensure_ascii=False)})')
+        return '\n'.join(partes) or None
+
+    return None
+
+
+def montar_pedido_resumo(resumo_anterior: str | None, mensagens: list) -> list:
+    conversa = '\n'.join(filter(None, (_formatar(message) for message in mensagens)))
+
+    return [
+        SystemMessage(content=PROMPT_RESUMO),
+        HumanMessage(content=f'RESUMO ANTERIOR:\n{resumo_anterior or "(vazio)"}\n\nMENSAGENS NOVAS:\n{conversa}'),
+    ]
+
+
+def precisa_resumir(mensagens: list) -> bool:
+    return sum(tokens_mensagem(message) for message in mensagens) >= RESUMO_MIN_TOKENS
+
+
+def mensagens_para_compactar(messages: list, resumo_ate: str | None, manter: int = CHECKPOINT_KEEP_MESSAGES) -> list:
+    """
+    Mensagens antigas que podem sair do checkpoint.
+
+    COMO FUNCIONA:
+    - Só sai o que já está no resumo (até resumo_ate): o agente não perde contexto
+    - As `manter` mensagens mais recentes ficam sempre
+    - O corte nunca separa uma tool_call dos seus ToolMessages
+    Com isso o state fica em ~orçamento da janela + SUMMARY_MIN_TOKENS,
+    não importa quanto tempo o paciente conversa.
+    """
+    ids = [message.id for message in messages]
+
+    if resumo_ate not in ids:
+        return []
+
+    corte = min(ids.index(resumo_ate) + 1, len(messages) - manter)
+
+    while 0 < corte < len(messages) and isinstance(messages[corte], ToolMessage):
+        corte -= 1
+
+    return messages[:max(corte, 0)]
@@ -0,0 +1,164 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+import xxhash
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from src.agent.llm_factory import embedding_falso, provedor_fake
+from src.metrics.stats import get_metrics
+from src.redis.client_redis import redis_client_bytes
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_BATCH = 256  # textos por chamada à API de embeddings
+
+# Cache em dois níveis: LRU no processo + Redis compartilhado entre workers
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 5000))  # vetores em memória por processo
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 30 * 86400))  # segundos no Redis
+CHAVE_EMBEDDING = 'emb:'
+
+_client = None
+metrics = get_metrics('embeddings')
+
+_memoria = OrderedDict()
+_memoria_lock = threading.Lock()
+
+
+def get_client() -> OpenAI:
+    """Cliente da OpenAI criado no primeiro uso: importar o módulo não exige OPENAI_API_KEY."""
+    global _client
+
+    if _client is None:
+        _client = OpenAI()
+
+    return _client
+
+
+def normalizar(texto: str) -> str:
+    """Espaços colapsados e minúsculas: variações triviais da mesma pergunta viram uma chave."""
+    return ' '.join(texto.split()).lower()
+
+
+def chave(texto_normalizado: str) -> str:
+    return f'{CHAVE_EMBEDDING}{EMBEDDING_MODEL}:{xxhash.xxh3_128_hexdigest(texto_normalizado)}'
+
+
+def _da_memoria(chaves: list[str]) -> dict[str, list[float]]:
+    encontrados = {}
+
+    with _memoria_lock:
+        for k in chaves:
+            if k in _memoria:
+                _memoria.move_to_end(k)
+                encontrados[k] = _memoria[k]
+
+    return encontrados
+
+
+def _para_memoria(vetores: dict[str, list[float]]):
+    with _memoria_lock:
+        for k, vetor in vetores.items():
+            _memoria[k] = vetor
+            _memoria.move_to_end(k)
+
+        while len(_memoria) > EMBEDDING_CACHE_SIZE:
+            _memoria.popitem(last=False)
+
+
+def _do_redis(chaves: list[str]) -> dict[str, list[float]]:
+    if not chaves:
+        return {}
+
+    try:
+        valores = redis_client_bytes.mget(chaves)
+    except Exception as e:
+        # Sem Redis, segue para a API: o cache nunca trava a conversa
+        print(f'⚠️ [EMBEDDINGS] Falha ao ler cache no Redis: {e}')
+        return {}
+
+    return {k: array('f', valor).tolist() for k, valor in zip(chaves, valores) if valor}
+
+
+def _para_redis(vetores: dict[str, list[float]]):
+    if not vetores:
+        return
+
+    try:
+        pipe = redis_client_bytes.pipeline(transaction=False)
+        for k, vetor in vetores.items():
+            # float32: 6 KB por vetor de 1536 dimensões
+            pipe.set(k, array('f', vetor).tobytes(), ex=EMBEDDING_CACHE_TTL)
+        pipe.execute()
+
+    except Exception as e:
+        print(f'⚠️ [EMBEDDINGS] Falha ao gravar cache no Redis: {e}')
+
+
+def _da_api(textos: list[str]) -> list[list[float]]:
+    if provedor_fake():
+        return [embedding_falso(texto) for texto in textos]
+
+    vetores = []
+
+    for inicio in range(0, len(textos), EMBEDDING_BATCH):
+        response = get_client().embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=textos[inicio:inicio + EMBEDDING_BATCH],
+        )
+        vetores.extend(item.embedding for item in response.data)
+
+    return vetores
+
+
+def embed_batch(textos: list[str]) -> list[list[float]]:
+    """
+    Embeddings de vários textos, na mesma ordem.
+
+    COMO FUNCIONA:
+    - Cada texto é normalizado e vira uma chave (hash xxh3 + modelo);
+      a normalização só serve à chave: a API recebe o texto original
+      (o primeiro de cada chave, quando há variações triviais no lote)
+    - Procura primeiro no LRU do processo, depois no Redis (MGET único)
+    - Só o que faltou vai para a API, em lotes de EMBEDDING_BATCH,
+      e volta para os dois níveis do cache
+
+    Tudo que gera embeddings (consultas, roteador, ingestão) deve passar
+    por aqui para compartilhar o cache.
+    """
+    chaves = [chave(normalizar(texto)) for texto in textos]
+    unicas = list(dict.fromkeys(chaves))
+
+    vetores = _da_memoria(unicas)
+    metrics.incr('hits.memoria', len(vetores))
+
+    faltando = [k for k in unicas if k not in vetores]
+    do_redis = _do_redis(faltando)
+    metrics.incr('hits.redis', len(do_redis))
+    _para_memoria(do_redis)
+    vetores.update(do_redis)
+
+    faltando = [k for k in faltando if k not in vetores]
+    if faltando:
+        texto_da_chave = {}
+        for k, texto in zip(chaves, textos):
+            texto_da_chave.setdefault(k, texto)
+
+        with metrics.timer('api'):
+            novos = dict(zip(faltando, _da_api([texto_da_chave[k] for k in faltando])))
+
+        _para_memoria(novos)
+        _para_redis(novos)
+        vetores.update(novos)
+
+    metrics.incr('hits', len(unicas) - len(faltando))
+    metrics.incr('misses', len(faltando))
+
+    return [vetores[k] for k in chaves]
+
+
+def embed(texto: str) -> list[float]:
+    return embed_batch([texto])[0]
@@ -0,0 +1,551 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any
+
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict, Field, PrivateAttr
+
+from src.metrics.stats import get_metrics
+
+load_dotenv()
+
+# openai | cerebras | groq | fake
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai').lower()
+
+# Cassete: arquivo JSON com respostas gravadas. 'record' grava o que ainda
+# não está no arquivo (e repete o que já está); 'replay' só repete, sem provedor
+LLM_CASSETTE = os.getenv('LLM_CASSETTE')
+LLM_CASSETTE_MODE = os.getenv('LLM_CASSETTE_MODE', 'replay').lower()
+LLM_CASSETTE_LATENCIA = os.getenv('LLM_CASSETTE_LATENCIA', 'false').lower() == 'true'  # repete o tempo gravado
+
+# Modelo falso: roteiro JSON opcional e distribuição da latência
+LLM_FAKE_SCRIPT = os.getenv('LLM_FAKE_SCRIPT')
+LLM_FAKE_LATENCIA = os.getenv('LLM_FAKE_LATENCIA', 'fixa:0')  # fixa:s | uniforme:a,b | normal:m,d | lognormal:mu,sigma
+LLM_FAKE_TOKENS_POR_S = float(os.getenv('LLM_FAKE_TOKENS_POR_S', 0))  # 0 = gera o texto todo de uma vez
+LLM_FAKE_SEED = int(os.getenv('LLM_FAKE_SEED', 42))
+LLM_FAKE_TRANSCRICAO = os.getenv('LLM_FAKE_TRANSCRICAO') or 'Olá, gostaria de saber o valor da consulta'  # texto de todo áudio
+
+# Mesmo tamanho do text-embedding-3-small (colunas VECTOR(1536) do banco)
+FAKE_EMBEDDING_DIMENSOES = 1536
+
+metrics = get_metrics('llm_factory')
+
+# Roteiro padrão do modelo falso, pensado para este graph:
+# - rotas: valor dos campos enum na saída estruturada (orquestrador -> NextAgent)
+# - tools: chamadas de tool quando a mensagem do paciente casa com 'se'
+# - respostas: texto final; sem regra que case, usa RESPOSTA_PADRAO
+ROTEIRO_PADRAO = {
+    'rotas': [
+        {'se': r'humano|atendente|falar com (uma )?pessoa', 'valor': 'humano'},
+        {'se': r'marcar|agendar|remarcar|cancelar|hor[aá]rio|consulta', 'valor': 'agendamento'},
+    ],
+    'tools': [],
+    'respostas': [],
+}
+RESPOSTA_PADRAO = 'Certo! Sobre "{texto}", posso te ajudar sim.\n\nSe quiser, me conte mais detalhes.'
+
+
+# -----------------------------
+# LATÊNCIA
+# -----------------------------
+
+def sorteador_latencia(spec: str, rng: random.Random):
+    """
+    Função que sorteia uma latência em segundos a partir de 'tipo:parametros'.
+
+    fixa:0.8 | uniforme:0.3,1.2 | normal:0.8,0.2 | lognormal:-0.2,0.5
+    """
+    tipo, _, parametros = (spec or 'fixa:0').partition(':')
+    valores = [float(valor) for valor in parametros.split(',') if valor.strip()]
+
+    distribuicoes = {
+        'fixa': (1, lambda segundos: segundos),
+        'uniforme': (2, rng.uniform),
+        'normal': (2, rng.gauss),
+        'lognormal': (2, rng.lognormvariate),
+    }
+    if tipo not in distribuicoes or len(valores) != distribuicoes[tipo][0]:
+        raise ValueError(f'Latência inválida: {spec!r} (ex: fixa:0.8, uniforme:0.3,1.2, normal:0.8,0.2, lognormal:-0.2,0.5)')
+
+    funcao = distribuicoes[tipo][1]
+    return lambda: max(0.0, funcao(*valores))
+
+
+# -----------------------------
+# UTILITÁRIOS
+# -----------------------------
+
+def _ultimo_texto_paciente(messages: list) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.text
+    return ''
+
+
+def _ultima_conversa(messages: list):
+    """Última mensagem que não é SystemMessage (o sufixo de contexto vem no fim)."""
+    for message in reversed(messages):
+        if not isinstance(message, SystemMessage):
+            return message
+    return None
+
+
+def _em_chunks(message: AIMessage) -> list[AIMessageChunk]:
+    """Quebra uma resposta em chunks de stream: palavra a palavra ou uma tool call por chunk."""
+    if message.tool_calls:
+        chunks = [
+            AIMessageChunk(content='', tool_call_chunks=[{
+                'name': call['name'],
+                'args': json.dumps(call['args'], ensure_ascii=False),
+                'id': call['id'],
+                'index': indice,
+            }])
+            for indice, call in enumerate(message.tool_calls)
+        ]
+    else:
+        chunks = [AIMessageChunk(content=parte) for parte in re.findall(r'\S+\s*|\s+', message.text)]
+
+    chunks = chunks or [AIMessageChunk(content='')]
+    chunks[-1].usage_metadata = message.usage_metadata
+    return chunks
+
+
+def _uso(messages: list, resposta: str) -> dict:
+    """Contagem aproximada (~4 chars por token) para as métricas de cache do Agent."""
+    entrada = sum(len(str(message.content)) for message in messages) // 4
+    saida = len(resposta) // 4
+    return {'input_tokens': entrada, 'output_tokens': saida, 'total_tokens': entrada + saida}
+
+
+# -----------------------------
+# MODELO FALSO
+# -----------------------------
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo de chat com roteiro determinístico, para rodar o graph offline.
+
+    COMO FUNCIONA:
+    - Saída estruturada (with_structured_output usa bind_tools com
+      tool_choice='any'): preenche o schema; campos enum seguem roteiro['rotas']
+    - Com tools: chama a tool de roteiro['tools'] cuja regra casa com a última
+      mensagem do paciente, só uma vez por turno (depois da ToolMessage responde)
+    - Texto: roteiro['respostas'] ou RESPOSTA_PADRAO, com {texto} = mensagem do paciente
+    - Latência sorteada de uma distribuição (antes da resposta) e, com
+      tokens_por_segundo, o stream sai no ritmo de geração
+    """
+
+    roteiro: dict = Field(default_factory=lambda: ROTEIRO_PADRAO)
+    latencia: str = 'fixa:0'
+    tokens_por_segundo: float = 0
+    seed: int = 42
+
+    _sortear = PrivateAttr()
+
+    def model_post_init(self, __context: Any):
+        self._sortear = sorteador_latencia(self.latencia, random.Random(self.seed))
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-roteiro'
+
+    def bind_tools(self, tools: list, tool_choice: Any = None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _preencher(self, parametros: dict, texto: str) -> dict:
+        args = {}
+
+        for nome, campo in parametros.get('properties', {}).items():
+            if 'enum' in campo:
+                rota = next(
+                    (rota['valor'] for rota in self.roteiro.get('rotas', [])
+                     if rota['valor'] in campo['enum'] and re.search(rota['se'], texto, re.IGNORECASE)),
+                    campo['enum'][0],
+                )
+                args[nome] = rota
+            else:
+                vazios = {'string': texto, 'boolean': False, 'integer': 0, 'number': 0, 'array': [], 'object': {}}
+                args[nome] = vazios.get(campo.get('type'), texto)
+
+        return args
+
+    def _responder(self, messages: list, tools: list | None = None, tool_choice: Any = None) -> AIMessage:
+        texto = _ultimo_texto_paciente(messages)
+        chamada = None
+
+        if tools and tool_choice not in (None, 'auto', 'none'):
+            funcao = tools[0]['function']
+            chamada = (funcao['name'], self._preencher(funcao.get('parameters', {}), texto))
+
+        elif tools and isinstance(_ultima_conversa(messages), HumanMessage):
+            nomes = {tool['function']['name'] for tool in tools}
+            regra = next(
+                (regra for regra in self.roteiro.get('tools', [])
+                 if regra['tool'] in nomes and re.search(regra.get('se', ''), texto, re.IGNORECASE)),
+                None,
+            )
+            if regra:
+                args = json.loads(json.dumps(regra.get('args', {})).replace('{texto}', json.dumps(texto)[1:-1]))
+                chamada = (regra['tool'], args)
+
+        if chamada:
+            nome, args = chamada
+            metrics.incr(f'fake.tool.{nome}')
+            return AIMessage(
+                content='',
+                tool_calls=[{'name': nome, 'args': args, 'id': f'call_{uuid.uuid4().hex[:24]}', 'type': 'tool_call'}],
+                usage_metadata=_uso(messages, json.dumps(args)),
+            )
+
+        resposta = next(
+            (regra['resposta'] for regra in self.roteiro.get('respostas', [])
+             if re.search(regra.get('se', ''), texto, re.IGNORECASE)),
+            RESPOSTA_PADRAO,
+        ).replace('{texto}', texto)
+
+        return AIMessage(content=resposta, usage_metadata=_uso(messages, resposta))
+
+    def _espera(self) -> tuple[float, float]:
+        """Segundos até o primeiro token e entre tokens."""
+        metrics.incr('fake.chamadas')
+        por_token = 1 / self.tokens_por_segundo if self.tokens_por_segundo else 0.0
+        return self._sortear(), por_token
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._responder(messages, kwargs.get('tools'), kwargs.get('tool_choice'))
+        primeiro, por_token = self._espera()
+        time.sleep(primeiro + por_token * len(_em_chunks(message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._responder(messages, kwargs.get('tools'), kwargs.get('tool_choice'))
+        primeiro, por_token = self._espera()
+        await asyncio.sleep(primeiro + por_token * len(_em_chunks(message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._responder(messages, kwargs.get('tools'), kwargs.get('tool_choice'))
+        primeiro, por_token = self._espera()
+        time.sleep(primeiro)
+
+        for chunk in _em_chunks(message):
+            time.sleep(por_token)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._responder(messages, kwargs.get('tools'), kwargs.get('tool_choice'))
+        primeiro, por_token = self._espera()
+        await asyncio.sleep(primeiro)
+
+        for chunk in _em_chunks(message):
+            await asyncio.sleep(por_token)
+            yield ChatGenerationChunk(message=chunk)
+
+
+# -----------------------------
+# CASSETE (gravar uma vez, repetir sempre)
+# -----------------------------
+
+# Partes do prompt que mudam sozinhas com o relógio (ContextProvider):
+# não entram na chave da gravação
+RELOGIO = [
+    (re.compile(r'\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?( \| [^\n]+)?'), '<data>'),
+    (re.compile(r'\b\d{2}/\d{2}(/\d{4})?\b'), '<data>'),
+]
+
+
+def _sem_relogio(texto: str) -> str:
+    for padrao, marcador in RELOGIO:
+        texto = padrao.sub(marcador, texto)
+    return texto
+
+
+def chave_cassete(messages: list, tools: list | None = None, tool_choice: Any = None) -> str:
+    """Hash do pedido sem ids (mudam a cada execução) e sem data/hora."""
+    pedido = {
+        'messages': [
+            {
+                'type': message.type,
+                'content': _sem_relogio(message.text),
+                'tool_calls': [(call['name'], call['args']) for call in getattr(message, 'tool_calls', [])],
+            }
+            for message in messages
+        ],
+        'tools': tools or [],
+        'tool_choice': tool_choice,
+    }
+    return hashlib.sha256(json.dumps(pedido, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+class Fita:
+    """Arquivo do cassete: chave -> respostas gravadas, na ordem em que aconteceram."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._lidas = {}  # chave -> quantas vezes já foi repetida neste processo
+
+        try:
+            with open(caminho, encoding='utf-8') as arquivo:
+                self._interacoes = json.load(arquivo)['interacoes']
+        except FileNotFoundError:
+            self._interacoes = {}
+
+    def proxima(self, chave: str, gravando: bool) -> dict | None:
+        """
+        Próxima resposta gravada para a chave. Pedida mais vezes do que foi
+        gravada: gravando, None (grava mais uma); repetindo, a última.
+        """
+        with self._lock:
+            gravadas = self._interacoes.get(chave)
+            indice = self._lidas.get(chave, 0)
+
+            if not gravadas or (gravando and indice >= len(gravadas)):
+                return None
+
+            self._lidas[chave] = indice + 1
+            return gravadas[min(indice, len(gravadas) - 1)]
+
+    def gravar(self, chave: str, registro: dict):
+        with self._lock:
+            self._interacoes.setdefault(chave, []).append(registro)
+            self._lidas[chave] = len(self._interacoes[chave])
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+            temporario = f'{self.caminho}.tmp'
+            with open(temporario, 'w', encoding='utf-8') as arquivo:
+                json.dump({'versao': 1, 'interacoes': self._interacoes}, arquivo, ensure_ascii=False, indent=1)
+            os.replace(temporario, self.caminho)
+
+
+_fitas: dict[str, Fita] = {}
+_fitas_lock = threading.Lock()
+
+
+def _fita(caminho: str) -> Fita:
+    with _fitas_lock:
+        if caminho not in _fitas:
+            _fitas[caminho] = Fita(caminho)
+        return _fitas[caminho]
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Grava as respostas de um modelo real e as repete depois, sem rede.
+
+    COMO FUNCIONA:
+    - A chave é o pedido inteiro (mensagens, tools, tool_choice) sem ids e
+      sem data/hora; pedidos iguais repetem as respostas na ordem gravada
+    - modo 'record': chave sem gravação vai ao modelo real e entra no arquivo
+    - modo 'replay': chave sem gravação é erro (o graph mudou o que pede ao LLM)
+    - Com LLM_CASSETTE_LATENCIA=true espera o tempo que a chamada real levou
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    modelo: BaseChatModel | None = None
+    caminho: str
+    modo: str = 'replay'
+
+    @property
+    def _llm_type(self) -> str:
+        return 'cassete'
+
+    def bind_tools(self, tools: list, tool_choice: Any = None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _buscar(self, messages: list, tools: list | None, tool_choice: Any) -> tuple[str, dict | None]:
+        chave = chave_cassete(messages, tools, tool_choice)
+        gravada = _fita(self.caminho).proxima(chave, gravando=self.modo == 'record')
+
+        if gravada is not None:
+            metrics.incr('cassete.replays')
+            return chave, gravada
+
+        if self.modo != 'record' or self.modelo is None:
+            metrics.incr('cassete.misses')
+            raise LookupError(
+                f'Cassete {self.caminho} sem gravação para esta chamada '
+                f'(grave de novo com LLM_CASSETTE_MODE=record)'
+            )
+
+        return chave, None
+
+    def _alvo(self, tools: list | None, tool_choice: Any):
+        return self.modelo.bind_tools(tools, tool_choice=tool_choice) if tools else self.modelo
+
+    def _guardar(self, chave: str, message: AIMessage, duracao: float) -> AIMessage:
+        metrics.incr('cassete.gravacoes')
+        _fita(self.caminho).gravar(chave, {'message': message_to_dict(message), 'duracao': round(duracao, 3)})
+        return message
+
+    def _responder(self, messages, **kwargs) -> tuple[AIMessage, float]:
+        tools, tool_choice = kwargs.get('tools'), kwargs.get('tool_choice')
+        chave, gravada = self._buscar(messages, tools, tool_choice)
+
+        if gravada is None:
+            inicio = time.perf_counter()
+            message = self._alvo(tools, tool_choice).invoke(messages)
+            return self._guardar(chave, message, time.perf_counter() - inicio), 0.0
+
+        espera = gravada['duracao'] if LLM_CASSETTE_LATENCIA else 0.0
+        return messages_from_dict([gravada['message']])[0], espera
+
+    async def _aresponder(self, messages, **kwargs) -> tuple[AIMessage, float]:
+        tools, tool_choice = kwargs.get('tools'), kwargs.get('tool_choice')
+        chave, gravada = self._buscar(messages, tools, tool_choice)
+
+        if gravada is None:
+            inicio = time.perf_counter()
+            message = await self._alvo(tools, tool_choice).ainvoke(messages)
+            return self._guardar(chave, message, time.perf_counter() - inicio), 0.0
+
+        espera = gravada['duracao'] if LLM_CASSETTE_LATENCIA else 0.0
+        return messages_from_dict([gravada['message']])[0], espera
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, espera = self._responder(messages, **kwargs)
+        time.sleep(espera)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, espera = await self._aresponder(messages, **kwargs)
+        await asyncio.sleep(espera)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message, espera = self._responder(messages, **kwargs)
+        time.sleep(espera)
+        for chunk in _em_chunks(message):
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message, espera = await self._aresponder(messages, **kwargs)
+        await asyncio.sleep(espera)
+        for chunk in _em_chunks(message):
+            yield ChatGenerationChunk(message=chunk)
+
+
+# -----------------------------
+# EMBEDDINGS E TRANSCRIÇÃO FALSOS
+# -----------------------------
+
+def provedor_fake() -> bool:
+    """Com LLM_PROVIDER=fake nada chama a OpenAI: nem chat, nem embeddings, nem Whisper."""
+    return LLM_PROVIDER == 'fake'
+
+
+def embedding_falso(texto: str) -> list[float]:
+    """
+    Vetor determinístico para o provedor fake.
+
+    COMO FUNCIONA:
+    - Cada palavra (minúsculas) cai em uma dimensão pelo hash (hashing trick)
+    - O vetor é normalizado: textos com palavras em comum têm cosseno alto,
+      então cache, pré-roteador e busca do RAG se comportam de forma plausível
+    """
+    vetor = [0.0] * FAKE_EMBEDDING_DIMENSOES
+
+    for palavra in re.findall(r'\w+', texto.lower()) or [texto]:
+        digest = hashlib.blake2b(palavra.encode(), digest_size=8).digest()
+        indice = int.from_bytes(digest[:4], 'big') % FAKE_EMBEDDING_DIMENSOES
+        vetor[indice] += 1.0 if digest[4] % 2 else -1.0
+
+    norma = sum(valor * valor for valor in vetor) ** 0.5 or 1.0
+    return [valor / norma for valor in vetor]
+
+
+def transcricao_falsa(audio_data: bytes) -> str:
+    return LLM_FAKE_TRANSCRICAO
+
+
+# -----------------------------
+# FÁBRICA
+# -----------------------------
+
+def _carregar_roteiro() -> dict:
+    if not LLM_FAKE_SCRIPT:
+        return ROTEIRO_PADRAO
+
+    with open(LLM_FAKE_SCRIPT, encoding='utf-8') as arquivo:
+        return {**ROTEIRO_PADRAO, **json.load(arquivo)}
+
+
+def _criar_provedor(papel: str) -> BaseChatModel:
+    if LLM_PROVIDER == 'fake':
+        return FakeChatModel(
+            roteiro=_carregar_roteiro(),
+            latencia=LLM_FAKE_LATENCIA,
+            tokens_por_segundo=LLM_FAKE_TOKENS_POR_S,
+            seed=LLM_FAKE_SEED,
+        )
+
+    if LLM_PROVIDER == 'openai':
+        from langchain_openai import ChatOpenAI
+
+        if papel == 'resumo':
+            return ChatOpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                model=os.getenv('SUMMARY_MODEL', 'gpt-4.1-nano'),
+                temperature=0,
+            )
+
+        return ChatOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            model=os.getenv('OPENAI_MODEL', 'gpt-4.1'),
+            temperature=0,
+            stream_usage=True,
+        )
+
+    # Cerebras e Groq: o resumo usa o mesmo modelo (SUMMARY_MODEL é da OpenAI)
+    if LLM_PROVIDER == 'cerebras':
+        from langchain_cerebras import ChatCerebras
+
+        return ChatCerebras(api_key=os.getenv('CEREBRAS_API_KEY'), model=os.getenv('CEREBRAS_MODEL'), temperature=0)
+
+    if LLM_PROVIDER == 'groq':
+        from langchain_groq import ChatGroq
+
+        return ChatGroq(api_key=os.getenv('GROQ_API_KEY'), model=os.getenv('GROQ_MODEL'), temperature=0)
+
+    raise ValueError(f'LLM_PROVIDER desconhecido: {LLM_PROVIDER!r} (use openai, cerebras, groq ou fake)')
+
+
+def criar_llm(papel: str = 'principal') -> BaseChatModel:
+    """
+    Modelo de chat escolhido por env.
+
+    papel: 'principal' (agentes e orquestrador) ou 'resumo' (resumo da janela de contexto).
+    Com LLM_CASSETTE o modelo fica atrás do cassete; em replay nem é criado.
+    """
+    if LLM_CASSETTE and LLM_CASSETTE_MODE not in ('record', 'replay'):
+        raise ValueError(f'LLM_CASSETTE_MODE desconhecido: {LLM_CASSETTE_MODE!r} (use record ou replay)')
+
+    modelo = None if LLM_CASSETTE and LLM_CASSETTE_MODE == 'replay' else _criar_provedor(papel)
+
+    if LLM_CASSETTE:
+        print(f'📼 [LLM] Cassete {LLM_CASSETTE} em modo {LLM_CASSETTE_MODE} ({papel})')
+        return CassetteChatModel(modelo=modelo, caminho=LLM_CASSETTE, modo=LLM_CASSETTE_MODE)
+
+    if LLM_PROVIDER != 'openai':
+        print(f'🧠 [LLM] Provedor {LLM_PROVIDER} ({papel})')
+
+    return modelo
@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 from langgraph.checkpoint.postgres import PostgresSaver
-from src.db.connection import get_vector_conn
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from src.db.connection import get_vector_conn, release_vector_conn
 
 load_dotenv()
 
@@ -10,6 +12,9 @@ DB_URI = (
     f"@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
 )
 
+CHECKPOINTER_POOL_MIN = int(os.getenv('CHECKPOINTER_POOL_MIN', 1))
+CHECKPOINTER_POOL_MAX = int(os.getenv('CHECKPOINTER_POOL_MAX', 5))
+
 
 def get_checkpointer() -> PostgresSaver:
     """
@@ -22,6 +27,60 @@ def get_checkpointer() -> PostgresSaver:
     return PostgresSaver.from_conn_string(DB_URI)
 
 
+def _pool_reconnect_failed(pool: ConnectionPool):
+    print(f"❌ Pool do checkpointer ({pool.name}) não conseguiu reconectar ao PostgreSQL")
+
+
+def get_checkpointer_pool() -> ConnectionPool:
+    """
+    Cria o pool psycopg3 usado pelo PostgresSaver de longa duração.
+
+    - check_connection testa cada conexão antes de entregar: conexões
+      quebradas (restart do banco, idle timeout do proxy) são descartadas
+      e substituídas sem derrubar o job
+    - max_idle/max_lifetime reciclam conexões antigas
+    - As mesmas opções do from_conn_string (autocommit, dict_row,
+      sem prepared statements) exigidas pelo PostgresSaver
+    """
+    return ConnectionPool(
+        DB_URI,
+        name='checkpointer',
+        min_size=CHECKPOINTER_POOL_MIN,
+        max_size=CHECKPOINTER_POOL_MAX,
+        kwargs={
+            'autocommit': True,
+            'prepare_threshold': 0,
+            'row_factory': dict_row,
+        },
+        check=ConnectionPool.check_connection,
+        max_idle=300,
+        max_lifetime=1800,
+        reconnect_failed=_pool_reconnect_failed,
+        open=True,
+    )
+
+
+async def get_async_checkpointer_pool() -> AsyncConnectionPool:
+    """Mesmo pool do get_checkpointer_pool, para o AsyncPostgresSaver."""
+    pool = AsyncConnectionPool(
+        DB_URI,
+        name='checkpointer_async',
+        min_size=CHECKPOINTER_POOL_MIN,
+        max_size=CHECKPOINTER_POOL_MAX,
+        kwargs={
+            'autocommit': True,
+            'prepare_threshold': 0,
+            'row_factory': dict_row,
+        },
+        check=AsyncConnectionPool.check_connection,
+        max_idle=300,
+        max_lifetime=1800,
+        open=False,
+    )
+    await pool.open()
+    return pool
+
+
 def setup_checkpointer():
     """
     Cria as tabelas do checkpointer no PostgreSQL.
@@ -97,7 +156,7 @@ def cleanup_old_checkpoints(keep: int = 1):
 
     finally:
         cursor.close()
-        conn.close()
+        release_vector_conn(conn)
 
     # VACUUM fora da transação — recupera espaço físico em disco
     vacuum_conn = get_vector_conn()
@@ -113,7 +172,7 @@ def cleanup_old_checkpoints(keep: int = 1):
         print(f"❌ Erro no VACUUM: {e}")
     finally:
         vacuum_cursor.close()
-        vacuum_conn.close()
+        release_vector_conn(vacuum_conn)
 
 
 def cleanup_inactive_threads(days: int = 90):
@@ -184,7 +243,7 @@ def cleanup_inactive_threads(days: int = 90):
 
     finally:
         cursor.close()
-        conn.close()
+        release_vector_conn(conn)
 
     # VACUUM após deleção de threads completos
     vacuum_conn = get_vector_conn()
@@ -200,4 +259,4 @@ def cleanup_inactive_threads(days: int = 90):
         print(f"❌ Erro no VACUUM: {e}")
     finally:
         vacuum_cursor.close()
-        vacuum_conn.close()
\ No newline at end of file
+        release_vector_conn(vacuum_conn)
\ No newline at end of file
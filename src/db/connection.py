@@ -1,13 +1,29 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 from dotenv import load_dotenv
 
+from src.metrics.stats import get_metrics
+
 load_dotenv()
 
+# CONFIG DO POOL
+POOL_MIN_SIZE = int(os.getenv('POSTGRES_POOL_MIN', 1))
+POOL_MAX_SIZE = int(os.getenv('POSTGRES_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', 30))  # segundos esperando conexão livre
+POOL_HEALTHCHECK_IDLE = float(os.getenv('POSTGRES_POOL_HEALTHCHECK_IDLE', 30))  # testa conexões paradas há mais que isso
+POOL_MAX_LIFETIME = float(os.getenv('POSTGRES_POOL_MAX_LIFETIME', 1800))  # recicla conexões antigas
 
-def get_vector_conn():
+metrics = get_metrics('postgres_pool')
+
+
+def _connect():
     return psycopg2.connect(
         host=os.getenv('POSTGRES_HOST'),
         port=os.getenv('POSTGRES_PORT'),
@@ -16,3 +32,204 @@ def get_vector_conn():
         dbname=os.getenv('POSTGRES_DB'),
         cursor_factory=psycopg2.extras.RealDictCursor,
     )
+
+
+class ConnectionPool:
+    """
+    Pool de conexões psycopg2 compartilhado pelo processo.
+
+    COMO FUNCIONA:
+    - Mantém até max_size conexões abertas; quem pede além disso espera
+      (até POOL_TIMEOUT) uma conexão ser devolvida
+    - Conexões ociosas ficam numa pilha (LIFO) para reaproveitar as mais quentes
+    - Health check: conexão parada há mais de POOL_HEALTHCHECK_IDLE segundos
+      roda um SELECT 1 antes de ser entregue; se falhar é descartada
+    - Conexões são recicladas após POOL_MAX_LIFETIME segundos
+    - Ao devolver, transações abertas sofrem rollback e autocommit volta ao padrão
+    """
+
+    def __init__(self, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE):
+        self.min_size = min_size
+        self.max_size = max_size
+        self._idle = deque()  # (conn, criada_em, devolvida_em)
+        self._created_at = {}
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+        for _ in range(min_size):
+            conn = self._open()
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def _open(self):
+        conn = _connect()
+        self._created_at[id(conn)] = time.monotonic()
+        metrics.incr('connections_opened')
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        metrics.incr('connections_discarded')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created_at: float, returned_at: float) -> bool:
+        agora = time.monotonic()
+
+        if conn.closed or agora - created_at > POOL_MAX_LIFETIME:
+            return False
+
+        if agora - returned_at < POOL_HEALTHCHECK_IDLE:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            metrics.incr('healthcheck_failures')
+            return False
+
+    def getconn(self):
+        inicio = time.perf_counter()
+
+        if not self._slots.acquire(timeout=POOL_TIMEOUT):
+            metrics.incr('timeouts')
+            raise TimeoutError(
+                f'❌ Nenhuma conexão livre no pool após {POOL_TIMEOUT}s '
+                f'(max={self.max_size})'
+            )
+
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+
+                if item is None:
+                    conn = self._open()
+                    break
+
+                conn, created_at, returned_at = item
+                if self._healthy(conn, created_at, returned_at):
+                    break
+                self._discard(conn)
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+
+        metrics.observe('wait', time.perf_counter() - inicio)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    conn.close()
+                else:
+                    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    if conn.autocommit:
+                        conn.autocommit = False
+        except Exception:
+            conn.close()
+
+        with self._lock:
+            self._in_use -= 1
+            if conn.closed:
+                self._created_at.pop(id(conn), None)
+                metrics.incr('connections_discarded')
+            else:
+                self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+            }
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                conn.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool, _pool_pid
+
+    # Após um fork (work horse do RQ) as conexões herdadas não podem ser
+    # reaproveitadas nem fechadas: o filho cria o próprio pool.
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool()
+                _pool_pid = os.getpid()
+
+    return _pool
+
+
+def get_vector_conn():
+    """
+    Pega uma conexão emprestada do pool do processo.
+    Toda conexão obtida aqui DEVE voltar com release_vector_conn().
+    """
+    return _get_pool().getconn()
+
+
+def release_vector_conn(conn):
+    """Devolve ao pool uma conexão obtida com get_vector_conn()."""
+    if conn is not None:
+        _get_pool().putconn(conn)
+
+
+@contextmanager
+def vector_conn():
+    """
+    Context manager que empresta e devolve a conexão automaticamente:
+
+        with vector_conn() as conn:
+            ...
+    """
+    conn = get_vector_conn()
+    try:
+        yield conn
+    finally:
+        release_vector_conn(conn)
+
+
+def get_dedicated_conn():
+    """
+    Conexão própria, fora do pool, para quem a segura o tempo todo
+    (ex: LISTEN do índice do RAG). Quem abre fecha.
+    """
+    return _connect()
+
+
+def get_pool_stats() -> dict:
+    return {**_get_pool().stats(), **metrics.snapshot()}
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
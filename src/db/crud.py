@@ -1,8 +1,35 @@
 import json
 
+import psycopg2.extras
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 
-from src.db.connection import get_vector_conn
+from src.db.connection import get_vector_conn, release_vector_conn
+
+# Upsert do usuário + INSERT da mensagem recebida + status do cadastro
+# em um único round trip. Os CTEs enxergam o snapshot de antes do INSERT:
+# usuário novo vem de `novo`, usuário existente vem do SELECT em `users`.
+LOAD_USER_AND_SAVE_MESSAGE_SQL = """
+    WITH novo AS (
+        INSERT INTO users (phone_number, origin_contact)
+        VALUES (%(phone_number)s, %(origin_contact)s)
+        ON CONFLICT (phone_number) DO NOTHING
+        RETURNING complete_register, require_human
+    ),
+    mensagem AS (
+        INSERT INTO chat (session_id, sender, message)
+        SELECT %(phone_number)s, 'user', %(message)s::jsonb
+        WHERE %(message)s::jsonb IS NOT NULL
+    )
+    SELECT TRUE AS created, complete_register, require_human
+    FROM novo
+    UNION ALL
+    SELECT FALSE AS created, complete_register, require_human
+    FROM users
+    WHERE phone_number = %(phone_number)s
+"""
+
+# Usado se a query falhar: segue como cadastro incompleto (recepcionista)
+USUARIO_PADRAO = {'created': False, 'complete_register': False, 'require_human': False}
 
 
 class PostgreSQL:
@@ -28,7 +55,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def verify_cadastro(phone_number: str) -> bool:
@@ -53,7 +80,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def create_user(phone_number: str, origin_contact: str = 'whatsapp'):
@@ -77,7 +104,45 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def load_user_and_save_message(phone_number: str, message: dict | None, origin_contact: str = 'whatsapp') -> dict:
+        """
+        Prelúdio de cada turno em uma única query:
+        cria o usuário se ainda não existir, grava a mensagem recebida
+        (quando message não é None) e devolve o status do cadastro.
+
+        Returns:
+            {'created', 'complete_register', 'require_human'}
+        """
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                LOAD_USER_AND_SAVE_MESSAGE_SQL,
+                {
+                    'phone_number': phone_number,
+                    'origin_contact': origin_contact,
+                    'message': json.dumps(message) if message is not None else None,
+                },
+            )
+            row = cursor.fetchone()
+            conn.commit()
+
+            return dict(row) if row else dict(USUARIO_PADRAO)
+
+        except Exception as e:
+            conn.rollback()
+            # Propaga: sem a mensagem gravada o turno não pode seguir como se
+            # tivesse dado certo (o job falha e o RQ tenta de novo)
+            print(f'❌ Erro ao carregar usuário e salvar mensagem: {e}')
+            raise
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def update_user(
@@ -121,7 +186,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def finally_user(phone_number: str):
@@ -146,7 +211,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def update_require_human(phone_number: str):
@@ -171,7 +236,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def save_message(session_id: str, sender: str, message: dict, agent_name: str = None):
@@ -197,7 +262,39 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def archive_messages(session_id: str, messages: list[dict]) -> bool:
+        """
+        Guarda em chat_archive mensagens removidas do checkpoint
+        (formato do message_to_dict do LangChain), em um único INSERT.
+        """
+        if not messages:
+            return True
+
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            psycopg2.extras.execute_values(
+                cursor,
+                'INSERT INTO chat_archive (session_id, message) VALUES %s',
+                [(session_id, json.dumps(message)) for message in messages],
+            )
+
+            conn.commit()
+            print(f'📦 {len(messages)} mensagens arquivadas - {session_id}')
+            return True
+
+        except Exception as e:
+            conn.rollback()
+            print(f'❌ Erro ao arquivar mensagens: {e}')
+            return False
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_historico(number: str):
@@ -256,15 +353,14 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_file(categoria: str):
+        conn = get_vector_conn()
+        cursor = conn.cursor()
 
         try:
-            conn = get_vector_conn()
-            cursor = conn.cursor()
-
             query = """
                 SELECT category, filename, mediatype, path
                 FROM files
@@ -279,10 +375,8 @@ class PostgreSQL:
             return resultado
 
         finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+            cursor.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def save_calendar_event(
@@ -323,7 +417,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_calendar_events(user_number: str):
@@ -350,7 +444,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def delete_calendar_event(user_number: str, event_id: str):
@@ -381,7 +475,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_user_by_number(number: str):
@@ -406,7 +500,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_doctor_for_id(calendar_id: str):
@@ -431,7 +525,7 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def save_tokens(
@@ -442,6 +536,7 @@ class PostgreSQL:
         total_tokens: int,
         model_name: str | None = None,
         provider: str | None = None,
+        cached_tokens: int = 0,
     ):
         conn = get_vector_conn()
         cursor = conn.cursor()
@@ -456,9 +551,10 @@ class PostgreSQL:
                     output_tokens,
                     total_tokens,
                     model_name,
-                    provider
+                    provider,
+                    cached_tokens
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 """,
                 (
                     phone_number,
@@ -468,6 +564,7 @@ class PostgreSQL:
                     total_tokens,
                     model_name,
                     provider,
+                    cached_tokens,
                 ),
             )
 
@@ -479,7 +576,50 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def get_mensagens_rotuladas(limit: int = 2000):
+        """
+        Mensagens de pacientes já roteadas, com o agente que respondeu cada uma
+        (agent_name da primeira resposta da IA depois dela na mesma sessão).
+        Base de exemplos do pré-roteador.
+        """
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                SELECT h.message->>'content' AS texto, resposta.agent_name
+                FROM chat h
+                JOIN LATERAL (
+                    SELECT a.agent_name
+                    FROM chat a
+                    WHERE a.session_id = h.session_id
+                      AND a.sender = 'ai'
+                      AND a.id > h.id
+                    ORDER BY a.id
+                    LIMIT 1
+                ) resposta ON TRUE
+                WHERE h.sender = 'user'
+                  AND h.message->>'type' = 'human'
+                  AND resposta.agent_name IN ('rag', 'cache_rag', 'agendamento', 'orquestrador', 'pre_roteador')
+                ORDER BY h.id DESC
+                LIMIT %s
+                """,
+                (limit,),
+            )
+
+            return cursor.fetchall()
+
+        except Exception as e:
+            print(f'❌ Erro ao buscar mensagens rotuladas: {e}')
+            return []
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
 
     @staticmethod
     def get_rag(query_embedding: list, categoria: str = None, limit: int = 3):
@@ -490,7 +630,7 @@ class PostgreSQL:
             if categoria:
                 cursor.execute(
                     """
-                    SELECT content, category,
+                    SELECT id::text AS id, content, category,
                         embedding <=> %s::vector AS distance
                     FROM rag_embeddings
                     WHERE category = %s
@@ -502,7 +642,7 @@ class PostgreSQL:
             else:
                 cursor.execute(
                     """
-                    SELECT content, category,
+                    SELECT id::text AS id, content, category,
                         embedding <=> %s::vector AS distance
                     FROM rag_embeddings
                     ORDER BY distance
@@ -515,4 +655,154 @@ class PostgreSQL:
 
         finally:
             cursor.close()
-            conn.close()
\ No newline at end of file
+            release_vector_conn(conn)
+
+    @staticmethod
+    def get_rag_lexical(query: str, categoria: str = None, limit: int = 20):
+        """
+        Trechos que contêm termos da pergunta (full text em pt_unaccent),
+        do mais ao menos relevante. Termos em OU: a fusão com a busca
+        vetorial decide o que sobe.
+        """
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                SELECT id::text AS id, content, category,
+                    ts_rank_cd(content_tsv, q) AS rank
+                FROM rag_embeddings,
+                    replace(plainto_tsquery('pt_unaccent', %s)::text, '&', '|')::tsquery AS q
+                WHERE content_tsv @@ q
+                  AND (%s::text IS NULL OR category = %s)
+                ORDER BY rank DESC
+                LIMIT %s
+                """,
+                (query, categoria, categoria, limit)
+            )
+
+            return cursor.fetchall()
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def get_rag_rows(desde=None):
+        """
+        Linhas de rag_embeddings com o vetor como lista de floats (índice em memória).
+        Com `desde`, só as criadas a partir desse created_at.
+        """
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                SELECT id::text AS id, content, category,
+                    embedding::real[] AS embedding, created_at
+                FROM rag_embeddings
+                WHERE embedding IS NOT NULL
+                  AND (%s::timestamptz IS NULL OR created_at >= %s::timestamptz)
+                ORDER BY created_at
+                """,
+                (desde, desde)
+            )
+
+            return cursor.fetchall()
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def count_rag() -> int:
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('SELECT count(*) AS total FROM rag_embeddings WHERE embedding IS NOT NULL')
+            return cursor.fetchone()['total']
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def get_rag_fingerprint() -> str:
+        """Hash do conteúdo de rag_embeddings: muda em qualquer INSERT, UPDATE ou DELETE."""
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                SELECT COALESCE(md5(string_agg(id::text || md5(content), ',' ORDER BY id)), '') AS versao
+                FROM rag_embeddings
+                """
+            )
+
+            return cursor.fetchone()['versao']
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def get_rag_cache(embedding: list, fingerprint: str):
+        """Resposta em cache mais próxima da pergunta, na versão atual da base, com a similaridade."""
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                SELECT answer, 1 - (embedding <=> %s::vector) AS similaridade
+                FROM rag_answer_cache
+                WHERE fingerprint = %s
+                  AND expires_at > NOW()
+                ORDER BY embedding <=> %s::vector
+                LIMIT 1
+                """,
+                (embedding, fingerprint, embedding)
+            )
+
+            return cursor.fetchone()
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
+
+    @staticmethod
+    def save_rag_cache(question: str, answer: str, embedding: list, fingerprint: str, ttl: int):
+        """Guarda a resposta e, na mesma transação, apaga as expiradas e as de outra versão."""
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                """
+                DELETE FROM rag_answer_cache
+                WHERE expires_at <= NOW() OR fingerprint <> %s
+                """,
+                (fingerprint,)
+            )
+            cursor.execute(
+                """
+                INSERT INTO rag_answer_cache (question, answer, embedding, fingerprint, expires_at)
+                VALUES (%s, %s, %s::vector, %s, NOW() + make_interval(secs => %s))
+                """,
+                (question, answer, embedding, fingerprint, ttl)
+            )
+
+            conn.commit()
+            print('⚡ [RAG CACHE] Resposta guardada')
+
+        except Exception:
+            conn.rollback()
+            raise
+
+        finally:
+            cursor.close()
+            release_vector_conn(conn)
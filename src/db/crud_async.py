@@ -0,0 +1,197 @@
+import os
+
+from dotenv import load_dotenv
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from src.db.checkpointer import DB_URI
+from src.db.crud import LOAD_USER_AND_SAVE_MESSAGE_SQL, USUARIO_PADRAO
+
+load_dotenv()
+
+ASYNC_POOL_MIN = int(os.getenv('POSTGRES_ASYNC_POOL_MIN', 2))
+ASYNC_POOL_MAX = int(os.getenv('POSTGRES_ASYNC_POOL_MAX', 20))
+
+_pool: AsyncConnectionPool | None = None
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """
+    Pool psycopg3 assíncrono usado pelo worker asyncio.
+    Aberto sob demanda no event loop do worker e reaproveitado por todas as conversas.
+    """
+    global _pool
+
+    if _pool is None:
+        pool = AsyncConnectionPool(
+            DB_URI,
+            name='crud_async',
+            min_size=ASYNC_POOL_MIN,
+            max_size=ASYNC_POOL_MAX,
+            kwargs={'row_factory': dict_row},
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await pool.open()
+        _pool = pool
+
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+class AsyncPostgreSQL:
+    """
+    Versão assíncrona dos métodos do PostgreSQL usados a cada turno do graph.
+    Mesmas queries e mesmo tratamento de erro da versão síncrona (src/db/crud.py).
+    """
+
+    @staticmethod
+    async def load_user_and_save_message(phone_number: str, message: dict | None, origin_contact: str = 'whatsapp') -> dict:
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                cursor = await conn.execute(
+                    LOAD_USER_AND_SAVE_MESSAGE_SQL,
+                    {
+                        'phone_number': phone_number,
+                        'origin_contact': origin_contact,
+                        'message': Jsonb(message) if message is not None else None,
+                    },
+                )
+                row = await cursor.fetchone()
+                return dict(row) if row else dict(USUARIO_PADRAO)
+
+        except Exception as e:
+            # Mesmo contrato da versão síncrona: propaga para o job tentar de novo
+            print(f'❌ Erro ao carregar usuário e salvar mensagem: {e}')
+            raise
+
+    @staticmethod
+    async def update_require_human(phone_number: str):
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                await conn.execute(
+                    """
+                    UPDATE users
+                    SET require_human = %s
+                    WHERE phone_number = %s
+                    """,
+                    (True, phone_number),
+                )
+
+        except Exception as e:
+            print(f'❌ Erro ao atualizar require_human: {e}')
+
+    @staticmethod
+    async def save_message(session_id: str, sender: str, message: dict, agent_name: str = None):
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO chat (session_id, sender, agent_name, message)
+                    VALUES (%s, %s, %s, %s)
+                    """,
+                    (session_id, sender, agent_name, Jsonb(message)),
+                )
+            print('✅ Mensagem salva com sucesso')
+
+        except Exception as e:
+            print(f'❌ Erro ao salvar mensagem no banco: {e}')
+
+    @staticmethod
+    async def archive_messages(session_id: str, messages: list[dict]) -> bool:
+        if not messages:
+            return True
+
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(
+                        'INSERT INTO chat_archive (session_id, message) VALUES (%s, %s)',
+                        [(session_id, Jsonb(message)) for message in messages],
+                    )
+            print(f'📦 {len(messages)} mensagens arquivadas - {session_id}')
+            return True
+
+        except Exception as e:
+            print(f'❌ Erro ao arquivar mensagens: {e}')
+            return False
+
+    @staticmethod
+    async def get_user_by_number(number: str):
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                cursor = await conn.execute(
+                    """
+                    SELECT *
+                    FROM users
+                    WHERE phone_number = %s
+                    """,
+                    (number,),
+                )
+                return await cursor.fetchone()
+
+        except Exception as e:
+            print(f'❌ Erro ao buscar usuário: {e}')
+            return None
+
+    @staticmethod
+    async def save_tokens(
+        phone_number: str,
+        message_id: str | None,
+        input_tokens: int,
+        output_tokens: int,
+        total_tokens: int,
+        model_name: str | None = None,
+        provider: str | None = None,
+        cached_tokens: int = 0,
+    ):
+        pool = await get_async_pool()
+
+        try:
+            async with pool.connection() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO token_usage (
+                        phone_number,
+                        message_id,
+                        input_tokens,
+                        output_tokens,
+                        total_tokens,
+                        model_name,
+                        provider,
+                        cached_tokens
+                    )
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (
+                        phone_number,
+                        message_id,
+                        input_tokens,
+                        output_tokens,
+                        total_tokens,
+                        model_name,
+                        provider,
+                        cached_tokens,
+                    ),
+                )
+
+        except Exception as e:
+            print(f'❌ Erro ao salvar tokens: {e}')
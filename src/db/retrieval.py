@@ -0,0 +1,65 @@
+import os
+
+from dotenv import load_dotenv
+
+from src.db.crud import PostgreSQL
+from src.db.vector_index import indice_rag
+from src.metrics.stats import get_metrics
+
+load_dotenv()
+
+RAG_HYBRID_ENABLED = os.getenv('RAG_HYBRID_ENABLED', 'true').lower() == 'true'
+RAG_CANDIDATOS = int(os.getenv('RAG_CANDIDATOS', 20))  # trechos de cada busca que entram na fusão
+RRF_K = 60  # constante do reciprocal rank fusion: suaviza o peso das primeiras posições
+
+metrics = get_metrics('retrieval')
+
+
+def fundir_rrf(listas: list[list[dict]], limit: int, k: int = RRF_K) -> list[dict]:
+    """
+    Reciprocal rank fusion: cada trecho soma 1 / (k + posição) em cada lista
+    onde aparece. Só as posições importam, não as escalas das buscas.
+    """
+    scores = {}
+    trechos = {}
+
+    for lista in listas:
+        for posicao, trecho in enumerate(lista, start=1):
+            scores[trecho['id']] = scores.get(trecho['id'], 0.0) + 1 / (k + posicao)
+            trechos.setdefault(trecho['id'], trecho)
+
+    melhores = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [{**trechos[id_], 'score': scores[id_]} for id_ in melhores]
+
+
+def buscar_trechos(query: str, query_embedding: list, categoria: str = None, limit: int = 3) -> list[dict]:
+    """
+    Trechos da base de conhecimento para o buscar_rag.
+
+    COMO FUNCIONA:
+    - Vetorial: índice em memória (src/db/vector_index.py) ou, sem ele, Postgres
+    - Lexical: full text em português sem acento, acha termos exatos
+      (procedimentos, convênios, valores) que a busca vetorial deixa passar
+    - As duas listas de RAG_CANDIDATOS são fundidas por RRF; com
+      RAG_HYBRID_ENABLED=false ou erro na lexical, fica só a vetorial
+    """
+    candidatos = RAG_CANDIDATOS if RAG_HYBRID_ENABLED else limit
+
+    with metrics.timer('vetorial'):
+        vetoriais = indice_rag.buscar(query_embedding=query_embedding, categoria=categoria, limit=candidatos)
+        if vetoriais is None:
+            vetoriais = PostgreSQL.get_rag(query_embedding=query_embedding, categoria=categoria, limit=candidatos)
+
+    if not RAG_HYBRID_ENABLED:
+        return vetoriais
+
+    try:
+        with metrics.timer('lexical'):
+            lexicais = PostgreSQL.get_rag_lexical(query=query, categoria=categoria, limit=candidatos)
+
+    except Exception as e:
+        print(f'❌ [RETRIEVAL] Erro na busca lexical, seguindo só com a vetorial: {e}')
+        return vetoriais[:limit]
+
+    with metrics.timer('fusao'):
+        return fundir_rrf([vetoriais, lexicais], limit=limit)
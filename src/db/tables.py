@@ -1,10 +1,11 @@
 import time
 
-from src.db.connection import get_vector_conn
+from src.db.connection import get_vector_conn, release_vector_conn
 
 
 def create_tables(retries=10, delay=3):
     for attempt in range(1, retries + 1):
+        conn = None
         try:
             conn = get_vector_conn()
             cursor = conn.cursor()
@@ -35,6 +36,17 @@ def create_tables(retries=10, delay=3):
                 created_at TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'America/Sao_Paulo')
             );
 
+            -- Mensagens que saíram do checkpoint e não estão em chat (tool calls e resultados)
+            CREATE TABLE IF NOT EXISTS chat_archive (
+                id BIGSERIAL PRIMARY KEY,
+                session_id VARCHAR(20) NOT NULL,
+                message JSONB NOT NULL,
+                archived_at TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'America/Sao_Paulo')
+            );
+
+            CREATE INDEX IF NOT EXISTS chat_archive_session_idx
+            ON chat_archive (session_id, id);
+
             CREATE TABLE IF NOT EXISTS rag_embeddings (
                 id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
                 content TEXT NOT NULL,
@@ -50,6 +62,41 @@ def create_tables(retries=10, delay=3):
             CREATE INDEX IF NOT EXISTS rag_category_idx
             ON rag_embeddings (category);
 
+            -- Busca lexical (híbrida com a vetorial): português sem acentos.
+            -- unaccent() não é IMMUTABLE; via configuração de text search pode
+            -- ser usado na coluna gerada
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN
+                    CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese);
+                    ALTER TEXT SEARCH CONFIGURATION pt_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+                END IF;
+            END
+            $$;
+
+            ALTER TABLE rag_embeddings ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('pt_unaccent', content)) STORED;
+
+            CREATE INDEX IF NOT EXISTS rag_content_tsv_idx
+            ON rag_embeddings
+            USING GIN (content_tsv);
+
+            -- Respostas do agente rag reaproveitadas para perguntas parecidas
+            CREATE TABLE IF NOT EXISTS rag_answer_cache (
+                id BIGSERIAL PRIMARY KEY,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                embedding VECTOR(1536) NOT NULL,
+                fingerprint TEXT NOT NULL,
+                expires_at TIMESTAMPTZ NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'America/Sao_Paulo')
+            );
+
+            CREATE INDEX IF NOT EXISTS rag_answer_cache_embedding_idx
+            ON rag_answer_cache
+            USING hnsw (embedding vector_cosine_ops);
+
             CREATE TABLE IF NOT EXISTS files (
                 id SERIAL PRIMARY KEY,
                 category VARCHAR(100) NOT NULL,
@@ -84,9 +131,13 @@ def create_tables(retries=10, delay=3):
                 total_tokens INTEGER NOT NULL,
                 model_name TEXT,
                 provider TEXT,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
                 created_at TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'America/Sao_Paulo')
             );
 
+            -- Bancos criados antes da coluna de tokens em cache
+            ALTER TABLE token_usage ADD COLUMN IF NOT EXISTS cached_tokens INTEGER NOT NULL DEFAULT 0;
+
             CREATE TABLE IF NOT EXISTS doctor_rules (
                 id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
                 name VARCHAR(150) NOT NULL,
@@ -148,6 +199,20 @@ def create_tables(retries=10, delay=3):
             BEFORE UPDATE ON admin_users
             FOR EACH ROW EXECUTE FUNCTION set_updated_at();
 
+            -- Avisa os workers (índice em memória do RAG) que a base mudou
+            CREATE OR REPLACE FUNCTION notify_rag_embeddings()
+            RETURNS TRIGGER AS $$
+            BEGIN
+                PERFORM pg_notify('rag_embeddings', TG_OP);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS rag_embeddings_notify ON rag_embeddings;
+            CREATE TRIGGER rag_embeddings_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON rag_embeddings
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_rag_embeddings();
+
             -- ─── Índices ──────────────────────────────────────────────────────────────
             CREATE INDEX IF NOT EXISTS calendar_events_user_idx
             ON calendar_events (user_number);
@@ -174,7 +239,6 @@ def create_tables(retries=10, delay=3):
             cursor.execute(sql)
             conn.commit()
             cursor.close()
-            conn.close()
 
             print('✅ Banco inicializado com sucesso!')
             return
@@ -185,6 +249,9 @@ def create_tables(retries=10, delay=3):
             )
             time.sleep(delay)
 
+        finally:
+            release_vector_conn(conn)
+
     raise RuntimeError(
         '❌ Não foi possível conectar ao banco após várias tentativas'
     )
@@ -208,7 +275,7 @@ def clean_tables():
 
     finally:
         cursor.close()
-        conn.close()
+        release_vector_conn(conn)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+import os
+import select
+import threading
+import time
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+from src.db.connection import get_dedicated_conn
+from src.db.crud import PostgreSQL
+from src.metrics.stats import get_metrics
+
+try:
+    import numpy as np
+except ImportError:  # está no requirements.txt; sem ele a busca fica no Postgres
+    np = None
+    print('⚠️ [RAG INDEX] numpy não encontrado (pip install -r requirements.txt): índice em memória desativado')
+
+load_dotenv()
+
+RAG_INDEX_ENABLED = os.getenv('RAG_INDEX_ENABLED', 'true').lower() == 'true'
+RAG_INDEX_REFRESH = int(os.getenv('RAG_INDEX_REFRESH', 60))  # segundos sem NOTIFY até conferir a tabela
+MARGEM_CREATED_AT = timedelta(minutes=5)  # transações que commitaram depois de outras mais novas
+
+CANAL = 'rag_embeddings'
+
+metrics = get_metrics('rag_index')
+
+
+class _Snapshot:
+    """Estado imutável do índice: buscas leem um snapshot, a recarga troca por outro."""
+
+    def __init__(self, linhas: list[dict]):
+        self.linhas = linhas
+        self.ids = {linha['id'] for linha in linhas}
+        self.ultimo = max((linha['created_at'] for linha in linhas), default=None)
+
+        if not linhas:
+            self.matriz = None
+            self.mascaras = {}
+            return
+
+        matriz = np.array([linha['embedding'] for linha in linhas], dtype=np.float32).reshape(len(linhas), -1)
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        self.matriz = matriz / np.where(normas == 0, 1, normas)
+
+        categorias = np.array([linha['category'] for linha in linhas], dtype=object)
+        self.mascaras = {categoria: categorias == categoria for categoria in set(categorias)}
+
+
+class IndiceRAG:
+    """
+    Cópia em memória de rag_embeddings para a busca do buscar_rag.
+
+    COMO FUNCIONA:
+    - Matriz float32 com os vetores normalizados e uma máscara por categoria:
+      a busca top-k por cosseno é um produto matriz-vetor, sem ir ao banco
+    - Carrega em uma thread ao subir o worker; até lá buscar() devolve None
+      e o buscar_rag usa o Postgres (que continua sendo a fonte da verdade)
+    - A thread fica em LISTEN no canal do trigger de rag_embeddings:
+      INSERT traz só as linhas novas (created_at), UPDATE/DELETE/TRUNCATE
+      recarrega tudo. Sem NOTIFY por RAG_INDEX_REFRESH segundos, confere a
+      tabela mesmo assim (NOTIFY perdido em reconexão)
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ativo(self) -> bool:
+        return self._snapshot is not None
+
+    def iniciar(self):
+        if not RAG_INDEX_ENABLED:
+            return
+
+        if np is None:
+            print('⚠️ [RAG INDEX] numpy não instalado: busca do RAG segue no Postgres')
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._escutar, name='rag-index', daemon=True)
+                self._thread.start()
+
+    def _carregar_tudo(self):
+        with metrics.timer('carga_completa'):
+            self._snapshot = _Snapshot(PostgreSQL.get_rag_rows())
+
+        print(f'🧮 [RAG INDEX] {len(self._snapshot.linhas)} trechos carregados em memória')
+
+    def _carregar_novos(self):
+        atual = self._snapshot
+        desde = atual.ultimo - MARGEM_CREATED_AT if atual.ultimo else None
+
+        novas = [linha for linha in PostgreSQL.get_rag_rows(desde=desde) if linha['id'] not in atual.ids]
+        if novas:
+            self._snapshot = _Snapshot(atual.linhas + novas)
+            print(f'🧮 [RAG INDEX] +{len(novas)} trechos ({len(self._snapshot.linhas)} no total)')
+
+    def _sincronizar(self, operacoes: set[str]):
+        if operacoes - {'INSERT'}:
+            self._carregar_tudo()
+            return
+
+        self._carregar_novos()
+
+        # Apagou sem trigger (ou NOTIFY perdido): contagem não bate
+        if not operacoes and PostgreSQL.count_rag() != len(self._snapshot.linhas):
+            self._carregar_tudo()
+
+    def _escutar(self):
+        while True:
+            conn = None
+            try:
+                conn = get_dedicated_conn()
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {CANAL}')
+
+                self._carregar_tudo()
+
+                while True:
+                    operacoes = set()
+
+                    if select.select([conn], [], [], RAG_INDEX_REFRESH) != ([], [], []):
+                        conn.poll()
+                        operacoes = {notify.payload for notify in conn.notifies}
+                        conn.notifies.clear()
+
+                    self._sincronizar(operacoes)
+
+            except Exception as e:
+                print(f'❌ [RAG INDEX] Erro na sincronização, tentando de novo: {e}')
+                time.sleep(RAG_INDEX_REFRESH)
+
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def buscar(self, query_embedding: list, categoria: str = None, limit: int = 3) -> list[dict] | None:
+        """
+        Mesmo formato do PostgreSQL.get_rag (id, content, category, distance).
+        None se o índice não está carregado.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+
+        if not snapshot.linhas:
+            return []
+
+        with metrics.timer('busca'):
+            consulta = np.asarray(query_embedding, dtype=np.float32)
+            consulta /= np.linalg.norm(consulta) or 1
+
+            similaridades = snapshot.matriz @ consulta
+
+            if categoria is not None:
+                mascara = snapshot.mascaras.get(categoria)
+                if mascara is None:
+                    return []
+                similaridades = np.where(mascara, similaridades, -np.inf)
+
+            candidatas = min(limit, int(np.isfinite(similaridades).sum()))
+            if candidatas == 0:
+                return []
+
+            topo = np.argpartition(-similaridades, candidatas - 1)[:candidatas]
+            topo = topo[np.argsort(-similaridades[topo])]
+
+        return [
+            {
+                'id': snapshot.linhas[i]['id'],
+                'content': snapshot.linhas[i]['content'],
+                'category': snapshot.linhas[i]['category'],
+                'distance': float(1 - similaridades[i]),
+            }
+            for i in topo
+        ]
+
+
+indice_rag = IndiceRAG()
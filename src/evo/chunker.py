@@ -0,0 +1,91 @@
+import re
+
+# Parágrafos maiores que isso são enviados frase a frase
+MAX_PARAGRAFO = 300
+
+# Split inteligente: só quebra após ., !, ? seguidos de espaço
+FIM_DE_FRASE = re.compile(r'(?<=[.!?])\s+')
+SEPARADOR_PARAGRAFO = '\n\n'
+
+
+def _partes_do_paragrafo(paragrafo: str) -> list[str]:
+    paragrafo = paragrafo.strip()
+
+    if not paragrafo:
+        return []
+
+    # Se parágrafo > 300 chars, quebra em frases
+    if len(paragrafo) > MAX_PARAGRAFO:
+        return [frase.strip() for frase in FIM_DE_FRASE.split(paragrafo) if frase.strip()]
+
+    # Parágrafo curto: envia inteiro
+    return [paragrafo]
+
+
+def dividir_texto(text: str) -> list[str]:
+    """
+    Quebra a resposta nas partes enviadas ao WhatsApp:
+    um envio por parágrafo (blocos separados por \\n\\n) e,
+    em parágrafos > 300 chars, um por frase.
+    """
+    partes = []
+
+    for paragrafo in text.strip().split(SEPARADOR_PARAGRAFO):
+        partes.extend(_partes_do_paragrafo(paragrafo))
+
+    return partes
+
+
+class ChunkerStreaming:
+    """
+    Versão incremental do dividir_texto para o texto que chega
+    token a token do LLM.
+
+    COMO FUNCIONA:
+    - alimentar() recebe cada pedaço do stream e devolve as partes que
+      já estão completas (parágrafo fechado por \\n\\n)
+    - Se o parágrafo em andamento passa de 300 chars, ele certamente será
+      enviado frase a frase: as frases já terminadas saem na hora
+    - finalizar() devolve o que sobrou no fim da geração
+
+    A concatenação de tudo o que sai é igual a dividir_texto(texto_completo),
+    então as partes enviadas durante o stream são exatamente as primeiras
+    partes da mensagem final.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._em_frases = False  # parágrafo atual já passou de 300 chars
+
+    def alimentar(self, delta: str) -> list[str]:
+        self._buffer += delta
+        partes = []
+
+        while SEPARADOR_PARAGRAFO in self._buffer:
+            paragrafo, self._buffer = self._buffer.split(SEPARADOR_PARAGRAFO, 1)
+            partes.extend(self._fechar_paragrafo(paragrafo))
+
+        if not self._em_frases and len(self._buffer.strip()) > MAX_PARAGRAFO:
+            self._em_frases = True
+
+        if self._em_frases:
+            # Só a última frase pode estar incompleta: o resto já pode sair.
+            # Espaços no fim do buffer ficam para depois: podem virar um \n\n
+            corte = len(self._buffer.rstrip())
+            *completas, resto = FIM_DE_FRASE.split(self._buffer[:corte])
+            self._buffer = resto + self._buffer[corte:]
+            partes.extend(frase.strip() for frase in completas if frase.strip())
+
+        return partes
+
+    def finalizar(self) -> list[str]:
+        paragrafo, self._buffer = self._buffer, ''
+        return self._fechar_paragrafo(paragrafo)
+
+    def _fechar_paragrafo(self, paragrafo: str) -> list[str]:
+        em_frases, self._em_frases = self._em_frases, False
+
+        if em_frases:
+            return [frase.strip() for frase in FIM_DE_FRASE.split(paragrafo) if frase.strip()]
+
+        return _partes_do_paragrafo(paragrafo)
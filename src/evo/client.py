@@ -1,9 +1,16 @@
+import asyncio
 import os
+import time
 from src.db.crud import PostgreSQL
-import re
+from src.evo.chunker import dividir_texto
+from src.evo.dispatcher import OUTBOUND_DISPATCHER, enfileirar
+from src.metrics.stats import get_metrics
 
+import httpx
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 
@@ -15,6 +22,63 @@ instance_name = os.getenv('INSTANCE_NAME')
 
 headers = {'Content-Type': 'application/json', 'apikey': instance_token}
 
+# Transporte HTTP compartilhado pelo processo (keep-alive, sem handshake por mensagem)
+EVO_POOL_SIZE = int(os.getenv('EVO_POOL_SIZE', 10))  # conexões mantidas abertas com a Evolution
+EVO_RETRIES = int(os.getenv('EVO_RETRIES', 3))
+EVO_CONNECT_TIMEOUT = float(os.getenv('EVO_CONNECT_TIMEOUT', 3))
+EVO_READ_TIMEOUT = float(os.getenv('EVO_READ_TIMEOUT', 15))  # inclui o delay de digitação (até 3s)
+
+# Só repete o que com certeza não foi processado: falha de conexão
+# (retry de connect) e 429/503, recusas da própria Evolution. 502/504 vêm do
+# proxy e a mensagem pode já ter sido enviada ao paciente, assim como num 500:
+# ficam para quem chamou decidir.
+STATUS_RETRY = (429, 503)
+
+metrics = get_metrics('evolution')
+
+
+def _criar_session() -> requests.Session:
+    retry = Retry(
+        total=EVO_RETRIES,
+        connect=EVO_RETRIES,
+        read=0,
+        status=EVO_RETRIES,
+        status_forcelist=STATUS_RETRY,
+        allowed_methods=frozenset({'POST'}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EVO_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = _criar_session()
+
+
+def _payload_texto(number: str, text: str) -> dict:
+    return {
+        'number': number,
+        'text': text,
+        'delay': min(len(text) * 30, 3000),  # Simula digitação (max 3s)
+        'presence': 'composing',
+    }
+
+
+def _registrar(endpoint: str, inicio: float, erro: Exception | None):
+    metrics.observe(endpoint, time.perf_counter() - inicio)
+    metrics.incr('requests')
+
+    if erro is not None:
+        status = getattr(getattr(erro, 'response', None), 'status_code', None)
+        metrics.incr('errors')
+        metrics.incr(f'errors.{status or type(erro).__name__}')
+
 
 class EvolutionAPI:
     def __init__(self):
@@ -23,54 +87,34 @@ class EvolutionAPI:
         self.headers = headers
 
     def _post(self, endpoint: str, payload: dict) -> dict:
-        url = f'{self.base_url_evo}{endpoint}/{self.instance_name}'
-        response = requests.post(url=url, headers=self.headers, json=payload)
+        # Com o dispatcher ligado só enfileira: o envio sai pelo src/evo/dispatcher.py
+        if OUTBOUND_DISPATCHER:
+            return enfileirar(endpoint=endpoint, payload=payload, instance=self.instance_name)
+
+        return self._post_direto(endpoint=endpoint, payload=payload)
+
+    def _post_direto(self, endpoint: str, payload: dict, instance: str | None = None) -> dict:
+        url = f'{self.base_url_evo}{endpoint}/{instance or self.instance_name}'
+        inicio = time.perf_counter()
+        erro = None
+
+        try:
+            response = session.post(url=url, json=payload, timeout=(EVO_CONNECT_TIMEOUT, EVO_READ_TIMEOUT))
+            response.raise_for_status()
+            return response.json()
 
-        response.raise_for_status()
-        return response.json()
+        except Exception as e:
+            erro = e
+            raise
+
+        finally:
+            _registrar(endpoint, inicio, erro)
+
+    def sender_part(self, number: str, text: str) -> dict:
+        return self._post(endpoint='/message/sendText', payload=_payload_texto(number, text))
 
     def sender_text(self, number: str, text: str) -> list[dict]:
-        
-        # Remove apenas espaços em branco excessivos, mantém \n
-        texto = text.strip()
-        
-        # Divide por parágrafos (blocos separados por \n\n)
-        paragrafos = [p.strip() for p in texto.split('\n\n') if p.strip()]
-        
-        responses = []
-        
-        for paragrafo in paragrafos:
-            # Se parágrafo > 300 chars, quebra em frases
-            if len(paragrafo) > 300:
-                # Split inteligente: só quebra após ., !, ? seguidos de espaço
-                frases = re.split(r'(?<=[.!?])\s+', paragrafo)
-                
-                for frase in frases:
-                    if not frase.strip():
-                        continue
-                        
-                    payload = {
-                        'number': number,
-                        'text': frase.strip(),
-                        'delay': min(len(frase) * 30, 3000),  # Simula digitação (max 3s)
-                        'presence': 'composing',
-                    }
-                    
-                    response = self._post(endpoint='/message/sendText', payload=payload)
-                    responses.append(response)
-            else:
-                # Parágrafo curto: envia inteiro
-                payload = {
-                    'number': number,
-                    'text': paragrafo,
-                    'delay': min(len(paragrafo) * 30, 3000),
-                    'presence': 'composing',
-                }
-                
-                response = self._post(endpoint='/message/sendText', payload=payload)
-                responses.append(response)
-        
-        return responses
+        return [self.sender_part(number=number, text=parte) for parte in dividir_texto(text)]
 
     def sender_file(
         self,
@@ -228,5 +272,66 @@ class EvolutionAPI:
 
             print(f"✅ Admin {admin_numero} notificado sobre agendamento")
         except Exception as e:
-            print(f"❌ Erro ao notificar admin: {e}")       
+            print(f"❌ Erro ao notificar admin: {e}")
+
+
+class AsyncEvolutionAPI:
+    """
+    Mesmos envios do EvolutionAPI para os caminhos assíncronos (worker asyncio,
+    webhooks do FastAPI), sobre um httpx.AsyncClient com keep-alive.
+
+    O client é criado no primeiro uso, dentro do event loop que vai usá-lo,
+    e fechado com aclose() no encerramento do processo.
+    """
+
+    _client = None
+
+    def __init__(self):
+        self.base_url_evo = base_url_evo
+        self.instance_name = instance_name
+
+    @classmethod
+    def _get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                # requests ignora header None (apikey sem env); httpx não
+                headers={nome: valor for nome, valor in headers.items() if valor is not None},
+                timeout=httpx.Timeout(EVO_READ_TIMEOUT, connect=EVO_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=EVO_POOL_SIZE, max_keepalive_connections=EVO_POOL_SIZE),
+                # Retries do transporte cobrem só falhas de conexão
+                transport=httpx.AsyncHTTPTransport(retries=EVO_RETRIES),
+            )
+
+        return cls._client
+
+    @classmethod
+    async def aclose(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    async def _post(self, endpoint: str, payload: dict) -> dict:
+        if OUTBOUND_DISPATCHER:
+            return await asyncio.to_thread(enfileirar, endpoint=endpoint, payload=payload, instance=self.instance_name)
+
+        url = f'{self.base_url_evo}{endpoint}/{self.instance_name}'
+        inicio = time.perf_counter()
+        erro = None
+
+        try:
+            response = await self._get_client().post(url, json=payload)
+            response.raise_for_status()
+            return response.json()
+
+        except Exception as e:
+            erro = e
+            raise
+
+        finally:
+            _registrar(endpoint, inicio, erro)
+
+    async def sender_part(self, number: str, text: str) -> dict:
+        return await self._post(endpoint='/message/sendText', payload=_payload_texto(number, text))
 
+    async def sender_text(self, number: str, text: str) -> list[dict]:
+        return [await self.sender_part(number=number, text=parte) for parte in dividir_texto(text)]
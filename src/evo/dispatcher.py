@@ -0,0 +1,226 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from src.metrics.stats import get_metrics
+from src.redis.client_redis import redis_client
+
+load_dotenv()
+
+# Com o dispatcher ligado, quem envia mensagem (nós, tools, scheduler) só
+# enfileira; o envio à Evolution roda no processo `python -m src.evo.dispatcher`
+OUTBOUND_DISPATCHER = os.getenv('OUTBOUND_DISPATCHER', 'false').lower() == 'true'
+
+DISPATCH_CONCURRENCY = int(os.getenv('DISPATCH_CONCURRENCY', 8))  # números sendo atendidos ao mesmo tempo
+DISPATCH_RATE_GLOBAL = int(os.getenv('DISPATCH_RATE_GLOBAL', 20))  # envios por segundo para a Evolution
+DISPATCH_RATE_INSTANCE = int(os.getenv('DISPATCH_RATE_INSTANCE', 5))  # envios por segundo por instância
+DISPATCH_MAX_TENTATIVAS = int(os.getenv('DISPATCH_MAX_TENTATIVAS', 5))
+DISPATCH_LEASE = 120  # segundos que um número fica reservado por um dispatcher (se ele cair, outro assume)
+DISPATCH_POLL = 0.1  # segundos entre consultas quando não há número pronto
+BACKOFF_MAX = 60  # segundos
+DLQ_MAX = 1000  # itens guardados na dead-letter
+
+CHAVE_FILA = 'evo:out:fila:'  # lista FIFO por número
+CHAVE_PRONTOS = 'evo:out:prontos'  # zset número -> quando pode ser atendido
+CHAVE_DLQ = 'evo:out:dlq'
+CHAVE_TAXA = 'evo:out:taxa:'
+
+metrics = get_metrics('dispatcher')
+
+# RPUSH na fila do número + agenda o número (NX: não encurta reserva nem backoff)
+_enfileirar = redis_client.register_script("""
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[3])
+""")
+
+# Números prontos até agora, reservados por DISPATCH_LEASE segundos
+_reservar = redis_client.register_script("""
+local numeros = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, numero in ipairs(numeros) do
+    redis.call('ZADD', KEYS[1], ARGV[3], numero)
+end
+return numeros
+""")
+
+# Tira a mensagem da frente (opcionalmente para a DLQ) e solta ou reagenda o
+# número, tudo atômico: um RPUSH concorrente nunca fica sem agendamento
+_concluir = redis_client.register_script("""
+redis.call('LPOP', KEYS[1])
+if ARGV[3] ~= '' then
+    redis.call('LPUSH', KEYS[3], ARGV[3])
+    redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[4]) - 1)
+end
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+else
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+end
+""")
+
+# Janela fixa de 1s: conta o envio no global e na instância, ou não conta em nenhum
+_taxa = redis_client.register_script("""
+local global = redis.call('INCR', KEYS[1])
+local instancia = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[1], 2)
+redis.call('EXPIRE', KEYS[2], 2)
+if global > tonumber(ARGV[1]) or instancia > tonumber(ARGV[2]) then
+    redis.call('DECR', KEYS[1])
+    redis.call('DECR', KEYS[2])
+    return 0
+end
+return 1
+""")
+
+
+def enfileirar(endpoint: str, payload: dict, instance: str) -> dict:
+    """
+    Coloca um envio na fila do número (payload['number']).
+    Mensagens do mesmo número saem na ordem em que entraram.
+    """
+    numero = payload['number']
+    item = {
+        'id': str(uuid.uuid4()),
+        'endpoint': endpoint,
+        'payload': payload,
+        'instance': instance,
+        'tentativas': 0,
+        'criado_em': time.time(),
+    }
+
+    _enfileirar(keys=[f'{CHAVE_FILA}{numero}', CHAVE_PRONTOS], args=[json.dumps(item), time.time(), numero], client=redis_client)
+    metrics.incr('enfileirados')
+
+    return {'queued': True, 'id': item['id']}
+
+
+def _reagendar(numero: str, segundos: float):
+    redis_client.zadd(CHAVE_PRONTOS, {numero: time.time() + segundos})
+
+
+def _concluir_item(numero: str, item_dlq: dict | None = None):
+    _concluir(
+        keys=[f'{CHAVE_FILA}{numero}', CHAVE_PRONTOS, CHAVE_DLQ],
+        args=[numero, time.time(), json.dumps(item_dlq) if item_dlq else '', DLQ_MAX],
+        client=redis_client,
+    )
+
+
+def _liberar_taxa(instance: str) -> bool:
+    segundo = int(time.time())
+    return bool(_taxa(
+        keys=[f'{CHAVE_TAXA}global:{segundo}', f'{CHAVE_TAXA}{instance}:{segundo}'],
+        args=[DISPATCH_RATE_GLOBAL, DISPATCH_RATE_INSTANCE],
+        client=redis_client,
+    ))
+
+
+def _retentavel(erro: Exception) -> bool:
+    """Erro do cliente (4xx, menos 429) não melhora repetindo: vai direto para a DLQ."""
+    status = getattr(getattr(erro, 'response', None), 'status_code', None)
+    return status is None or status == 429 or status >= 500
+
+
+def processar_numero(numero: str, evo):
+    """
+    Envia a mensagem da frente da fila do número.
+
+    COMO FUNCIONA:
+    - Um número por vez (reserva no zset): a ordem das mensagens é mantida
+    - Limite de taxa estourado: reagenda para o próximo segundo, sem contar tentativa
+    - Falha: a mensagem continua na frente e o número volta com backoff
+      exponencial; depois de DISPATCH_MAX_TENTATIVAS (ou erro 4xx) vai para a DLQ
+      e a fila segue
+    - Sucesso: tira da fila e, se ainda há mensagens, o número volta como pronto
+    """
+    fila = f'{CHAVE_FILA}{numero}'
+    bruto = redis_client.lindex(fila, 0)
+
+    if bruto is None:
+        _concluir_item(numero)
+        return
+
+    item = json.loads(bruto)
+
+    if not _liberar_taxa(item['instance']):
+        metrics.incr('limitados')
+        _reagendar(numero, 1 - time.time() % 1)
+        return
+
+    try:
+        with metrics.timer('envio'):
+            evo._post_direto(endpoint=item['endpoint'], payload=item['payload'], instance=item['instance'])
+
+    except Exception as e:
+        item['tentativas'] += 1
+        item['erro'] = str(e)
+        metrics.incr('falhas')
+
+        if item['tentativas'] >= DISPATCH_MAX_TENTATIVAS or not _retentavel(e):
+            print(f'☠️ [DISPATCHER] {numero}: envio {item["id"]} para a DLQ após {item["tentativas"]} tentativa(s): {e}')
+            metrics.incr('dlq')
+            _concluir_item(numero, item_dlq=item)
+            return
+
+        espera = min(2 ** item['tentativas'], BACKOFF_MAX)
+        print(f'⚠️ [DISPATCHER] {numero}: falha no envio ({e}), nova tentativa em {espera}s')
+        redis_client.lset(fila, 0, json.dumps(item))
+        _reagendar(numero, espera)
+        return
+
+    metrics.incr('enviados')
+    metrics.observe('espera_fila', time.time() - item['criado_em'])
+    _concluir_item(numero)
+
+
+def main():
+    """
+    Processo que esvazia as filas de saída. Pode rodar mais de um:
+    cada número é reservado por um dispatcher de cada vez.
+
+    Rodar com:
+        python -m src.evo.dispatcher
+    """
+    # Import aqui: src/evo/client.py importa este módulo para enfileirar
+    from src.evo.client import EvolutionAPI
+
+    evo = EvolutionAPI()
+    em_andamento = set()
+
+    print(f'📤 [DISPATCHER] Pronto (concorrência {DISPATCH_CONCURRENCY}, '
+          f'{DISPATCH_RATE_GLOBAL}/s global, {DISPATCH_RATE_INSTANCE}/s por instância)')
+
+    with ThreadPoolExecutor(max_workers=DISPATCH_CONCURRENCY) as executor:
+        while True:
+            livres = DISPATCH_CONCURRENCY - len(em_andamento)
+            numeros = []
+
+            try:
+                if livres > 0:
+                    agora = time.time()
+                    numeros = _reservar(keys=[CHAVE_PRONTOS], args=[agora, livres, agora + DISPATCH_LEASE], client=redis_client)
+            except Exception as e:
+                print(f'❌ [DISPATCHER] Erro ao ler filas: {e}')
+
+            for numero in numeros:
+                futuro = executor.submit(_processar_seguro, numero, evo)
+                em_andamento.add(futuro)
+                futuro.add_done_callback(em_andamento.discard)
+
+            if not numeros:
+                time.sleep(DISPATCH_POLL)
+
+
+def _processar_seguro(numero: str, evo):
+    try:
+        processar_numero(numero, evo)
+    except Exception as e:
+        # Erro de Redis: a reserva expira e o número volta a ficar pronto
+        print(f'❌ [DISPATCHER] Erro ao processar fila de {numero}: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,16 @@
 from contextlib import asynccontextmanager
 from src.db.tables import create_tables
+from src.db.connection import close_pool, get_pool_stats
 from src.db.checkpointer import setup_checkpointer, cleanup_old_checkpoints, cleanup_inactive_threads
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
-from src.evo.client import EvolutionAPI
+from src.evo.client import AsyncEvolutionAPI
 from src.agent.audio_transcription import audio_transcription
 from src.db.crud import PostgreSQL
 from src.redis.buffer import adicionar_ao_buffer, iniciar_ouvinte_background
 from src.redis.rq import enqueue_agent_processing
 from apscheduler.schedulers.background import BackgroundScheduler
+from src.metrics.stats import snapshot_all
 
 
 async def processar_mensagens_agrupadas(numero: str, texto_final: str):
@@ -18,7 +20,9 @@ async def processar_mensagens_agrupadas(numero: str, texto_final: str):
         enqueue_agent_processing(numero, texto_final)
 
     except Exception as e:
+        # Propaga: o dispatcher do buffer devolve as mensagens para um novo flush
         print(f'❌ Erro ao enfileirar processamento para {numero}: {e}\n')
+        raise
 
 
 @asynccontextmanager
@@ -55,6 +59,8 @@ async def lifespan(app: FastAPI):
     yield
 
     scheduler.shutdown(wait=False)
+    close_pool()
+    await AsyncEvolutionAPI.aclose()
     print('🛑 Encerrando aplicação...')
 
 
@@ -154,8 +160,7 @@ async def scheduler_webhook(request: Request):
         print(f'📱 Número: {numero}')
         print(f'💬 Mensagem: {mensagem}')
 
-        evo = EvolutionAPI()
-        sender_message = evo.sender_text(number=numero, text=mensagem)
+        sender_message = await AsyncEvolutionAPI().sender_text(number=numero, text=mensagem)
 
         if sender_message:
             message_payload = {'type': 'ai', 'content': mensagem}
@@ -174,4 +179,11 @@ async def scheduler_webhook(request: Request):
 
 @app.get('/health')
 async def health_check():
-    return {'status': 'ok', 'message': 'Aplicação rodando com sucesso'}
\ No newline at end of file
+    return {'status': 'ok', 'message': 'Aplicação rodando com sucesso'}
+
+
+@app.get('/metrics')
+async def metrics():
+    # get_pool_stats() já inclui as métricas do grupo 'postgres_pool' de
+    # snapshot_all(): vem depois para não ser sobrescrito por ele
+    return {**snapshot_all(), 'postgres_pool': get_pool_stats()}
@@ -1,4 +1,5 @@
 import os
+import threading
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -12,9 +13,25 @@ class GoogleCalendarClient:
     def __init__(self, credentials_path="credentials.json", token_path="token.json"):
         self.credentials_path = credentials_path
         self.token_path = token_path
-        self.service = None
+        self._creds = None
+        self._local = threading.local()
         self._authenticate()
 
+    @property
+    def service(self):
+        """
+        Service do Google Calendar da thread atual.
+        O cliente HTTP do googleapiclient (httplib2) não é thread-safe e as
+        tools de uma mesma AIMessage rodam em paralelo: cada thread usa o seu.
+        """
+        service = getattr(self._local, 'service', None)
+
+        if service is None:
+            service = build("calendar", "v3", credentials=self._creds)
+            self._local.service = service
+
+        return service
+
     def _authenticate(self):
         """Autentica e cria o serviço do Google Calendar"""
         import json
@@ -57,7 +74,8 @@ class GoogleCalendarClient:
                         "ou forneça credentials.json localmente."
                     )
         
-        self.service = build("calendar", "v3", credentials=creds)
+        self._creds = creds
+        self._local.service = build("calendar", "v3", credentials=creds)
     
     def verificar(self, data_inicio: str, data_fim: str, calendar_id: str):
         """
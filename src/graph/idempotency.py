@@ -0,0 +1,105 @@
+from langchain_core.messages import ToolMessage
+
+from src.redis.client_redis import redis_client
+
+# Marcas de efeitos colaterais já executados em um turno.
+# Em um retry do job, os nós consultam a marca e pulam o que já foi feito
+# (mensagem salva, partes já enviadas no WhatsApp, consulta já agendada).
+CHAVE_EFEITO = 'graph:effect:'
+EFEITO_TTL = 86400  # segundos — bem mais que o tempo de vida de um job com retries
+
+# Tools que mexem em sistemas externos: o resultado fica guardado por tool_call_id
+# (enviar_arquivo manda o arquivo ao paciente pela Evolution)
+TOOLS_COM_EFEITO = {'agendar_consulta', 'cancelar_consulta', 'enviar_arquivo'}
+
+
+def chave_turno(state, etapa: str) -> str | None:
+    """
+    Chave da marca de uma etapa do turno atual.
+    Sem turn_id (graph chamado fora do worker) não há marca: o nó roda sempre.
+    """
+    turn_id = state.get('turn_id')
+    if not turn_id:
+        return None
+
+    return f'{CHAVE_EFEITO}{state["number"]}:{turn_id}:{etapa}'
+
+
+def chave_tool(tool_call_id: str) -> str:
+    return f'{CHAVE_EFEITO}tool:{tool_call_id}'
+
+
+def ja_executado(chave: str | None) -> str | None:
+    if chave is None:
+        return None
+
+    try:
+        return redis_client.get(chave)
+    except Exception as e:
+        # Redis fora do ar não pode travar a conversa: executa de novo
+        print(f'⚠️ [IDEMPOTÊNCIA] Falha ao ler marca {chave}: {e}')
+        return None
+
+
+def marcar_executado(chave: str | None, valor: str = '1'):
+    if chave is None:
+        return
+
+    try:
+        redis_client.set(chave, valor, ex=EFEITO_TTL)
+    except Exception as e:
+        print(f'⚠️ [IDEMPOTÊNCIA] Falha ao gravar marca {chave}: {e}')
+
+
+def separar_tool_calls(message) -> tuple[list[ToolMessage], object | None]:
+    """
+    Separa as tool calls de uma AIMessage em:
+    - resultados já guardados de tools com efeito (não rodam de novo)
+    - uma cópia da mensagem só com as tool calls que ainda precisam rodar
+      (None quando não sobra nenhuma)
+    """
+    prontas = []
+    pendentes = []
+
+    for call in message.tool_calls:
+        if call['name'] in TOOLS_COM_EFEITO:
+            resultado = ja_executado(chave_tool(call['id']))
+
+            if resultado is not None:
+                print(f'⏭️ [IDEMPOTÊNCIA] {call["name"]} já executada ({call["id"]}), reaproveitando resultado')
+                prontas.append(ToolMessage(content=resultado, tool_call_id=call['id'], name=call['name']))
+                continue
+
+        pendentes.append(call)
+
+    if not pendentes:
+        return prontas, None
+
+    return prontas, message.model_copy(update={'tool_calls': pendentes})
+
+
+def registrar_tool_results(message, resultados: list) -> list:
+    """
+    Guarda o resultado das tools com efeito e devolve os ToolMessages
+    na ordem das tool calls da AIMessage original.
+    """
+    nomes = {call['id']: call['name'] for call in message.tool_calls}
+
+    for resultado in resultados:
+        if nomes.get(resultado.tool_call_id) in TOOLS_COM_EFEITO and resultado.status != 'error':
+            marcar_executado(chave_tool(resultado.tool_call_id), str(resultado.content))
+
+    ordem = {call['id']: i for i, call in enumerate(message.tool_calls)}
+    return sorted(resultados, key=lambda r: ordem.get(r.tool_call_id, len(ordem)))
+
+
+def deve_retomar(snapshot, turn_id: str | None) -> bool:
+    """
+    True quando o último checkpoint da thread é uma execução interrompida
+    deste mesmo turno: o retry continua do nó que falhou (graph.invoke(None))
+    em vez de rodar o graph inteiro de novo.
+    """
+    if not turn_id or snapshot is None or not snapshot.next:
+        return False
+
+    return snapshot.values.get('turn_id') == turn_id
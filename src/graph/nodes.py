@@ -1,11 +1,19 @@
-from src.agent.agents import Agent
+import asyncio
+from src.agent.agents import Agent, llm_resumo
+from src.agent.context_window import mensagens_para_compactar, montar_pedido_resumo, pendentes_de_resumo, precisa_resumir
 from src.graph.states import NextAgent
 from src.db.crud import PostgreSQL
-from src.evo.client import EvolutionAPI
+from src.db.crud_async import AsyncPostgreSQL
+from src.evo.client import AsyncEvolutionAPI, EvolutionAPI
 from src.graph.states import State
-from src.graph.tools import Tools 
+from src.graph.tools import TOOL_MAX_CONCURRENCY, Tools, tool_metrics
+from src.evo.chunker import dividir_texto
+from src.graph.router import agente_fixo, atualizar_agente_fixo, pre_rotear
+from src.graph import rag_cache
+from src.graph.idempotency import chave_turno, ja_executado, marcar_executado, registrar_tool_results, separar_tool_calls
 from src.prompts.context_providers import ContextProvider
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, message_to_dict
+from langchain_core.runnables import RunnableConfig
 from src.prompts.get_prompts import get_prompt
 from dotenv import load_dotenv
 import os
@@ -17,72 +25,120 @@ PROMPT_RECEPCIONISTA = os.getenv("PROMPT_RECEPCIONISTA")
 PROMPT_RAG = os.getenv('PROMPT_RAG')
 PROMPT_ORQUESTRADOR = os.getenv('PROMPT_ORQUESTRADOR')
 
+# O orquestrador só escolhe o agente: precisa de bem menos histórico
+ORCAMENTO_ORQUESTRADOR = int(os.getenv('CONTEXT_TOKEN_BUDGET_ORQUESTRADOR', 2000))
+
 
 evo = EvolutionAPI()
+aevo = AsyncEvolutionAPI()
 
 class Nodes:
     
     @staticmethod
-    def node_verify_user(state: State):
-        number = state['number']
+    def _mensagem_recebida(state: State) -> dict | None:
+        """Mensagem do usuário a gravar no chat (None se não há ou se um retry já gravou)."""
+        messages = state['messages']
 
-        exist = PostgreSQL.verify_user(phone_number=number)
+        if not messages or ja_executado(chave_turno(state, 'save_msg_human')):
+            return None
 
-        if exist:
-            print(f'✅ Usuário {number} já existe')
-            return 'existent'
-        else:
+        return {'type': 'human', 'content': messages[-1].content}
+
+    @staticmethod
+    def _status_usuario(state: State, usuario: dict) -> dict:
+        number = state['number']
+
+        if usuario['created']:
             print(f'🆕 Novo Usuário {number}')
-            return 'new'
-        
+        else:
+            print(f'✅ Usuário {number} já existe')
+
+        return {
+            'complete_register': usuario['complete_register'],
+            'require_human': usuario['require_human'],
+        }
+
     @staticmethod
-    def node_verify_cadastro(state: State):
+    def node_preparar_usuario(state: State):
+        """
+        Entrada do graph: cria o usuário se for novo, grava a mensagem
+        recebida e carrega o status do cadastro no state, tudo em uma query.
+        Se o banco falhar, o erro sobe (o turno é refeito pelo retry do job)
+        e save_msg_human só é marcado depois da gravação confirmada.
+        """
         number = state['number']
-    
-        cadastro_completo = PostgreSQL.verify_cadastro(phone_number=number)
-        
-        if cadastro_completo:
+        message_payload = Nodes._mensagem_recebida(state)
+
+        usuario = PostgreSQL.load_user_and_save_message(phone_number=number, message=message_payload)
+        if message_payload is not None:
+            marcar_executado(chave_turno(state, 'save_msg_human'))
+
+        return Nodes._status_usuario(state, usuario)
+
+    @staticmethod
+    async def anode_preparar_usuario(state: State):
+        number = state['number']
+        message_payload = await asyncio.to_thread(Nodes._mensagem_recebida, state)
+
+        usuario = await AsyncPostgreSQL.load_user_and_save_message(phone_number=number, message=message_payload)
+        if message_payload is not None:
+            await asyncio.to_thread(marcar_executado, chave_turno(state, 'save_msg_human'))
+
+        return Nodes._status_usuario(state, usuario)
+
+    @staticmethod
+    def route_cadastro(state: State) -> str:
+        number = state['number']
+
+        if state.get('complete_register'):
             print(f'✅ Cadastro completo - {number}')
             return 'orquestrador'
         else:
             print(f'📝 Cadastro incompleto - {number}')
             return 'recepcionista'
-    
-    @staticmethod
-    def node_save_user(state: State):
-        number = state['number']
-
-        PostgreSQL.create_user(phone_number=number)
-
-        return state
 
     @staticmethod
-    def node_save_message_user(state: State):
-        messages = state['messages']
+    def node_save_message_ai(state: State):
+        message = state['messages']
         number = state['number']
+        name_agent = state['agent_name']
+        chave = chave_turno(state, 'save_msg_ai')
 
-        if messages:
-            ultima = messages[-1]
+        if message and not ja_executado(chave):
+            ultima = message[-1]
             conteudo = ultima.content
-            message_payload = {'type': 'human', 'content': conteudo}
-            PostgreSQL.save_message(session_id=number, sender='user', message=message_payload)
+            message_payload = {'type': 'ai', 'content': conteudo}
+            PostgreSQL.save_message(session_id=number, sender='ai', agent_name=name_agent, message=message_payload)
+            marcar_executado(chave)
 
         return state
-    
+
     @staticmethod
-    def node_save_message_ai(state: State):
+    async def anode_save_message_ai(state: State):
         message = state['messages']
         number = state['number']
         name_agent = state['agent_name']
+        chave = chave_turno(state, 'save_msg_ai')
 
-        if message:
+        if message and not await asyncio.to_thread(ja_executado, chave):
             ultima = message[-1]
             conteudo = ultima.content
             message_payload = {'type': 'ai', 'content': conteudo}
-            PostgreSQL.save_message(session_id=number, sender='ai', agent_name=name_agent, message=message_payload)
+            await AsyncPostgreSQL.save_message(session_id=number, sender='ai', agent_name=name_agent, message=message_payload)
+            await asyncio.to_thread(marcar_executado, chave)
 
         return state
 
+    @staticmethod
+    def _partes_transmitidas(state, message) -> int:
+        """Partes desta mensagem que o agente já enviou durante o stream (STREAM_TO_WHATSAPP)."""
+        streamed = state.get('streamed') or {}
+
+        if streamed.get('id') != message.id:
+            return 0
+
+        return streamed.get('parts', 0)
+
     @staticmethod
     def node_sender_message(state):
         messages = state['messages']
@@ -90,7 +146,38 @@ class Nodes:
 
         last_message = messages[-1]
         text = last_message.content
-        evo.sender_text(number=number, text=text)
+
+        # Conta as partes já entregues: um retry continua da primeira não enviada
+        chave = chave_turno(state, 'sender_message')
+        enviadas = max(int(ja_executado(chave) or 0), Nodes._partes_transmitidas(state, last_message))
+
+        for indice, parte in enumerate(dividir_texto(text)):
+            if indice < enviadas:
+                continue
+            evo.sender_part(number=number, text=parte)
+            marcar_executado(chave, str(indice + 1))
+
+        return state
+
+    @staticmethod
+    async def anode_sender_message(state):
+        messages = state['messages']
+        number = state['number']
+
+        last_message = messages[-1]
+        text = last_message.content
+
+        chave = chave_turno(state, 'sender_message')
+        enviadas = max(
+            int(await asyncio.to_thread(ja_executado, chave) or 0),
+            Nodes._partes_transmitidas(state, last_message),
+        )
+
+        for indice, parte in enumerate(dividir_texto(text)):
+            if indice < enviadas:
+                continue
+            await aevo.sender_part(number=number, text=parte)
+            await asyncio.to_thread(marcar_executado, chave, str(indice + 1))
 
         return state
 
@@ -106,13 +193,213 @@ class Nodes:
             return 'no'
         
     @staticmethod
-    def tool_node(state: State):
+    def _devolucao(message) -> dict:
+        """O especialista chamou encerrar_fluxo: a conversa volta para o orquestrador no próximo turno."""
+        if any(call['name'] == 'encerrar_fluxo' for call in message.tool_calls):
+            print('↩️ Especialista encerrou o fluxo')
+            return {'hand_back': True}
+
+        return {}
+
+    @staticmethod
+    def tool_node(state: State, config: RunnableConfig):
         print('🛠️ Executando ferramentas...')
         
         last_message = state['messages'][-1]
-        response = Tools.tool_node.invoke({'messages': [last_message]})
 
-        return {'messages': [last_message] + response['messages']}
+        # Tools com efeito que já rodaram neste turno (retry) não rodam de novo
+        resultados, pendente = separar_tool_calls(last_message)
+        if pendente is not None:
+            with tool_metrics.timer('tool_node'):
+                resultados += Tools.tool_node.invoke(
+                    {'messages': [pendente]},
+                    config={**config, 'max_concurrency': TOOL_MAX_CONCURRENCY},
+                )['messages']
+
+        return {
+            'messages': [last_message] + registrar_tool_results(last_message, resultados),
+            **Nodes._devolucao(last_message),
+        }
+
+    @staticmethod
+    async def atool_node(state: State, config: RunnableConfig):
+        print('🛠️ Executando ferramentas...')
+
+        last_message = state['messages'][-1]
+
+        resultados, pendente = await asyncio.to_thread(separar_tool_calls, last_message)
+        if pendente is not None:
+            with tool_metrics.timer('tool_node'):
+                resultados += (await Tools.tool_node.ainvoke({'messages': [pendente]}, config=config))['messages']
+
+        ordenados = await asyncio.to_thread(registrar_tool_results, last_message, resultados)
+        return {'messages': [last_message] + ordenados, **Nodes._devolucao(last_message)}
+
+    @staticmethod
+    def node_pre_roteador(state: State):
+        """
+        Tenta decidir o agente sem LLM (regras, agente fixo e embeddings, src/graph/router.py).
+        Sem decisão, limpa o next_agent do turno anterior e segue para o orquestrador.
+        """
+        decisao = pre_rotear(state['messages'][-1].content, agente_ativo=agente_fixo(state))
+
+        if decisao is None:
+            return {'next_agent': None}
+
+        return {'next_agent': decisao, 'agent_name': 'pre_roteador'}
+
+    @staticmethod
+    async def anode_pre_roteador(state: State):
+        decisao = await asyncio.to_thread(pre_rotear, state['messages'][-1].content, agente_fixo(state))
+
+        if decisao is None:
+            return {'next_agent': None}
+
+        return {'next_agent': decisao, 'agent_name': 'pre_roteador'}
+
+    @staticmethod
+    def _pedido_resumo(state: State):
+        pendentes = pendentes_de_resumo(state['messages'], state.get('summary_upto'))
+
+        if not precisa_resumir(pendentes):
+            return None, None
+
+        return montar_pedido_resumo(state.get('summary'), pendentes), pendentes[-1].id
+
+    @staticmethod
+    def node_resumir_contexto(state: State):
+        """
+        Fim do turno (a resposta já foi enviada): atualiza o resumo com as
+        mensagens que saíram da janela de contexto dos agentes.
+        Só chama o LLM quando acumulou RESUMO_MIN_TOKENS fora do resumo.
+        """
+        pedido, ultima = Nodes._pedido_resumo(state)
+        if pedido is None:
+            return {}
+
+        try:
+            resumo = llm_resumo.invoke(pedido).content
+            print(f'📝 [CONTEXTO] Resumo atualizado ({len(resumo)} chars)')
+            return {'summary': resumo, 'summary_upto': ultima}
+
+        except Exception as e:
+            # Sem resumo novo, tenta de novo no próximo turno
+            print(f'❌ [CONTEXTO] Erro ao resumir conversa: {e}')
+            return {}
+
+    @staticmethod
+    async def anode_resumir_contexto(state: State):
+        pedido, ultima = Nodes._pedido_resumo(state)
+        if pedido is None:
+            return {}
+
+        try:
+            resumo = (await llm_resumo.ainvoke(pedido)).content
+            print(f'📝 [CONTEXTO] Resumo atualizado ({len(resumo)} chars)')
+            return {'summary': resumo, 'summary_upto': ultima}
+
+        except Exception as e:
+            print(f'❌ [CONTEXTO] Erro ao resumir conversa: {e}')
+            return {}
+
+    @staticmethod
+    def _compactacao(state: State):
+        """
+        Mensagens que saem do checkpoint e, delas, as que precisam ir para o
+        chat_archive: pergunta do paciente e resposta final já estão em chat.
+        """
+        remover = mensagens_para_compactar(state['messages'], state.get('summary_upto'))
+        arquivar = [
+            message_to_dict(message)
+            for message in remover
+            if not isinstance(message, HumanMessage)
+            and not (isinstance(message, AIMessage) and not message.tool_calls)
+        ]
+        return remover, arquivar
+
+    @staticmethod
+    def node_compactar_estado(state: State):
+        """
+        Fim do turno: tira do checkpoint as mensagens antigas já resumidas,
+        para o tamanho do state não crescer com a vida do paciente.
+        Se o arquivamento falhar, nada é removido (tenta no próximo turno).
+        """
+        remover, arquivar = Nodes._compactacao(state)
+        if not remover:
+            return {}
+
+        chave = chave_turno(state, 'compactar_estado')
+        if not ja_executado(chave):
+            if not PostgreSQL.archive_messages(session_id=state['number'], messages=arquivar):
+                return {}
+            marcar_executado(chave)
+
+        print(f'🗜️ [CONTEXTO] {len(remover)} mensagens removidas do checkpoint')
+        return {'messages': [RemoveMessage(id=message.id) for message in remover]}
+
+    @staticmethod
+    async def anode_compactar_estado(state: State):
+        remover, arquivar = Nodes._compactacao(state)
+        if not remover:
+            return {}
+
+        chave = chave_turno(state, 'compactar_estado')
+        if not await asyncio.to_thread(ja_executado, chave):
+            if not await AsyncPostgreSQL.archive_messages(session_id=state['number'], messages=arquivar):
+                return {}
+            await asyncio.to_thread(marcar_executado, chave)
+
+        print(f'🗜️ [CONTEXTO] {len(remover)} mensagens removidas do checkpoint')
+        return {'messages': [RemoveMessage(id=message.id) for message in remover]}
+
+    @staticmethod
+    def node_cache_rag(state: State):
+        """
+        Antes do agente_rag: se uma pergunta parecida já foi respondida
+        (src/graph/rag_cache.py), envia a mesma resposta sem chamar LLM.
+        """
+        resposta = rag_cache.buscar_resposta(state['messages'][-1].content)
+
+        if resposta is None:
+            return {}
+
+        return {'messages': [AIMessage(content=resposta)], 'agent_name': 'cache_rag'}
+
+    @staticmethod
+    async def anode_cache_rag(state: State):
+        resposta = await asyncio.to_thread(rag_cache.buscar_resposta, state['messages'][-1].content)
+
+        if resposta is None:
+            return {}
+
+        return {'messages': [AIMessage(content=resposta)], 'agent_name': 'cache_rag'}
+
+    @staticmethod
+    def route_from_cache_rag(state: State) -> str:
+        return 'hit' if isinstance(state['messages'][-1], AIMessage) else 'miss'
+
+    @staticmethod
+    def node_guardar_cache_rag(state: State):
+        """Fim do turno: guarda a resposta do agente_rag para perguntas parecidas."""
+        rag_cache.guardar_resposta(state)
+        return {}
+
+    @staticmethod
+    async def anode_guardar_cache_rag(state: State):
+        await asyncio.to_thread(rag_cache.guardar_resposta, state)
+        return {}
+
+    @staticmethod
+    def node_fixar_agente(state: State):
+        """Fim do turno: mantém (ou solta) o especialista para o próximo turno."""
+        return atualizar_agente_fixo(state)
+
+    @staticmethod
+    def route_from_pre_roteador(state: State) -> str:
+        if state.get('next_agent') is None:
+            return 'orquestrador'
+
+        return state['next_agent'].next_agent
 
     @staticmethod
     def route_from_orquestrador(state: State) -> str:
@@ -126,9 +413,10 @@ class Nodes:
             llm=Tools.llm_with_tools_recepcionista,
             context_providers=[
                 ContextProvider.context_calendario,
-                ContextProvider.context_datetime,
-                ContextProvider.context_user_number
-            ]
+                ContextProvider.context_user_number,
+                ContextProvider.context_datetime
+            ],
+            stream_sender=evo.sender_part
         )
 
     @staticmethod
@@ -138,9 +426,13 @@ class Nodes:
             prompt=get_prompt(prompt_name=PROMPT_RAG),
             llm=Tools.llm_with_tools_rag,
             context_providers=[
-                ContextProvider.context_datetime,
-                ContextProvider.context_user_number
-            ]
+                ContextProvider.context_user_number,
+                ContextProvider.context_datetime
+            ],
+            stream_sender=evo.sender_part,
+            # Perguntas cacheáveis são respondidas sem dados do paciente:
+            # a resposta vai para o cache global (src/graph/rag_cache.py)
+            turno_isolado=rag_cache.turno_isolado,
         )
 
     @staticmethod
@@ -150,10 +442,11 @@ class Nodes:
             prompt=get_prompt(prompt_name=PROMPT_AGENDAMENTO),
             llm=Tools.llm_with_tools_agendamento,
             context_providers=[
-                ContextProvider.context_datetime,
+                ContextProvider.context_calendario,
                 ContextProvider.context_user_number,
-                ContextProvider.context_calendario
-            ]
+                ContextProvider.context_datetime
+            ],
+            stream_sender=evo.sender_part
         )
 
     @staticmethod
@@ -162,7 +455,8 @@ class Nodes:
             name="orquestrador",
             prompt=get_prompt(prompt_name=PROMPT_ORQUESTRADOR),
             llm=Tools.llm_orquestrador,
-            structured_schema=NextAgent
+            structured_schema=NextAgent,
+            token_budget=ORCAMENTO_ORQUESTRADOR
         )
 
     @staticmethod
@@ -174,9 +468,11 @@ class Nodes:
 
         try:
             PostgreSQL.update_require_human(phone_number=numero)
-            
-            evo = EvolutionAPI()
-            evo.notify_human(phone_number=numero, reason=motivo)
+
+            chave = chave_turno(state, 'chamar_humano')
+            if not ja_executado(chave):
+                evo.notify_human(phone_number=numero, reason=motivo)
+                marcar_executado(chave)
 
             return {'messages': [
                 AIMessage(
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.agent.embeddings import embed
+from src.db.crud import PostgreSQL
+from src.metrics.stats import get_metrics
+
+load_dotenv()
+
+RAG_CACHE_ENABLED = os.getenv('RAG_CACHE_ENABLED', 'true').lower() == 'true'
+RAG_CACHE_THRESHOLD = float(os.getenv('RAG_CACHE_THRESHOLD', 0.95))  # similaridade de cosseno mínima
+RAG_CACHE_TTL = int(os.getenv('RAG_CACHE_TTL', 86400))  # segundos de vida de cada resposta
+FINGERPRINT_TTL = 60  # segundos entre consultas da versão da base de conhecimento
+
+# O cache é compartilhado entre pacientes: por isso as perguntas elegíveis
+# são respondidas pelo agente_rag sem dados do paciente (turno_isolado)
+
+# Perguntas curtas ou que continuam a anterior ("e para criança?") dependem
+# da conversa: não consultam nem alimentam o cache
+MIN_PALAVRAS = 3
+CONTINUACAO = re.compile(r'^(e|mas|ent[aã]o|tamb[eé]m)\b')
+
+# Só respostas que vieram da base de conhecimento entram no cache;
+# enviar_arquivo tem efeito (manda o arquivo) e não pode ser pulado
+TOOLS_CACHEAVEIS = {'buscar_rag'}
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / 'prompts'
+ARQUIVOS_VERSIONADOS = ['business_rules.json', 'prompt_rag.j2']
+
+metrics = get_metrics('rag_cache')
+
+_fingerprint = None
+_fingerprint_em = 0.0
+_fingerprint_lock = threading.Lock()
+
+
+def fingerprint() -> str:
+    """
+    Versão do que gera as respostas do RAG: conteúdo de rag_embeddings,
+    business_rules.json e prompt_rag.j2. Respostas de outra versão não são
+    servidas (e são apagadas no próximo INSERT).
+    """
+    global _fingerprint, _fingerprint_em
+
+    with _fingerprint_lock:
+        if _fingerprint is not None and time.monotonic() - _fingerprint_em < FINGERPRINT_TTL:
+            return _fingerprint
+
+        versao = hashlib.sha256(PostgreSQL.get_rag_fingerprint().encode())
+        for arquivo in ARQUIVOS_VERSIONADOS:
+            versao.update((PROMPTS_DIR / arquivo).read_bytes())
+
+        _fingerprint = versao.hexdigest()
+        _fingerprint_em = time.monotonic()
+        return _fingerprint
+
+
+def elegivel(texto: str | None) -> bool:
+    if not RAG_CACHE_ENABLED or not texto:
+        return False
+
+    texto = texto.lower().strip()
+    return len(texto.split()) >= MIN_PALAVRAS and not CONTINUACAO.match(texto)
+
+
+def buscar_resposta(texto: str) -> str | None:
+    """Resposta guardada para uma pergunta parecida o bastante, ou None."""
+    if not elegivel(texto):
+        return None
+
+    try:
+        with metrics.timer('busca'):
+            encontrada = PostgreSQL.get_rag_cache(embedding=embed(texto), fingerprint=fingerprint())
+
+    except Exception as e:
+        print(f'❌ [RAG CACHE] Erro ao consultar cache: {e}')
+        return None
+
+    if encontrada and encontrada['similaridade'] >= RAG_CACHE_THRESHOLD:
+        metrics.incr('hits')
+        print(f'⚡ [RAG CACHE] Hit ({encontrada["similaridade"]:.3f}, acerto {metrics.ratio("hits", "misses"):.0%})')
+        return encontrada['answer']
+
+    metrics.incr('misses')
+    return None
+
+
+def _turno(messages: list) -> tuple[HumanMessage | None, list]:
+    """Última mensagem do paciente e o que o graph gerou depois dela."""
+    for indice in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[indice], HumanMessage):
+            return messages[indice], messages[indice + 1:]
+
+    return None, []
+
+
+def turno_isolado(state) -> list | None:
+    """
+    Mensagens com que o agente_rag responde uma pergunta cacheável: só a
+    pergunta e o que veio depois dela no turno (buscar_rag e resultados).
+
+    Sem histórico, resumo e context_providers (número do paciente, data):
+    a resposta sai da base de conhecimento e pode ser servida a qualquer
+    paciente. None quando a pergunta não é elegível (contexto completo).
+    """
+    pergunta, gerado = _turno(state['messages'])
+
+    if pergunta is None or not elegivel(pergunta.content):
+        return None
+
+    return [pergunta, *gerado]
+
+
+def guardar_resposta(state) -> bool:
+    """
+    Fim do turno: guarda a resposta do agente_rag se ela pode ser reaproveitada.
+
+    COMO FUNCIONA:
+    - Só turnos respondidos pelo agente rag (não os servidos pelo cache)
+    - A resposta tem que ter passado por buscar_rag e por nenhuma outra tool
+    - A pergunta tem que ser elegível (não é continuação da conversa): só
+      assim o agente_rag respondeu sem dados do paciente (turno_isolado)
+    """
+    if state.get('agent_name') != 'rag':
+        return False
+
+    pergunta, gerado = _turno(state['messages'])
+    if pergunta is None or not gerado or not elegivel(pergunta.content):
+        return False
+
+    tools = {call['name'] for message in gerado if isinstance(message, AIMessage) for call in message.tool_calls}
+    resposta = gerado[-1]
+
+    if not tools or not tools <= TOOLS_CACHEAVEIS or not isinstance(resposta, AIMessage) or not resposta.content:
+        return False
+
+    try:
+        PostgreSQL.save_rag_cache(
+            question=pergunta.content,
+            answer=resposta.content,
+            embedding=embed(pergunta.content),
+            fingerprint=fingerprint(),
+            ttl=RAG_CACHE_TTL,
+        )
+        return True
+
+    except Exception as e:
+        print(f'❌ [RAG CACHE] Erro ao guardar resposta: {e}')
+        return False
@@ -0,0 +1,281 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from src.agent.embeddings import embed, embed_batch
+from src.db.crud import PostgreSQL
+from src.graph.states import NextAgent
+from src.metrics.stats import get_metrics
+from src.redis.client_redis import redis_client
+
+load_dotenv()
+
+PRE_ROUTER_ENABLED = os.getenv('PRE_ROUTER_ENABLED', 'true').lower() == 'true'
+
+# Classificador por embeddings (nearest centroid)
+ROUTER_MIN_EXEMPLOS = int(os.getenv('ROUTER_MIN_EXEMPLOS', 20))  # por agente, para ter um centroide
+ROUTER_MAX_EXEMPLOS = int(os.getenv('ROUTER_MAX_EXEMPLOS', 2000))
+ROUTER_TEMPERATURA = float(os.getenv('ROUTER_TEMPERATURA', 0.02))  # softmax das similaridades
+CENTROIDES_TTL = 6 * 3600  # segundos até recalcular com as conversas novas
+CENTROIDES_RETRY = 600  # segundos entre tentativas quando ainda não há centroides
+
+# Agente fixo: conversas no meio de um fluxo (escolher médico, data,
+# confirmar) vão direto para o especialista, sem passar pelo orquestrador
+STICKY_AGENTS = set(filter(None, os.getenv('STICKY_AGENTS', 'agendamento').split(',')))
+STICKY_TTL = int(os.getenv('STICKY_TTL', 900))  # segundos desde o último turno do especialista
+STICKY_MAX_TURNOS = int(os.getenv('STICKY_MAX_TURNOS', 10))  # depois disso o orquestrador reavalia
+
+CHAVE_CENTROIDES = 'router:centroids'
+CHAVE_CENTROIDES_LOCK = 'router:centroids:lock'
+
+RULES_PATH = Path(__file__).resolve().parent.parent / 'prompts' / 'business_rules.json'
+
+# Quem respondeu a mensagem -> para onde ela foi roteada.
+# A resposta de chamar_humano é salva com o agent_name de quem roteou.
+ROTULOS = {
+    'rag': 'rag',
+    'cache_rag': 'rag',
+    'agendamento': 'agendamento',
+    'orquestrador': 'humano',
+    'pre_roteador': 'humano',
+}
+
+metrics = get_metrics('router')
+
+_centroides = None
+_centroides_em = 0.0
+_proxima_tentativa = 0.0
+_centroides_lock = threading.Lock()
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acento: as regras são escritas nesse formato."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=1)
+def carregar_roteamento() -> dict:
+    """Seção "roteamento" do business_rules.json com os padrões já compilados."""
+    with open(RULES_PATH, 'r', encoding='utf-8') as f:
+        roteamento = json.load(f).get('roteamento', {})
+
+    regras = [
+        {
+            'agente': regra['agente'],
+            'motivo': regra.get('motivo'),
+            'padroes': [re.compile(padrao) for padrao in regra['padroes']],
+        }
+        for regra in roteamento.get('regras', [])
+    ]
+
+    return {'limiar_confianca': roteamento.get('limiar_confianca', 0.85), 'regras': regras}
+
+
+def classificar_por_regras(texto: str) -> NextAgent | None:
+    """
+    Decide pelas regras de palavra-chave/regex.
+    Só decide quando todas as regras que casaram apontam para o mesmo agente:
+    "quero cancelar e saber o endereço" fica para o LLM.
+    """
+    texto = normalizar(texto)
+    casadas = [
+        regra
+        for regra in carregar_roteamento()['regras']
+        if any(padrao.search(texto) for padrao in regra['padroes'])
+    ]
+
+    if not casadas or len({regra['agente'] for regra in casadas}) > 1:
+        return None
+
+    regra = casadas[0]
+    return NextAgent(next_agent=regra['agente'], reason=regra['motivo'])
+
+
+def agente_fixo(state) -> str | None:
+    """Especialista que está conduzindo a conversa, se ainda não expirou."""
+    ativo = state.get('active_agent')
+
+    if not ativo or (state.get('active_agent_expires_at') or 0) < time.time():
+        return None
+
+    return ativo
+
+
+def atualizar_agente_fixo(state) -> dict:
+    """
+    Fim do turno: fixa o especialista que respondeu (se for um STICKY_AGENTS)
+    ou solta a conversa, se ele devolveu com a tool encerrar_fluxo,
+    se outro agente respondeu ou se o limite de turnos foi atingido.
+    """
+    agente = state.get('agent_name')
+    livre = {'active_agent': None, 'active_agent_expires_at': None, 'active_agent_turns': 0, 'hand_back': False}
+
+    if state.get('hand_back') or agente not in STICKY_AGENTS:
+        return livre
+
+    turnos = (state.get('active_agent_turns') or 0) + 1 if state.get('active_agent') == agente else 1
+
+    if turnos > STICKY_MAX_TURNOS:
+        return livre
+
+    return {
+        'active_agent': agente,
+        'active_agent_expires_at': time.time() + STICKY_TTL,
+        'active_agent_turns': turnos,
+        'hand_back': False,
+    }
+
+
+def _normalizar_vetor(vetor: list[float]) -> list[float]:
+    norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+    return [v / norma for v in vetor]
+
+
+def construir_centroides() -> dict[str, list[float]] | None:
+    """
+    Centroide (média normalizada dos embeddings) das mensagens já roteadas
+    para cada agente. None se rag ou agendamento não têm exemplos suficientes.
+    """
+    exemplos = {}
+    for row in PostgreSQL.get_mensagens_rotuladas(limit=ROUTER_MAX_EXEMPLOS):
+        if row['texto']:
+            exemplos.setdefault(ROTULOS[row['agent_name']], []).append(row['texto'])
+
+    # 'humano' só entra como concorrente se tiver exemplos suficientes:
+    # o classificador nunca decide por ele, só deixa de decidir
+    exemplos = {agente: textos for agente, textos in exemplos.items() if len(textos) >= ROUTER_MIN_EXEMPLOS}
+
+    if not {'rag', 'agendamento'} <= set(exemplos):
+        print(f'⚠️ [ROUTER] Exemplos insuficientes para o classificador: { {k: len(v) for k, v in exemplos.items()} }')
+        return None
+
+    centroides = {}
+    for agente, textos in exemplos.items():
+        vetores = embed_batch(textos)
+        media = [sum(coluna) / len(vetores) for coluna in zip(*vetores)]
+        centroides[agente] = _normalizar_vetor(media)
+
+    print(f'🧭 [ROUTER] Centroides calculados: { {k: len(v) for k, v in exemplos.items()} }')
+    return centroides
+
+
+def _recalcular_centroides():
+    # Um worker por vez recalcula; os outros continuam com o que têm (ou com o LLM)
+    if not redis_client.set(CHAVE_CENTROIDES_LOCK, 1, nx=True, ex=300):
+        return
+
+    try:
+        centroides = construir_centroides()
+        if centroides:
+            redis_client.set(CHAVE_CENTROIDES, json.dumps(centroides), ex=CENTROIDES_TTL)
+
+    except Exception as e:
+        print(f'❌ [ROUTER] Erro ao calcular centroides: {e}')
+
+    finally:
+        redis_client.delete(CHAVE_CENTROIDES_LOCK)
+
+
+def get_centroides() -> dict[str, list[float]] | None:
+    """
+    Centroides em memória, recarregados do Redis a cada CENTROIDES_TTL.
+    Se ainda não existem, dispara o cálculo em background e devolve None:
+    o turno atual não espera por isso.
+    """
+    global _centroides, _centroides_em, _proxima_tentativa
+
+    if _centroides is not None and time.monotonic() - _centroides_em < CENTROIDES_TTL:
+        return _centroides
+
+    with _centroides_lock:
+        if _centroides is not None and time.monotonic() - _centroides_em < CENTROIDES_TTL:
+            return _centroides
+
+        salvos = redis_client.get(CHAVE_CENTROIDES)
+        if salvos:
+            _centroides = json.loads(salvos)
+            _centroides_em = time.monotonic()
+        elif time.monotonic() >= _proxima_tentativa:
+            _proxima_tentativa = time.monotonic() + CENTROIDES_RETRY
+            threading.Thread(target=_recalcular_centroides, daemon=True).start()
+
+    return _centroides
+
+
+def classificar_por_embedding(texto: str) -> tuple[str, float] | None:
+    """Agente do centroide mais próximo e a confiança (softmax das similaridades)."""
+    centroides = get_centroides()
+    if not centroides:
+        return None
+
+    vetor = _normalizar_vetor(embed(texto))
+    similaridades = {
+        agente: sum(a * b for a, b in zip(vetor, centroide))
+        for agente, centroide in centroides.items()
+    }
+
+    maior = max(similaridades.values())
+    pesos = {agente: math.exp((sim - maior) / ROUTER_TEMPERATURA) for agente, sim in similaridades.items()}
+    agente = max(pesos, key=pesos.get)
+
+    return agente, pesos[agente] / sum(pesos.values())
+
+
+def pre_rotear(texto: str, agente_ativo: str | None = None) -> NextAgent | None:
+    """
+    Roteamento local antes do orquestrador LLM.
+
+    COMO FUNCIONA:
+    - Regras de business_rules.json: decisão na hora, confiança 1
+      (valem mesmo no meio de um fluxo: "qual o endereço?" sai do agendamento)
+    - Senão, se há um agente fixo (fluxo em andamento), segue com ele
+    - Senão, nearest centroid sobre embeddings de mensagens já roteadas:
+      decide se a confiança passar do limiar_confianca
+    - O classificador nunca decide 'humano' sozinho (precisa de motivo
+      e de julgamento): nesse caso, e abaixo do limiar, devolve None
+      e o orquestrador LLM decide
+    """
+    if not PRE_ROUTER_ENABLED or not texto:
+        return None if agente_ativo is None else NextAgent(next_agent=agente_ativo, reason='fluxo em andamento')
+
+    decisao = classificar_por_regras(texto)
+    if decisao is not None:
+        metrics.incr('hits')
+        metrics.incr('hits.regras')
+        print(f'🧭 [ROUTER] Regra -> {decisao.next_agent} (acerto {metrics.ratio("hits", "misses"):.0%})')
+        return decisao
+
+    if agente_ativo is not None:
+        metrics.incr('hits')
+        metrics.incr('hits.sticky')
+        print(f'🧭 [ROUTER] Fluxo em andamento -> {agente_ativo} (acerto {metrics.ratio("hits", "misses"):.0%})')
+        return NextAgent(next_agent=agente_ativo, reason='fluxo em andamento')
+
+    try:
+        with metrics.timer('embedding'):
+            resultado = classificar_por_embedding(texto)
+    except Exception as e:
+        print(f'❌ [ROUTER] Erro no classificador por embedding: {e}')
+        resultado = None
+
+    if resultado is not None:
+        agente, confianca = resultado
+
+        if agente != 'humano' and confianca >= carregar_roteamento()['limiar_confianca']:
+            metrics.incr('hits')
+            metrics.incr('hits.embedding')
+            print(f'🧭 [ROUTER] Embedding -> {agente} ({confianca:.2f}, acerto {metrics.ratio("hits", "misses"):.0%})')
+            return NextAgent(next_agent=agente, reason=f'pré-roteador (confiança {confianca:.2f})')
+
+    metrics.incr('misses')
+    print(f'🧭 [ROUTER] Sem decisão local, chamando orquestrador (acerto {metrics.ratio("hits", "misses"):.0%})')
+    return None
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import threading
+
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+from src.db.checkpointer import get_async_checkpointer_pool, get_checkpointer_pool
+from src.db.vector_index import indice_rag
+from src.graph.workflow import workflow
+
+
+class AgentRuntime:
+    """
+    Recursos do agente que vivem durante todo o processo do worker:
+    o graph compilado e o PostgresSaver apoiado em um pool de conexões.
+
+    COMO FUNCIONA:
+    - Na primeira chamada de get_graph() abre o pool e compila o graph
+    - As chamadas seguintes reaproveitam os dois (sem handshake nem compile por job)
+    - Se o processo foi forkado (work horse do RQ), o filho recria tudo:
+      conexões herdadas do pai não podem ser compartilhadas
+    """
+
+    _lock = threading.Lock()
+    _pid = None
+    _pool = None
+    _graph = None
+
+    @classmethod
+    def get_graph(cls):
+        if cls._graph is None or cls._pid != os.getpid():
+            with cls._lock:
+                if cls._graph is None or cls._pid != os.getpid():
+                    cls._pool = get_checkpointer_pool()
+                    checkpointer = PostgresSaver(cls._pool)
+                    cls._graph = workflow.compile(checkpointer=checkpointer)
+                    cls._pid = os.getpid()
+                    print(f'🟢 [RUNTIME] Graph compilado e pool do checkpointer aberto (pid {cls._pid})')
+
+        return cls._graph
+
+    @classmethod
+    def warmup(cls):
+        """Compila o graph, abre o pool e começa a carregar o índice do RAG antes do primeiro job."""
+        cls.get_graph()
+        indice_rag.iniciar()
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._pool is not None and cls._pid == os.getpid():
+                cls._pool.close()
+            cls._pool = None
+            cls._graph = None
+            cls._pid = None
+
+
+class AsyncAgentRuntime:
+    """
+    Equivalente assíncrono do AgentRuntime para o worker asyncio:
+    graph compilado uma vez com AsyncPostgresSaver sobre um AsyncConnectionPool.
+    """
+
+    _lock = asyncio.Lock()
+    _pool = None
+    _graph = None
+
+    @classmethod
+    async def get_graph(cls):
+        if cls._graph is None:
+            async with cls._lock:
+                if cls._graph is None:
+                    cls._pool = await get_async_checkpointer_pool()
+                    checkpointer = AsyncPostgresSaver(cls._pool)
+                    cls._graph = workflow.compile(checkpointer=checkpointer)
+                    print('🟢 [RUNTIME] Graph compilado com checkpointer assíncrono')
+
+        return cls._graph
+
+    @classmethod
+    async def close(cls):
+        if cls._pool is not None:
+            await cls._pool.close()
+        cls._pool = None
+        cls._graph = None
@@ -12,4 +12,14 @@ class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     number: str
     next_agent: Optional[NextAgent] = None
-    agent_name: Optional[str] = None
\ No newline at end of file
+    agent_name: Optional[str] = None
+    turn_id: Optional[str] = None
+    complete_register: Optional[bool] = None
+    require_human: Optional[bool] = None
+    streamed: Optional[dict] = None
+    active_agent: Optional[str] = None
+    active_agent_expires_at: Optional[float] = None
+    active_agent_turns: Optional[int] = None
+    hand_back: Optional[bool] = None
+    summary: Optional[str] = None
+    summary_upto: Optional[str] = None
\ No newline at end of file
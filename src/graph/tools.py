@@ -7,15 +7,46 @@ from src.evo.client import EvolutionAPI
 from src.agent.agents import llm
 from src.google_calendar.client_calendar import GoogleCalendarClient
 from src.db.crud import PostgreSQL
-from src.db.connection import get_vector_conn
+from src.db.connection import get_vector_conn, release_vector_conn
 from src.scheduler.schedulers import create_scheduler_message, delete_scheduler_message
-from openai import OpenAI
+from src.metrics.stats import get_metrics
+from src.agent.embeddings import embed
+from src.db.retrieval import buscar_trechos
 
 load_dotenv()
 
-client = OpenAI()
+# Máximo de tool calls de uma mesma AIMessage rodando ao mesmo tempo
+TOOL_MAX_CONCURRENCY = int(os.getenv('TOOL_MAX_CONCURRENCY', 4))
 
 calendar_client = GoogleCalendarClient()
+evo = EvolutionAPI()
+
+tool_metrics = get_metrics('tools')
+
+
+def _medir_tool(request, execute):
+    """Registra a latência de cada tool call (por nome da tool) no ToolNode."""
+    nome = request.tool_call['name']
+
+    with tool_metrics.timer(nome):
+        resultado = execute(request)
+
+    if getattr(resultado, 'status', None) == 'error':
+        tool_metrics.incr(f'{nome}.errors')
+
+    return resultado
+
+
+async def _amedir_tool(request, execute):
+    nome = request.tool_call['name']
+
+    with tool_metrics.timer(nome):
+        resultado = await execute(request)
+
+    if getattr(resultado, 'status', None) == 'error':
+        tool_metrics.incr(f'{nome}.errors')
+
+    return resultado
 
 
 class Tools:
@@ -110,14 +141,10 @@ class Tools:
               f"CATEGORIA: === {categoria} ==="
               )
         # Gera embedding
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query
-        )
-        query_embedding = response.data[0].embedding
+        query_embedding = embed(query)
         
-        # Busca no BD
-        results = PostgreSQL.get_rag(query_embedding=query_embedding, categoria=categoria)
+        # Busca híbrida: vetorial (índice em memória ou BD) + lexical, fundidas por RRF
+        results = buscar_trechos(query=query, query_embedding=query_embedding, categoria=categoria)
         
         if not results:
             return "Nenhuma informação encontrada."
@@ -140,7 +167,6 @@ class Tools:
             return f"Arquivo '{tipo}' não encontrado"
         print(f"DEBUG file_info: {dict(file_info)}")
         # Envia
-        evo = EvolutionAPI()
         evo.sender_file(
             numero=numero,
             media_type=file_info['mediatype'],
@@ -178,10 +204,11 @@ class Tools:
         convenio = user.get('convenio', None) if user else None
 
         print(f"Convênio: {convenio or 'Não informado'}")
+
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
         try:
-            conn = get_vector_conn()
-            cursor = conn.cursor()
-            
             query = """
                 SELECT id, name, calendar_id
                 FROM doctor_rules
@@ -223,7 +250,7 @@ class Tools:
         
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
    
     @tool(description="""
         Busca detalhes completos de um doutor específico após escolha do paciente.
@@ -261,10 +288,10 @@ class Tools:
         print("Ferramenta: =========== Buscar Detalhes do Doutor ===========")
         print(f"Doutor ID: {doutor_id}")
         
+        conn = get_vector_conn()
+        cursor = conn.cursor()
+
         try:
-            conn = get_vector_conn()
-            cursor = conn.cursor()
-            
             cursor.execute("""
                 SELECT 
                     id, name, calendar_id, procedures, duration,
@@ -301,7 +328,7 @@ class Tools:
         
         finally:
             cursor.close()
-            conn.close()
+            release_vector_conn(conn)
     
     @tool(description="""
         Verifica se um horário específico está livre ou ocupado na agenda.
@@ -404,7 +431,6 @@ class Tools:
                 description=description
             )
 
-            evo = EvolutionAPI()
             evo.notificar_admin_agendamento(
                 paciente_numero=number,
                 procedimento=procedimento,
@@ -509,7 +535,6 @@ class Tools:
 
             # Notifica Doutor sobre o Cancelamento
             doutor = PostgreSQL.get_doctor_for_id(calendar_id=calendar_id)
-            evo = EvolutionAPI()
             evo.notificar_admin_cancelamento(
                 paciente_numero=number,
                 doctor_number=doutor['doctor_number'],
@@ -526,12 +551,31 @@ class Tools:
             return f"Erro ao cancelar consulta: {str(e)}"
 
 
+    @tool(description="""
+        Encerra o fluxo atual e devolve a conversa para a triagem de assuntos.
+
+        Enquanto o fluxo está aberto, as próximas mensagens do paciente
+        chegam direto para você.
+
+        QUANDO USAR:
+        - Agendamento, cancelamento ou reagendamento concluído
+        - Paciente desistiu do agendamento
+        - Paciente mudou para um assunto que não é agendamento
+
+        Returns:
+            Confirmação; em seguida responda ao paciente normalmente
+    """)
+    def encerrar_fluxo() -> str:
+        print("Ferramenta: =========== Encerrar Fluxo ===========")
+        return "Fluxo encerrado. Responda ao paciente normalmente."
+
     tools_agendamento = [
         listar_doutores_disponiveis,
         buscar_detalhes_doutor,
         verificar_agenda,
         agendar_consulta,
-        cancelar_consulta
+        cancelar_consulta,
+        encerrar_fluxo
     ]
 
     tools_recepcionista = [
@@ -546,7 +590,9 @@ class Tools:
 
     tools = tools_recepcionista + tools_agendamento + tools_rag 
 
-    tool_node = ToolNode(tools)
+    # As tool calls de uma AIMessage rodam em paralelo (thread pool no invoke,
+    # asyncio.gather no ainvoke) e os resultados voltam na ordem das calls
+    tool_node = ToolNode(tools, wrap_tool_call=_medir_tool, awrap_tool_call=_amedir_tool)
 
     llm_with_tools_recepcionista = llm.bind_tools(tools_recepcionista)
     llm_with_tools_agendamento = llm.bind_tools(tools_agendamento)
@@ -1,41 +1,60 @@
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph
 
 from src.graph.nodes import Nodes
 from src.graph.states import State
 
+
+def _no(func, afunc, name: str | None = None) -> RunnableLambda:
+    """
+    Nó com duas implementações: func roda no graph.invoke (worker RQ)
+    e afunc no graph.ainvoke (worker asyncio), sem ocupar thread.
+    """
+    return RunnableLambda(func, afunc=afunc, name=name)
+
+
+def _agente(agent) -> RunnableLambda:
+    return _no(agent.__call__, agent.acall, name=f'agente_{agent.name}')
+
+
 workflow = StateGraph(State)
 
 
-workflow.add_node('verificar_user', lambda state: state)
-workflow.add_node('verificar_cadastro', lambda state: state)
-workflow.add_node('save_user', Nodes.node_save_user)
-workflow.add_node('save_msg_human', Nodes.node_save_message_user)
-workflow.add_node('sender_message', Nodes.node_sender_message)
-workflow.add_node('save_msg_ai', Nodes.node_save_message_ai)
-workflow.add_node('agente_recepcionista', Nodes.node_agent_recepcionista())
-workflow.add_node('agente_orquestrador', Nodes.node_agent_orquestrador())
-workflow.add_node('agente_rag', Nodes.node_agent_rag())
-workflow.add_node('agente_agendamento', Nodes.node_agent_agendamento())
-workflow.add_node('tool_node_recepcionista', Nodes.tool_node)
-workflow.add_node('tool_node_rag', Nodes.tool_node)
-workflow.add_node('tool_node_agendamento', Nodes.tool_node)
+workflow.add_node('preparar_usuario', _no(Nodes.node_preparar_usuario, Nodes.anode_preparar_usuario))
+workflow.add_node('sender_message', _no(Nodes.node_sender_message, Nodes.anode_sender_message))
+workflow.add_node('save_msg_ai', _no(Nodes.node_save_message_ai, Nodes.anode_save_message_ai))
+workflow.add_node('agente_recepcionista', _agente(Nodes.node_agent_recepcionista()))
+workflow.add_node('pre_roteador', _no(Nodes.node_pre_roteador, Nodes.anode_pre_roteador))
+workflow.add_node('agente_orquestrador', _agente(Nodes.node_agent_orquestrador()))
+workflow.add_node('cache_rag', _no(Nodes.node_cache_rag, Nodes.anode_cache_rag))
+workflow.add_node('agente_rag', _agente(Nodes.node_agent_rag()))
+workflow.add_node('agente_agendamento', _agente(Nodes.node_agent_agendamento()))
+workflow.add_node('tool_node_recepcionista', _no(Nodes.tool_node, Nodes.atool_node))
+workflow.add_node('tool_node_rag', _no(Nodes.tool_node, Nodes.atool_node))
+workflow.add_node('tool_node_agendamento', _no(Nodes.tool_node, Nodes.atool_node))
 workflow.add_node('chamar_humano', Nodes.node_chamar_humano)
+workflow.add_node('guardar_cache_rag', _no(Nodes.node_guardar_cache_rag, Nodes.anode_guardar_cache_rag))
+workflow.add_node('resumir_contexto', _no(Nodes.node_resumir_contexto, Nodes.anode_resumir_contexto))
+workflow.add_node('compactar_estado', _no(Nodes.node_compactar_estado, Nodes.anode_compactar_estado))
+workflow.add_node('fixar_agente', Nodes.node_fixar_agente)
 
-workflow.set_entry_point('verificar_user')
+workflow.set_entry_point('preparar_usuario')
 
 workflow.add_conditional_edges(
-    'verificar_user',
-    Nodes.node_verify_user,
-    {'new': 'save_user', 'existent': 'save_msg_human'},
+    'preparar_usuario',
+    Nodes.route_cadastro,
+    {'recepcionista': 'agente_recepcionista', 'orquestrador': 'pre_roteador'},
 )
 
-workflow.add_edge('save_user', 'save_msg_human')
-workflow.add_edge('save_msg_human', 'verificar_cadastro')
-
 workflow.add_conditional_edges(
-    'verificar_cadastro',
-    Nodes.node_verify_cadastro,
-    {'recepcionista': 'agente_recepcionista', 'orquestrador': 'agente_orquestrador'},
+    'pre_roteador',
+    Nodes.route_from_pre_roteador,
+    {
+        'orquestrador': 'agente_orquestrador',
+        'rag': 'cache_rag',
+        'agendamento': 'agente_agendamento',
+        'humano': 'chamar_humano'
+    },
 )
 
 workflow.add_conditional_edges(
@@ -48,12 +67,18 @@ workflow.add_conditional_edges(
     'agente_orquestrador',
     Nodes.route_from_orquestrador,
     {
-        'rag': 'agente_rag', 
+        'rag': 'cache_rag',
         'agendamento': 'agente_agendamento',
         'humano': 'chamar_humano'
      },
 )
 
+workflow.add_conditional_edges(
+    'cache_rag',
+    Nodes.route_from_cache_rag,
+    {'hit': 'sender_message', 'miss': 'agente_rag'},
+)
+
 workflow.add_conditional_edges(
     'agente_rag',
     Nodes.should_continue,
@@ -72,7 +97,11 @@ workflow.add_edge('tool_node_agendamento', 'agente_agendamento')
 
 workflow.add_edge('chamar_humano', 'sender_message')
 workflow.add_edge('sender_message', 'save_msg_ai')
-workflow.add_edge('save_msg_ai', END)
+workflow.add_edge('save_msg_ai', 'guardar_cache_rag')
+workflow.add_edge('guardar_cache_rag', 'resumir_contexto')
+workflow.add_edge('resumir_contexto', 'compactar_estado')
+workflow.add_edge('compactar_estado', 'fixar_agente')
+workflow.add_edge('fixar_agente', END)
 
 
 graph = workflow.compile()
\ No newline at end of file
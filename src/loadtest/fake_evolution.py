@@ -0,0 +1,279 @@
+import asyncio
+import base64
+import io
+import os
+import random
+import time
+import uuid
+import wave
+
+import httpx
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+# Evolution falsa para testes de carga e de integração locais.
+# Aponte a aplicação para ela com BASE_URL_EVO=http://localhost:8081
+FAKE_EVO_HOST = os.getenv('FAKE_EVO_HOST', '127.0.0.1')
+FAKE_EVO_PORT = int(os.getenv('FAKE_EVO_PORT', 8081))
+FAKE_EVO_WEBHOOK_URL = os.getenv('FAKE_EVO_WEBHOOK_URL', 'http://localhost:8000/webhook')
+
+MAX_REGISTROS = 100_000  # envios e eventos guardados em memória
+
+# Ajustável em tempo de execução por POST /_fake/config
+config = {
+    'latencia_ms': float(os.getenv('FAKE_EVO_LATENCIA_MS', 80)),  # média do tempo de resposta
+    'jitter_ms': float(os.getenv('FAKE_EVO_JITTER_MS', 30)),  # desvio padrão em torno da média
+    'taxa_erro': float(os.getenv('FAKE_EVO_TAXA_ERRO', 0)),  # fração dos envios que falham (0 a 1)
+    'status_erro': int(os.getenv('FAKE_EVO_STATUS_ERRO', 503)),
+    # A Evolution real segura a requisição durante o 'delay' de digitação do payload
+    'respeitar_delay': os.getenv('FAKE_EVO_RESPEITAR_DELAY', 'true').lower() == 'true',
+}
+
+enviados = []  # mensagens que a aplicação mandou para os pacientes
+eventos = []  # eventos que esta Evolution entregou no /webhook
+ouvintes = []  # funções chamadas com cada envio entregue (gerador de carga no mesmo processo)
+
+
+# -----------------------------
+# EVENTOS DE ENTRADA (paciente -> /webhook)
+# -----------------------------
+
+def _evento(numero: str, message_type: str, message: dict, from_me: bool = False) -> dict:
+    """Mesmo formato do messages.upsert da Evolution, no que o /webhook lê."""
+    return {
+        'event': 'messages.upsert',
+        'instance': os.getenv('INSTANCE_NAME', 'fake'),
+        'data': {
+            'key': {
+                'remoteJid': f'{numero}@s.whatsapp.net',
+                'fromMe': from_me,
+                'id': uuid.uuid4().hex[:20].upper(),
+            },
+            'pushName': f'Paciente {numero[-4:]}',
+            'messageType': message_type,
+            'message': message,
+            'messageTimestamp': int(time.time()),
+        },
+        'date_time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def evento_texto(numero: str, texto: str, from_me: bool = False) -> dict:
+    return _evento(numero, 'conversation', {'conversation': texto}, from_me=from_me)
+
+
+def evento_imagem(numero: str) -> dict:
+    return _evento(numero, 'imageMessage', {'imageMessage': {'mimetype': 'image/jpeg', 'caption': ''}})
+
+
+def evento_audio(numero: str, audio_base64: str | None = None, segundos: float = 1.0) -> dict:
+    audio_base64 = audio_base64 or audio_silencioso(segundos)
+    return _evento(numero, 'audioMessage', {
+        'audioMessage': {'mimetype': 'audio/wav', 'seconds': int(segundos)},
+        'base64': audio_base64,
+    })
+
+
+def audio_silencioso(segundos: float = 1.0) -> str:
+    """WAV mono 8 kHz em silêncio, em base64 (o /webhook manda para a transcrição)."""
+    buffer = io.BytesIO()
+
+    with wave.open(buffer, 'wb') as arquivo:
+        arquivo.setnchannels(1)
+        arquivo.setsampwidth(2)
+        arquivo.setframerate(8000)
+        arquivo.writeframes(b'\x00\x00' * int(8000 * segundos))
+
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+async def enviar_evento(client: httpx.AsyncClient, evento: dict, webhook_url: str = FAKE_EVO_WEBHOOK_URL) -> int:
+    """Entrega um evento no /webhook e registra quando saiu. Retorna o status HTTP."""
+    registro = {
+        'numero': evento['data']['key']['remoteJid'].split('@')[0],
+        'tipo': evento['data']['messageType'],
+        'from_me': evento['data']['key']['fromMe'],
+        'enviado_em': time.time(),
+    }
+
+    try:
+        response = await client.post(webhook_url, json=evento)
+        registro['status'] = response.status_code
+
+    except httpx.HTTPError as e:
+        registro['status'] = None
+        registro['erro'] = str(e)
+
+    registro['duracao_ms'] = round((time.time() - registro['enviado_em']) * 1000, 2)
+    _guardar(eventos, registro)
+    return registro['status']
+
+
+# -----------------------------
+# API FALSA (aplicação -> Evolution)
+# -----------------------------
+
+app = FastAPI(title='Evolution API (fake)')
+
+
+def _guardar(lista: list, registro: dict):
+    lista.append(registro)
+    if len(lista) > MAX_REGISTROS:
+        del lista[:len(lista) - MAX_REGISTROS]
+
+
+async def _simular_envio(request: Request, endpoint: str, instance: str) -> JSONResponse:
+    """
+    COMO FUNCIONA:
+    - Espera a latência sorteada (normal com média latencia_ms e desvio
+      jitter_ms) mais o 'delay' de digitação do payload, como a Evolution real
+    - Com probabilidade taxa_erro responde status_erro e não entrega nada
+    - Senão registra o envio e responde no formato da Evolution
+    """
+    recebido_em = time.time()
+    payload = await request.json()
+
+    espera_ms = max(0.0, random.gauss(config['latencia_ms'], config['jitter_ms']))
+    if config['respeitar_delay']:
+        espera_ms += payload.get('delay') or 0
+
+    await asyncio.sleep(espera_ms / 1000)
+
+    registro = {
+        'id': uuid.uuid4().hex[:20].upper(),
+        'endpoint': endpoint,
+        'instance': instance,
+        'numero': payload.get('number'),
+        'texto': payload.get('text') or payload.get('caption'),
+        'mediatype': payload.get('mediatype'),
+        'recebido_em': recebido_em,
+        'entregue_em': time.time(),
+    }
+
+    if random.random() < config['taxa_erro']:
+        registro['status'] = config['status_erro']
+        _guardar(enviados, registro)
+        return JSONResponse(
+            content={'status': config['status_erro'], 'error': 'erro injetado', 'response': {'message': ['fake']}},
+            status_code=config['status_erro'],
+        )
+
+    registro['status'] = 201
+    _guardar(enviados, registro)
+
+    for ouvinte in ouvintes:
+        ouvinte(registro)
+
+    return JSONResponse(
+        content={
+            'key': {'remoteJid': f'{registro["numero"]}@s.whatsapp.net', 'fromMe': True, 'id': registro['id']},
+            'message': {'conversation': registro['texto']},
+            'messageTimestamp': int(registro['entregue_em']),
+            'status': 'PENDING',
+        },
+        status_code=201,
+    )
+
+
+@app.post('/message/sendText/{instance}')
+async def send_text(instance: str, request: Request):
+    return await _simular_envio(request, '/message/sendText', instance)
+
+
+@app.post('/message/sendMedia/{instance}')
+async def send_media(instance: str, request: Request):
+    return await _simular_envio(request, '/message/sendMedia', instance)
+
+
+# -----------------------------
+# CONTROLE DO TESTE
+# -----------------------------
+
+@app.get('/_fake/enviados')
+async def listar_enviados(numero: str | None = None, desde: float = 0):
+    """Envios (com e sem erro) na ordem em que foram respondidos, opcionalmente de um número."""
+    return [
+        registro for registro in enviados
+        if registro['recebido_em'] >= desde and (numero is None or registro['numero'] == numero)
+    ]
+
+
+@app.get('/_fake/eventos')
+async def listar_eventos(numero: str | None = None, desde: float = 0):
+    return [
+        registro for registro in eventos
+        if registro['enviado_em'] >= desde and (numero is None or registro['numero'] == numero)
+    ]
+
+
+@app.get('/_fake/stats')
+async def stats():
+    entregues = [registro for registro in enviados if registro['status'] == 201]
+    duracao = entregues[-1]['entregue_em'] - entregues[0]['recebido_em'] if entregues else 0
+
+    return {
+        'config': config,
+        'enviados': len(entregues),
+        'erros': len(enviados) - len(entregues),
+        'numeros': len({registro['numero'] for registro in entregues}),
+        'envios_por_segundo': round(len(entregues) / duracao, 2) if duracao else 0.0,
+        'eventos': len(eventos),
+    }
+
+
+@app.post('/_fake/config')
+async def atualizar_config(request: Request):
+    novos = await request.json()
+    desconhecidos = set(novos) - set(config)
+    if desconhecidos:
+        return JSONResponse(content={'erro': f'chaves desconhecidas: {sorted(desconhecidos)}'}, status_code=400)
+
+    for chave, valor in novos.items():
+        if isinstance(config[chave], bool):
+            config[chave] = valor if isinstance(valor, bool) else str(valor).lower() == 'true'
+        else:
+            config[chave] = type(config[chave])(valor)
+
+    print(f'⚙️ [FAKE EVO] Config: {config}')
+    return config
+
+
+@app.post('/_fake/reset')
+async def resetar():
+    enviados.clear()
+    eventos.clear()
+    return {'status': 'ok'}
+
+
+@app.post('/_fake/inbound')
+async def inbound(request: Request):
+    """
+    Entrega no /webhook um evento sintético, para testar com curl:
+    {"numero": "5511999990000", "tipo": "texto" | "audio" | "imagem", "texto": "...", "from_me": false}
+    """
+    pedido = await request.json()
+    numero = pedido['numero']
+    tipo = pedido.get('tipo', 'texto')
+
+    if tipo == 'audio':
+        evento = evento_audio(numero, pedido.get('base64'))
+    elif tipo == 'imagem':
+        evento = evento_imagem(numero)
+    else:
+        evento = evento_texto(numero, pedido.get('texto', 'Olá'), from_me=pedido.get('from_me', False))
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        status = await enviar_evento(client, evento, webhook_url=pedido.get('webhook_url', FAKE_EVO_WEBHOOK_URL))
+
+    return {'status': status}
+
+
+if __name__ == '__main__':
+    # Rodar com:
+    #     python -m src.loadtest.fake_evolution
+    print(f'🧪 [FAKE EVO] Evolution falsa em http://{FAKE_EVO_HOST}:{FAKE_EVO_PORT} (webhook: {FAKE_EVO_WEBHOOK_URL})')
+    uvicorn.run(app, host=FAKE_EVO_HOST, port=FAKE_EVO_PORT, log_level='warning')
@@ -0,0 +1,465 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import uvicorn
+from dotenv import load_dotenv
+from redis import Redis
+from rq import Queue
+from rq.registry import StartedJobRegistry
+
+from src.loadtest import fake_evolution
+from src.loadtest.fake_evolution import enviar_evento, evento_audio, evento_imagem, evento_texto
+
+load_dotenv()
+
+PERCENTIS = (50, 90, 95, 99)
+BARRAS = '▁▂▃▄▅▆▇█'
+
+# Frases de paciente: cada rajada junta algumas, como quem digita em pedaços
+SAUDACOES = ['oi', 'olá', 'bom dia', 'boa tarde', 'oi, tudo bem?']
+PEDIDOS = [
+    'queria marcar uma consulta',
+    'vocês atendem pelo convênio unimed?',
+    'qual o valor da consulta particular?',
+    'tem horário para semana que vem?',
+    'preciso remarcar meu horário',
+    'quais procedimentos vocês fazem?',
+    'qual o endereço da clínica?',
+    'pode ser na quinta de manhã',
+    'meu nome é Maria da Silva',
+    'quero cancelar minha consulta de amanhã',
+]
+COMPLEMENTOS = ['é urgente', 'obrigado', 'pode ser qualquer horário', 'de preferência à tarde', 'ok']
+
+
+# -----------------------------
+# PACIENTES
+# -----------------------------
+
+def montar_rajada(rng: random.Random, numero: str, turno: int, args) -> list[tuple[dict, float]]:
+    """
+    Mensagens de um turno do paciente, com a pausa de digitação antes de cada uma.
+
+    Pausas menores que o BUFFER_TIMEOUT caem no mesmo flush do buffer;
+    as maiores podem dividir a rajada em dois turnos do agente, como acontece de verdade.
+    """
+    frases = [rng.choice(SAUDACOES)] if turno == 0 else []
+    frases.append(rng.choice(PEDIDOS))
+    while len(frases) < args.max_rajada and rng.random() < 0.4:
+        frases.append(rng.choice(COMPLEMENTOS))
+
+    rajada = []
+    for indice, frase in enumerate(frases):
+        pausa = 0.0 if indice == 0 else rng.uniform(0.3, 2.5)
+
+        if rng.random() < args.audio:
+            evento = evento_audio(numero, segundos=rng.uniform(2, 15))
+        else:
+            evento = evento_texto(numero, frase)
+
+        rajada.append((evento, pausa))
+
+    if rng.random() < args.imagem:
+        rajada.append((evento_imagem(numero), rng.uniform(0.5, 3)))
+
+    return rajada
+
+
+async def simular_paciente(indice: int, args, client: httpx.AsyncClient, respostas: asyncio.Queue, turnos: list):
+    """
+    Um paciente: manda uma rajada, espera a resposta inteira, pensa e manda a próxima.
+
+    COMO FUNCIONA:
+    - TTFR (primeira resposta) e TTLR (última) contam a partir da última
+      mensagem da rajada, que é quando o paciente fica esperando
+    - A resposta acaba quando a clínica fica args.silencio segundos sem mandar nada
+    - Respostas que chegam depois disso são descartadas antes da próxima rajada
+      (contadas como atrasadas)
+    """
+    numero = f'{args.prefixo}{indice:05d}'
+    rng = random.Random(args.seed * 100_003 + indice)
+
+    await asyncio.sleep(rng.uniform(0, args.rampa))
+
+    for turno in range(args.turnos):
+        while not respostas.empty():
+            respostas.get_nowait()
+            turnos.append({'numero': numero, 'turno': turno, 'atrasada': True})
+
+        rajada = montar_rajada(rng, numero, turno, args)
+        inicio = time.time()
+
+        for evento, pausa in rajada:
+            await asyncio.sleep(pausa)
+            await enviar_evento(client, evento, webhook_url=args.webhook)
+
+        fim_rajada = time.time()
+        registro = {
+            'numero': numero,
+            'turno': turno,
+            'mensagens': len(rajada),
+            'digitando_s': round(fim_rajada - inicio, 3),
+        }
+
+        try:
+            primeira = await asyncio.wait_for(respostas.get(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            registro['sem_resposta'] = True
+            turnos.append(registro)
+            continue
+
+        ultima, partes = primeira, 1
+        while True:
+            try:
+                ultima = await asyncio.wait_for(respostas.get(), timeout=args.silencio)
+                partes += 1
+            except asyncio.TimeoutError:
+                break
+
+        registro['ttfr'] = primeira['entregue_em'] - fim_rajada
+        registro['ttlr'] = ultima['entregue_em'] - fim_rajada
+        registro['partes'] = partes
+        turnos.append(registro)
+
+        await asyncio.sleep(rng.expovariate(1 / args.pausa) if args.pausa else 0)
+
+
+# -----------------------------
+# AMOSTRAGEM (fila RQ e Postgres)
+# -----------------------------
+
+def _fila_rq() -> Queue:
+    conn = Redis(
+        host=os.getenv('REDIS_HOST'),
+        port=os.getenv('REDIS_PORT'),
+        password=os.getenv('SENHA_REDIS'),
+        db=0,
+    )
+    return Queue(connection=conn)
+
+
+def _conexoes_db(conn) -> dict | None:
+    if conn is None:
+        return None
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT count(*) AS total,
+                   count(*) FILTER (WHERE state = 'active') AS ativas,
+                   count(*) FILTER (WHERE state = 'idle in transaction') AS presas
+            FROM pg_stat_activity
+            WHERE datname = current_database() AND pid <> pg_backend_pid()
+        """)
+        return dict(cursor.fetchone())
+
+
+def _ler_amostra(fila: Queue, conn, inicio: float) -> dict:
+    amostra = {'t': round(time.time() - inicio, 2)}
+
+    try:
+        amostra['fila_rq'] = fila.count
+        amostra['rq_rodando'] = StartedJobRegistry(queue=fila).count
+    except Exception as e:
+        amostra['erro_redis'] = str(e)
+
+    try:
+        amostra['db'] = _conexoes_db(conn)
+    except Exception as e:
+        amostra['erro_db'] = str(e)
+
+    return amostra
+
+
+async def amostrar(args, amostras: list, parar: asyncio.Event, inicio: float):
+    fila = _fila_rq()
+    conn = None
+
+    if not args.sem_db:
+        try:
+            # Import aqui: sem Postgres configurado o teste roda sem essa coluna
+            from src.db.connection import get_dedicated_conn
+
+            conn = await asyncio.to_thread(get_dedicated_conn)
+            conn.autocommit = True
+        except Exception as e:
+            print(f'⚠️ [LOAD] Sem Postgres para contar conexões: {e}')
+
+    try:
+        while not parar.is_set():
+            amostras.append(await asyncio.to_thread(_ler_amostra, fila, conn, inicio))
+            try:
+                await asyncio.wait_for(parar.wait(), timeout=args.amostragem)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+async def _metricas_app(client: httpx.AsyncClient, args) -> dict:
+    """Contadores do /metrics da API (o buffer roda no processo dela)."""
+    try:
+        response = await client.get(args.webhook.rsplit('/', 1)[0] + '/metrics')
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f'⚠️ [LOAD] /metrics indisponível: {e}')
+        return {}
+
+
+# -----------------------------
+# RELATÓRIO
+# -----------------------------
+
+def percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _distribuicao(valores: list[float]) -> dict:
+    resumo = {f'p{p}_ms': round(percentil(valores, p) * 1000, 1) for p in PERCENTIS}
+    resumo['max_ms'] = round(max(valores, default=0) * 1000, 1)
+    resumo['count'] = len(valores)
+    return resumo
+
+
+def _delta(antes: dict, depois: dict, grupo: str) -> dict:
+    contadores_antes = antes.get(grupo, {}).get('counters', {})
+    contadores_depois = depois.get(grupo, {}).get('counters', {})
+    return {chave: valor - contadores_antes.get(chave, 0) for chave, valor in contadores_depois.items()}
+
+
+def resumir(turnos: list, amostras: list, metricas_antes: dict, metricas_depois: dict, duracao: float) -> dict:
+    respondidos = [turno for turno in turnos if 'ttfr' in turno]
+    buffer = _delta(metricas_antes, metricas_depois, 'buffer')
+
+    profundidades = [amostra['fila_rq'] for amostra in amostras if 'fila_rq' in amostra]
+    conexoes = [amostra['db'] for amostra in amostras if amostra.get('db')]
+
+    return {
+        'duracao_s': round(duracao, 1),
+        'turnos': sum(1 for turno in turnos if not turno.get('atrasada')),
+        'sem_resposta': sum(1 for turno in turnos if turno.get('sem_resposta')),
+        'respostas_atrasadas': sum(1 for turno in turnos if turno.get('atrasada')),
+        'mensagens_enviadas': sum(turno.get('mensagens', 0) for turno in turnos),
+        'ttfr': _distribuicao([turno['ttfr'] for turno in respondidos]),
+        'ttlr': _distribuicao([turno['ttlr'] for turno in respondidos]),
+        'buffer': {
+            'flushes': buffer.get('flushes', 0),
+            'mensagens': buffer.get('messages', 0),
+            'erros_callback': buffer.get('callback_errors', 0),
+        },
+        'fila_rq': {
+            'max': max(profundidades, default=0),
+            'media': round(sum(profundidades) / len(profundidades), 2) if profundidades else 0,
+            'serie': profundidades,
+        },
+        'conexoes_db': {
+            'max_total': max((conexao['total'] for conexao in conexoes), default=None),
+            'max_ativas': max((conexao['ativas'] for conexao in conexoes), default=None),
+            'max_presas': max((conexao['presas'] for conexao in conexoes), default=None),
+        },
+    }
+
+
+def _sparkline(serie: list[int], largura: int = 60) -> str:
+    if not serie:
+        return '-'
+    passo = max(1, len(serie) // largura)
+    pontos = [max(serie[i:i + passo]) for i in range(0, len(serie), passo)]
+    topo = max(pontos) or 1
+    return ''.join(BARRAS[min(len(BARRAS) - 1, int(ponto / topo * (len(BARRAS) - 1)))] for ponto in pontos)
+
+
+def imprimir(resumo: dict, baseline: dict | None = None):
+    print(f'\n{"=" * 60}')
+    print(f'📊 RELATÓRIO DE CARGA ({resumo["duracao_s"]}s)')
+    print(f'{"=" * 60}')
+    print(f'Turnos: {resumo["turnos"]}  |  mensagens: {resumo["mensagens_enviadas"]}  |  '
+          f'sem resposta: {resumo["sem_resposta"]}  |  atrasadas: {resumo["respostas_atrasadas"]}')
+
+    for nome in ('ttfr', 'ttlr'):
+        linha = '  '.join(f'{chave}={valor}' for chave, valor in resumo[nome].items())
+        print(f'{nome.upper()}: {linha}')
+
+        if baseline and nome in baseline:
+            diferencas = '  '.join(
+                f'{chave}={resumo[nome][chave] - baseline[nome][chave]:+.1f}'
+                for chave in ('p50_ms', 'p95_ms', 'p99_ms')
+            )
+            print(f'      vs baseline: {diferencas}')
+
+    buffer = resumo['buffer']
+    por_flush = buffer['mensagens'] / buffer['flushes'] if buffer['flushes'] else 0
+    print(f'Buffer: {buffer["flushes"]} flushes, {buffer["mensagens"]} mensagens '
+          f'({por_flush:.2f} por flush), {buffer["erros_callback"]} erros')
+
+    fila = resumo['fila_rq']
+    print(f'Fila RQ: max {fila["max"]}, média {fila["media"]}  {_sparkline(fila["serie"])}')
+
+    conexoes = resumo['conexoes_db']
+    print(f'Postgres: max {conexoes["max_total"]} conexões, {conexoes["max_ativas"]} ativas, '
+          f'{conexoes["max_presas"]} idle in transaction')
+    print(f'{"=" * 60}\n')
+
+
+# -----------------------------
+# EXECUÇÃO
+# -----------------------------
+
+def _subir_aplicacao(args) -> list[subprocess.Popen]:
+    """API e worker como em produção, só que enviando para a Evolution falsa."""
+    env = {**os.environ, 'BASE_URL_EVO': f'http://{args.host_evo}:{args.porta_evo}'}
+    porta_api = httpx.URL(args.webhook).port or 8000
+    worker = 'src.redis.async_worker' if args.worker == 'async' else 'src.redis.worker'
+
+    return [
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', 'src.fast_api.app:app', '--port', str(porta_api)], env=env),
+        subprocess.Popen([sys.executable, '-m', worker], env=env),
+    ]
+
+
+async def _aguardar_api(client: httpx.AsyncClient, args, limite: float = 60):
+    url = args.webhook.rsplit('/', 1)[0] + '/health'
+    fim = time.monotonic() + limite
+
+    while time.monotonic() < fim:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+
+    raise RuntimeError(f'API não respondeu em {url}')
+
+
+async def executar(args) -> dict:
+    fake_evolution.config.update({
+        'latencia_ms': args.evo_latencia_ms,
+        'jitter_ms': args.evo_jitter_ms,
+        'taxa_erro': args.evo_taxa_erro,
+    })
+
+    # Cada paciente recebe só as respostas do seu número
+    filas = defaultdict(asyncio.Queue)
+    fake_evolution.ouvintes.append(lambda registro: filas[registro['numero']].put_nowait(registro))
+
+    servidor = uvicorn.Server(uvicorn.Config(
+        fake_evolution.app, host=args.host_evo, port=args.porta_evo, log_level='warning'
+    ))
+    tarefa_servidor = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+
+    processos = _subir_aplicacao(args) if args.subir else []
+    turnos, amostras = [], []
+    parar = asyncio.Event()
+
+    try:
+        async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=args.pacientes)) as client:
+            await _aguardar_api(client, args)
+            metricas_antes = await _metricas_app(client, args)
+
+            print(f'🧪 [LOAD] {args.pacientes} pacientes x {args.turnos} turnos contra {args.webhook}')
+            inicio = time.time()
+            amostrador = asyncio.create_task(amostrar(args, amostras, parar, inicio))
+
+            await asyncio.gather(*(
+                simular_paciente(indice, args, client, filas[f'{args.prefixo}{indice:05d}'], turnos)
+                for indice in range(args.pacientes)
+            ))
+
+            duracao = time.time() - inicio
+            parar.set()
+            await amostrador
+            metricas_depois = await _metricas_app(client, args)
+
+    finally:
+        for processo in processos:
+            processo.terminate()
+        for processo in processos:
+            processo.wait(timeout=30)
+
+        servidor.should_exit = True
+        await tarefa_servidor
+
+    return resumir(turnos, amostras, metricas_antes, metricas_depois, duracao)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.loadtest.load_generator',
+        description='Pacientes sintéticos contra o /webhook, respostas pela Evolution falsa.',
+    )
+    parser.add_argument('-n', '--pacientes', type=int, default=20)
+    parser.add_argument('-t', '--turnos', type=int, default=3, help='rajadas por paciente')
+    parser.add_argument('--webhook', default='http://localhost:8000/webhook')
+    parser.add_argument('--subir', action='store_true', help='sobe a API e o worker apontando para a Evolution falsa')
+    parser.add_argument('--worker', choices=['rq', 'async'], default='rq', help='worker usado com --subir')
+    parser.add_argument('--host-evo', default=fake_evolution.FAKE_EVO_HOST)
+    parser.add_argument('--porta-evo', type=int, default=fake_evolution.FAKE_EVO_PORT)
+    parser.add_argument('--evo-latencia-ms', type=float, default=fake_evolution.config['latencia_ms'])
+    parser.add_argument('--evo-jitter-ms', type=float, default=fake_evolution.config['jitter_ms'])
+    parser.add_argument('--evo-taxa-erro', type=float, default=fake_evolution.config['taxa_erro'])
+    parser.add_argument('--rampa', type=float, default=10, help='segundos para todos os pacientes começarem')
+    parser.add_argument('--pausa', type=float, default=8, help='média da pausa entre turnos (s)')
+    parser.add_argument('--max-rajada', type=int, default=4, help='máximo de mensagens por rajada')
+    parser.add_argument('--audio', type=float, default=0.1, help='fração das mensagens que são áudio')
+    parser.add_argument('--imagem', type=float, default=0.05, help='fração das rajadas com imagem')
+    parser.add_argument('--timeout', type=float, default=90, help='espera máxima pela primeira resposta (s)')
+    parser.add_argument('--silencio', type=float, default=5, help='segundos sem envio que encerram a resposta')
+    parser.add_argument('--amostragem', type=float, default=1, help='intervalo entre amostras da fila e do banco (s)')
+    parser.add_argument('--prefixo', default='5599000', help='prefixo dos números sintéticos')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sem-db', action='store_true', help='não conta conexões no Postgres')
+    parser.add_argument('--saida', help='grava o relatório em JSON (para usar como baseline)')
+    parser.add_argument('--baseline', help='relatório JSON de uma execução anterior para comparar')
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    """
+    Gera carga de pacientes no /webhook e mede o caminho inteiro:
+    webhook → adicionar_ao_buffer → ouvinte_de_expiracao →
+    enqueue_agent_processing → worker (processar_agente) → Evolution.
+
+    A API e o worker são os de produção; só a Evolution é a falsa, no
+    mesmo processo do gerador. Suba a aplicação com
+    BASE_URL_EVO=http://127.0.0.1:8081 ou use --subir. Para medir sem LLM
+    real, rode o worker com LLM_PROVIDER=fake ou com um cassete
+    (src/agent/llm_factory.py).
+
+    Rodar com:
+        python -m src.loadtest.load_generator -n 50 -t 3 --saida base.json
+        python -m src.loadtest.load_generator -n 50 -t 3 --baseline base.json
+
+    Os números sintéticos (--prefixo) ficam gravados no banco como pacientes.
+    """
+    args = _parser().parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as arquivo:
+            baseline = json.load(arquivo)
+
+    resumo = asyncio.run(executar(args))
+    imprimir(resumo, baseline)
+
+    if args.saida:
+        with open(args.saida, 'w') as arquivo:
+            json.dump(resumo, arquivo, indent=2)
+        print(f'💾 [LOAD] Relatório salvo em {args.saida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Quantas amostras de latência guardar por métrica (janela deslizante)
+MAX_SAMPLES = 1000
+
+
+class Metrics:
+    """
+    Contadores e latências em memória, por processo e thread-safe.
+
+    COMO FUNCIONA:
+    - incr() soma em um contador nomeado (ex: 'hits', 'errors')
+    - observe() registra uma latência em segundos
+    - snapshot() devolve um dict pronto para log ou para o endpoint /metrics
+
+    Não persiste nada: cada processo (API, worker RQ) tem as suas métricas.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._totals = defaultdict(lambda: [0, 0.0, 0.0])  # count, soma, máximo
+
+    def incr(self, key: str, value: int = 1):
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            self._samples[key].append(seconds)
+            total = self._totals[key]
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+
+    @contextmanager
+    def timer(self, key: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(key, time.perf_counter() - inicio)
+
+    def ratio(self, hit_key: str, miss_key: str) -> float:
+        with self._lock:
+            hits = self._counters[hit_key]
+            total = hits + self._counters[miss_key]
+        return hits / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {}
+            for key, samples in self._samples.items():
+                ordenadas = sorted(samples)
+                count, soma, maximo = self._totals[key]
+                timings[key] = {
+                    'count': count,
+                    'avg_ms': round(soma / count * 1000, 2) if count else 0.0,
+                    'p50_ms': round(_percentile(ordenadas, 50) * 1000, 2),
+                    'p95_ms': round(_percentile(ordenadas, 95) * 1000, 2),
+                    'max_ms': round(maximo * 1000, 2),
+                }
+
+            return {'counters': dict(self._counters), 'timings': timings}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+            self._totals.clear()
+
+
+def _percentile(ordenadas: list, p: float) -> float:
+    if not ordenadas:
+        return 0.0
+    indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[indice]
+
+
+_registry: dict[str, Metrics] = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(name: str) -> Metrics:
+    """Retorna (criando se preciso) o grupo de métricas com esse nome."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Metrics(name)
+        return _registry[name]
+
+
+def snapshot_all() -> dict:
+    with _registry_lock:
+        grupos = list(_registry.values())
+    return {grupo.name: grupo.snapshot() for grupo in grupos}
@@ -17,7 +17,8 @@ class ContextProvider:
         day_en = now_dt.strftime("%A")
         day_pt = DIAS_PT.get(day_en, day_en)
 
-        now = now_dt.strftime("%Y-%m-%d %H:%M:%S") + f" | {day_pt}"
+        # Minuto, não segundo: chamadas do mesmo minuto mandam o mesmo texto
+        now = now_dt.strftime("%Y-%m-%d %H:%M") + f" | {day_pt}"
 
         return f"DATA/HORA ATUAL: {now}"
 
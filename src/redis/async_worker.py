@@ -0,0 +1,242 @@
+import asyncio
+import os
+import socket
+import traceback
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from rq import Queue
+from rq.defaults import DEFAULT_FAILURE_TTL
+from rq.executions import Execution
+from rq.job import JobStatus
+from rq.registry import FailedJobRegistry, FinishedJobRegistry
+from rq.results import Result
+
+from src.db.crud_async import AsyncPostgreSQL, close_async_pool
+from src.graph.idempotency import deve_retomar
+from src.db.vector_index import indice_rag
+from src.evo.client import AsyncEvolutionAPI
+from src.graph.runtime import AsyncAgentRuntime
+from src.redis.rq import (
+    JOB_TIMEOUT,
+    MAX_TURNOS_POR_JOB,
+    concluir_turno,
+    montar_entrada,
+    passar_a_vez,
+    proximo_turno,
+    relatar_resultado,
+    turno_falhou,
+)
+from src.redis.worker import worker_conn
+
+load_dotenv()
+
+AGENT_ASYNC_CONCURRENCY = int(os.getenv('AGENT_ASYNC_CONCURRENCY', 32))
+DEQUEUE_TIMEOUT = 5  # segundos bloqueado esperando job antes de checar de novo
+RESULT_TTL = 500  # segundos guardando o resultado do job (mesmo padrão do RQ)
+HEARTBEAT_INTERVALO = 30  # segundos entre heartbeats de um job em execução
+HEARTBEAT_TTL = HEARTBEAT_INTERVALO + 60  # sem heartbeat por esse tempo, o RQ considera o job abandonado
+
+
+async def processar_agente_async(numero: str, texto_final: str, turn_id: str | None = None):
+    """Versão assíncrona do processar_agente: graph.ainvoke + CRUD assíncrono."""
+    try:
+        print(f'📦 [ASYNC WORKER] Processando buffer para: {numero}')
+        print(f'💬 [ASYNC WORKER] Texto agrupado: {texto_final}')
+
+        entrada, config = montar_entrada(numero, texto_final, turn_id)
+
+        graph = await AsyncAgentRuntime.get_graph()
+
+        if deve_retomar(await graph.aget_state(config), turn_id):
+            print(f'♻️ [ASYNC WORKER] Retomando turno {turn_id} de {numero} do último checkpoint')
+            resultado = await graph.ainvoke(None, config=config)
+        else:
+            resultado = await graph.ainvoke(entrada, config=config)
+
+        resposta_ia, tokens = relatar_resultado(numero, resultado)
+
+        if tokens:
+            await AsyncPostgreSQL.save_tokens(**tokens)
+            print('Tokens Salvos com Sucesso!!! \n')
+
+        return {'status': 'sucesso', 'numero': numero, 'resposta': resposta_ia}
+
+    except Exception as e:
+        print(f'❌ [ASYNC WORKER] Erro ao processar mensagens para {numero}: {e}')
+        print(f'Entrada que causou erro: number={numero}, texto={texto_final}\n')
+        raise
+
+
+async def processar_conversa_async(numero: str, ultima_tentativa: bool, job_id: str):
+    """
+    Mesmo contrato do processar_conversa (ordem estrita por número,
+    turnos coalescidos, posse da conversa), rodando no event loop.
+    """
+    for _ in range(MAX_TURNOS_POR_JOB):
+        turno = await asyncio.to_thread(proximo_turno, numero, job_id)
+
+        if turno is None:
+            return {'status': 'sucesso', 'numero': numero}
+
+        try:
+            await processar_agente_async(numero, turno['texto'], turno['id'])
+
+        except Exception:
+            await asyncio.to_thread(turno_falhou, numero, turno, ultima_tentativa, job_id)
+            raise
+
+        await asyncio.to_thread(concluir_turno, numero, turno)
+
+    await asyncio.to_thread(passar_a_vez, numero, job_id)
+    return {'status': 'continuacao', 'numero': numero}
+
+
+def _bater_ponto(job, execucao: Execution):
+    """Heartbeat do job e da execução: mantém o job no StartedJobRegistry."""
+    with worker_conn.pipeline() as pipe:
+        job.heartbeat(datetime.now(timezone.utc), HEARTBEAT_TTL, pipeline=pipe)
+        execucao.heartbeat(job.started_job_registry, HEARTBEAT_TTL, pipe)
+        pipe.execute()
+
+
+async def _manter_vivo(job, execucao: Execution):
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVALO)
+        try:
+            _bater_ponto(job, execucao)
+        except Exception as e:
+            print(f'⚠️ [ASYNC WORKER] Falha no heartbeat do job {job.id}: {e}')
+
+
+async def _executar_job(job, fila: Queue, nome_worker: str):
+    """
+    Executa um job da fila do RQ e registra o desfecho do mesmo jeito
+    que o worker do RQ, só com a API pública do RQ.
+
+    COMO FUNCIONA:
+    - O job entra no StartedJobRegistry (via Execution) e recebe heartbeat
+      a cada HEARTBEAT_INTERVALO; se este processo morrer, a limpeza do RQ
+      trata o job como abandonado (retry ou FailedJobRegistry)
+    - Sucesso: status FINISHED, Result e FinishedJobRegistry
+    - Falha: retry enquanto houver tentativas, senão FAILED, Result e
+      FailedJobRegistry
+
+    TIMEOUT:
+    - Passado JOB_TIMEOUT o job é dado como falho, mas o trabalho só é
+      abandonado, não interrompido: um job.perform em thread (ou uma chamada
+      bloqueante já em andamento numa thread) continua até terminar sozinho.
+      A posse da conversa impede que ele e o retry processem o mesmo número
+      ao mesmo tempo por mais de um turno
+    """
+    with worker_conn.pipeline() as pipe:
+        job.prepare_for_execution(nome_worker, pipe)
+        execucao = Execution.create(job, HEARTBEAT_TTL, pipeline=pipe)
+        pipe.execute()
+
+    heartbeat = asyncio.create_task(_manter_vivo(job, execucao))
+
+    try:
+        if job.func_name.endswith('processar_conversa'):
+            resultado = await asyncio.wait_for(
+                processar_conversa_async(*job.args, ultima_tentativa=not job.retries_left, job_id=job.id),
+                timeout=JOB_TIMEOUT,
+            )
+        else:
+            # Qualquer outro job da fila roda como no RQ, em uma thread
+            resultado = await asyncio.wait_for(asyncio.to_thread(job.perform), timeout=JOB_TIMEOUT)
+
+    except Exception:
+        exc_string = traceback.format_exc()
+        print(f'❌ [ASYNC WORKER] Job {job.id} falhou')
+
+        with worker_conn.pipeline() as pipe:
+            execucao.delete(job, pipe)
+            if job.retries_left:
+                job.retry(fila, pipe)
+            else:
+                failure_ttl = job.failure_ttl or DEFAULT_FAILURE_TTL
+                job.set_status(JobStatus.FAILED, pipeline=pipe)
+                FailedJobRegistry(queue=fila).add(job, ttl=failure_ttl, exc_string=exc_string, pipeline=pipe)
+                Result.create_failure(job, failure_ttl, exc_string=exc_string, worker_name=nome_worker, pipeline=pipe)
+            pipe.execute()
+        return
+
+    finally:
+        heartbeat.cancel()
+
+    with worker_conn.pipeline() as pipe:
+        execucao.delete(job, pipe)
+        job.set_status(JobStatus.FINISHED, pipeline=pipe)
+        Result.create(
+            job, Result.Type.SUCCESSFUL, RESULT_TTL,
+            return_value=resultado, worker_name=nome_worker, pipeline=pipe,
+        )
+        FinishedJobRegistry(queue=fila).add(job, RESULT_TTL, pipeline=pipe)
+        pipe.execute()
+
+
+async def main_async():
+    """
+    Consome a mesma fila do RQ com até AGENT_ASYNC_CONCURRENCY conversas
+    simultâneas por processo.
+
+    COMO FUNCIONA:
+    - Só tira um job da fila quando há vaga no semáforo: jobs que este
+      processo não consegue rodar agora continuam disponíveis para outros workers
+    - Cada job vira uma task no event loop; o graph roda com ainvoke,
+      nós assíncronos e CRUD assíncrono
+    - A ordem por conversa vem do mesmo mecanismo do worker RQ
+      (caixa de entrada + posse do número)
+    """
+    semaforo = asyncio.Semaphore(AGENT_ASYNC_CONCURRENCY)
+    fila = Queue(connection=worker_conn)
+    nome_worker = f'async-{socket.gethostname()}-{os.getpid()}'
+    tarefas = set()
+
+    await AsyncAgentRuntime.get_graph()
+    indice_rag.iniciar()
+    print(f'🚀 [ASYNC WORKER] {nome_worker} pronto (concorrência {AGENT_ASYNC_CONCURRENCY})')
+
+    try:
+        while True:
+            await semaforo.acquire()
+
+            try:
+                retirado = await asyncio.to_thread(
+                    Queue.dequeue_any, [fila], DEQUEUE_TIMEOUT, connection=worker_conn
+                )
+            except Exception as e:
+                print(f'❌ [ASYNC WORKER] Erro ao ler a fila: {e}')
+                semaforo.release()
+                await asyncio.sleep(1)
+                continue
+
+            if retirado is None:
+                semaforo.release()
+                continue
+
+            job, fila_job = retirado
+            tarefa = asyncio.create_task(_executar_job(job, fila_job, nome_worker))
+            tarefas.add(tarefa)
+            tarefa.add_done_callback(tarefas.discard)
+            tarefa.add_done_callback(lambda _: semaforo.release())
+
+    finally:
+        if tarefas:
+            await asyncio.gather(*tarefas, return_exceptions=True)
+        await AsyncAgentRuntime.close()
+        await close_async_pool()
+        await AsyncEvolutionAPI.aclose()
+
+
+def main():
+    """
+    Rodar com:
+        python -m src.redis.async_worker
+    """
+    asyncio.run(main_async())
+
+
+if __name__ == '__main__':
+    main()
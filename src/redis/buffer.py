@@ -1,15 +1,128 @@
 import asyncio
-import json
+import time
 from typing import Awaitable, Callable
 
 from dotenv import load_dotenv
 
+from src.metrics.stats import get_metrics
 from src.redis.client_redis import redis_client
 
 load_dotenv()
 
 
 BUFFER_TIMEOUT = 1  # segundos
+BUFFER_CONTENT_TTL = 300  # segundos — TTL de segurança para buffers abandonados
+BUFFER_RETRY_DELAY = 5  # segundos — novo prazo quando o flush falha
+DISPATCHER_MAX_IDLE = 30  # segundos — maior bloqueio sem nenhum prazo pendente
+CLAIM_BATCH = 50  # máximo de números reivindicados por chamada
+BUFFER_LEASE = 60  # segundos — reivindicação sem confirmação depois disso volta para o buffer
+CLAIM_TTL = 86400  # segundos — TTL de segurança das reivindicações
+
+CHAVE_CONTEUDO = 'buffer:content:'
+CHAVE_PRAZOS = 'buffer:deadlines'  # sorted set: membro = número, score = prazo em ms
+CHAVE_DESPERTAR = 'buffer:wakeup'  # lista usada só para acordar um dispatcher bloqueado
+CHAVE_REIVINDICACAO = 'buffer:claim:'  # lista [numero, mensagens...] de um flush em andamento
+CHAVE_LEASES = 'buffer:leases'  # sorted set: membro = id da reivindicação, score = vencimento em ms
+CHAVE_SEQUENCIA = 'buffer:claim_seq'
+
+metrics = get_metrics('buffer')
+
+# Em Redis < 7 é preciso replicar efeitos para poder usar TIME antes de escrever
+_AGORA_MS_LUA = """
+    if redis.replicate_commands then redis.replicate_commands() end
+    local t = redis.call('TIME')
+    local agora = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+
+# Tudo em um único round trip e atômico no Redis:
+# RPUSH da mensagem, TTL de segurança no conteúdo, novo prazo do número
+# no sorted set e um sinal para acordar o dispatcher.
+# Retorna o total de mensagens no buffer.
+_ADICIONAR_LUA = redis_client.register_script(
+    _AGORA_MS_LUA
+    + """
+    local total = redis.call('RPUSH', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('ZADD', KEYS[2], agora + tonumber(ARGV[3]) * 1000, ARGV[4])
+    redis.call('LPUSH', KEYS[3], 1)
+    redis.call('LTRIM', KEYS[3], 0, 0)
+    redis.call('EXPIRE', KEYS[3], ARGV[2])
+    return total
+    """
+)
+
+
+# Reivindica os números com prazo vencido e move o buffer de cada um para
+# uma chave de reivindicação com lease, tudo na mesma transação: só um
+# dispatcher recebe cada flush, e as mensagens só somem depois da confirmação.
+# Retorna {{numero, id, {mensagens...}}, ...} e os ms até o próximo prazo (-1 se não houver).
+_REIVINDICAR_LUA = redis_client.register_script(
+    _AGORA_MS_LUA
+    + """
+    local numeros = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', agora, 'LIMIT', 0, ARGV[1])
+    local resultado = {}
+
+    for _, numero in ipairs(numeros) do
+        redis.call('ZREM', KEYS[1], numero)
+        local chave = ARGV[2] .. numero
+        local mensagens = redis.call('LRANGE', chave, 0, -1)
+        redis.call('DEL', chave)
+
+        if #mensagens > 0 then
+            local id = numero .. ':' .. redis.call('INCR', KEYS[3])
+            local reivindicacao = ARGV[3] .. id
+            redis.call('RPUSH', reivindicacao, numero, unpack(mensagens))
+            redis.call('EXPIRE', reivindicacao, ARGV[5])
+            redis.call('ZADD', KEYS[2], agora + tonumber(ARGV[4]) * 1000, id)
+            table.insert(resultado, {numero, id, mensagens})
+        end
+    end
+
+    local proximo = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local espera = -1
+    if proximo[2] then
+        espera = math.max(tonumber(proximo[2]) - agora, 0)
+    end
+
+    return {resultado, espera}
+    """
+)
+
+
+# Recoloca as mensagens de uma reivindicação no início do buffer, agenda
+# nova tentativa (sem adiantar um prazo que já exista) e encerra a reivindicação
+_DEVOLVER_LUA = redis_client.register_script(
+    _AGORA_MS_LUA
+    + """
+    local itens = redis.call('LRANGE', KEYS[2], 0, -1)
+    if #itens == 0 then
+        redis.call('ZREM', KEYS[3], ARGV[3])
+        return 0
+    end
+
+    local numero = itens[1]
+    local conteudo = ARGV[4] .. numero
+    for i = #itens, 2, -1 do
+        redis.call('LPUSH', conteudo, itens[i])
+    end
+    redis.call('EXPIRE', conteudo, ARGV[1])
+    redis.call('ZADD', KEYS[1], 'NX', agora + tonumber(ARGV[2]) * 1000, numero)
+    redis.call('DEL', KEYS[2])
+    redis.call('ZREM', KEYS[3], ARGV[3])
+    return 1
+    """
+)
+
+
+# Reivindicações cujo lease venceu (dispatcher caiu entre reivindicar e
+# confirmar): ids para devolver ao buffer
+_LEASES_VENCIDAS_LUA = redis_client.register_script(
+    _AGORA_MS_LUA
+    + """
+    return redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', agora, 'LIMIT', 0, ARGV[1])
+    """
+)
 
 
 def adicionar_ao_buffer(numero: str, nova_mensagem: str):
@@ -18,114 +131,164 @@ def adicionar_ao_buffer(numero: str, nova_mensagem: str):
     Reinicia o timer de timeout a cada nova mensagem.
 
     COMO FUNCIONA:
-    - Pega todas as mensagens já armazenadas para esse número
-    - Adiciona a nova mensagem à lista
-    - Salva tudo de volta no Redis
-    - Reinicia o timer de 10 segundos (setex = set with expiration)
+    - Um script Lua faz, de forma atômica e em um único round trip:
+      RPUSH da mensagem na lista buffer:content:{numero},
+      EXPIRE de segurança no conteúdo e ZADD do novo prazo do número
+      no sorted set buffer:deadlines (agora + BUFFER_TIMEOUT)
+    - Também deixa um sinal em buffer:wakeup para acordar o dispatcher
+    - Dois webhooks simultâneos para o mesmo número nunca perdem mensagens
 
     Args:
         numero (str): ID do usuário (número de telefone)
         nova_mensagem (str): A mensagem a ser adicionada
     """
-    chave_conteudo = f'buffer:content:{numero}'
-    chave_gatilho = f'buffer:trigger:{numero}'
+    total = _ADICIONAR_LUA(
+        keys=[f'{CHAVE_CONTEUDO}{numero}', CHAVE_PRAZOS, CHAVE_DESPERTAR],
+        args=[nova_mensagem or '', BUFFER_CONTENT_TTL, BUFFER_TIMEOUT, numero],
+    )
 
-    # Recupera as mensagens já armazenadas
-    # Se não existir, começa com lista vazia
-    mensagens_json = redis_client.get(chave_conteudo)
-    mensagens = json.loads(mensagens_json) if mensagens_json else []
+    print(
+        f'⏱️ Timer resetado para {numero} ({total} mensagens no buffer)'
+    )
 
-    # Adiciona a nova mensagem
-    mensagens.append(nova_mensagem)
 
-    # Salva as mensagens atualizadas
-    redis_client.set(chave_conteudo, json.dumps(mensagens))
+def reivindicar_vencidos() -> tuple[list[tuple[str, str, list[str]]], float | None]:
+    """
+    Reivindica atomicamente os buffers com prazo vencido.
 
-    # Reinicia o timer: a chave vai expirar em 10 segundos
-    # O valor "1" é irrelevante, importante é que a chave expira
-    redis_client.setex(chave_gatilho, BUFFER_TIMEOUT, 1)
+    As mensagens ficam em buffer:claim:{id} até confirmar_flush(id) ou
+    devolver_ao_buffer(id); se nenhum dos dois acontecer em BUFFER_LEASE
+    segundos, recuperar_leases_vencidas() as devolve ao buffer.
 
-    print(
-        f'⏱️ Timer resetado para {numero} ({len(mensagens)} mensagens no buffer)'
+    Returns:
+        (lista de (numero, id da reivindicação, mensagens), segundos até o próximo prazo ou None)
+    """
+    reivindicados, espera_ms = _REIVINDICAR_LUA(
+        keys=[CHAVE_PRAZOS, CHAVE_LEASES, CHAVE_SEQUENCIA],
+        args=[CLAIM_BATCH, CHAVE_CONTEUDO, CHAVE_REIVINDICACAO, BUFFER_LEASE, CLAIM_TTL],
     )
 
+    espera = None if espera_ms < 0 else espera_ms / 1000
+    return [(numero, id_, mensagens) for numero, id_, mensagens in reivindicados], espera
+
+
+def confirmar_flush(id_reivindicacao: str):
+    """Callback concluído: as mensagens da reivindicação podem sumir."""
+    pipe = redis_client.pipeline()
+    pipe.delete(f'{CHAVE_REIVINDICACAO}{id_reivindicacao}')
+    pipe.zrem(CHAVE_LEASES, id_reivindicacao)
+    pipe.execute()
+
+
+def devolver_ao_buffer(id_reivindicacao: str, atraso: float | None = None) -> bool:
+    """
+    Recoloca as mensagens de uma reivindicação no início do buffer
+    (ex: falha ao enfileirar) e agenda um novo flush em `atraso` segundos
+    (padrão BUFFER_RETRY_DELAY).
+    """
+    atraso = BUFFER_RETRY_DELAY if atraso is None else atraso
+
+    return bool(_DEVOLVER_LUA(
+        keys=[CHAVE_PRAZOS, f'{CHAVE_REIVINDICACAO}{id_reivindicacao}', CHAVE_LEASES],
+        args=[BUFFER_CONTENT_TTL, atraso, id_reivindicacao, CHAVE_CONTEUDO],
+    ))
+
+
+def recuperar_leases_vencidas() -> int:
+    """
+    Devolve ao buffer as reivindicações de dispatchers que caíram antes de
+    confirmar. Entrega pelo menos uma vez: se a queda foi depois do
+    enqueue e antes da confirmação, o texto é enfileirado de novo.
+    """
+    recuperadas = 0
+
+    for id_reivindicacao in _LEASES_VENCIDAS_LUA(keys=[CHAVE_LEASES], args=[CLAIM_BATCH]):
+        if devolver_ao_buffer(id_reivindicacao, atraso=0):
+            recuperadas += 1
+
+    if recuperadas:
+        print(f'♻️ {recuperadas} flush(es) sem confirmação devolvidos ao buffer')
+        metrics.incr('leases_recuperadas', recuperadas)
+
+    return recuperadas
+
 
 async def ouvinte_de_expiracao(
     callback: Callable[[str, str], Awaitable[None]],
 ):
     """
-    Fica em loop ouvindo o Redis Pub/Sub esperando expirations de chaves.
-    Quando uma chave buffer:trigger:{numero} expira, processa as mensagens.
+    Dispatcher do debounce: entrega cada buffer vencido exatamente uma vez.
 
     COMO FUNCIONA:
-    1. Se inscreve no canal __keyevent@0__:expired do Redis
-    2. Entra em loop infinito aguardando eventos
-    3. Quando recebe um evento de uma chave buffer:trigger:
-       - Extrai o número do usuário
-       - Pega as mensagens agrupadas do Redis
-       - Concatena com espaço
+    1. Reivindica (Lua: ZRANGEBYSCORE + ZREM + drenagem) os números cujo
+       prazo em buffer:deadlines já passou; as mensagens vão para uma
+       chave de reivindicação com lease de BUFFER_LEASE segundos
+    2. Para cada um:
+       - Concatena as mensagens com espaço
        - Chama a função callback (que invoca o agente)
-       - Deleta as mensagens do Redis
+       - Sucesso: confirma e a reivindicação é apagada
+       - Falha: devolve as mensagens ao buffer
+    3. Ao iniciar (e a cada BUFFER_LEASE segundos), devolve ao buffer as
+       reivindicações vencidas de dispatchers que caíram no meio do flush
+    4. Sem nada vencido, bloqueia em BLPOP buffer:wakeup até o próximo
+       prazo (ou até uma nova mensagem chegar) — sem polling ocioso
 
-    IMPORTANTE: Você precisa habilitar no Redis com:
-    redis-cli CONFIG SET notify-keyspace-events Ex
+    Várias réplicas da API podem rodar este loop ao mesmo tempo: a
+    reivindicação é atômica, então cada flush acontece em uma só réplica.
+    Não depende de notify-keyspace-events nem de Pub/Sub.
 
     Args:
         callback: Função assíncrona que será chamada quando o timer expirar
                   Recebe (numero: str, texto_final: str)
     """
-    print('🚀 Ouvinte de expiração iniciado...')
-
-    # Se conecta ao Pub/Sub do Redis
-    pubsub = redis_client.pubsub()
-
-    # Se inscreve no canal de eventos de expiração
-    # __keyevent@0__:expired = eventos de expiração da database 0
-    pubsub.subscribe('__keyevent@0__:expired')
+    print('🚀 Dispatcher do buffer iniciado...')
+    proxima_recuperacao = 0.0
 
     while True:
         try:
-            # Pega uma mensagem do Pub/Sub
-            # ignore_subscribe_messages=True ignora confirmação de inscrição
-            mensagem = pubsub.get_message(ignore_subscribe_messages=True)
-
-            if mensagem and mensagem['data'].startswith('buffer:trigger:'):
-                # Extrai o número da chave que expirou
-                # Exemplo: "buffer:trigger:5585987654321" -> "5585987654321"
-                numero = mensagem['data'].split(':')[2]
-                chave_conteudo = f'buffer:content:{numero}'
-
-                # Recupera as mensagens armazenadas
-                mensagens_json = redis_client.get(chave_conteudo)
-
-                if mensagens_json:
-                    # Converte JSON para lista
-                    mensagens_lista = json.loads(mensagens_json)
-
-                    # Concatena todas as mensagens com espaço
-                    # filter(None, ...) remove strings vazias
-                    texto_final = ' '.join(
-                        filter(None, map(str, mensagens_lista))
-                    )
-
-                    print(f'\n⏰ Timer expirou para {numero}')
-                    print(
-                        f'📦 Processando {len(mensagens_lista)} mensagem(ns)'
-                    )
-                    print(f'💬 Texto final: {texto_final}\n')
-
-                    # Chama a função que invoca o agente
+            if time.monotonic() >= proxima_recuperacao:
+                recuperar_leases_vencidas()
+                proxima_recuperacao = time.monotonic() + BUFFER_LEASE
+
+            reivindicados, espera = reivindicar_vencidos()
+
+            for numero, id_reivindicacao, mensagens_lista in reivindicados:
+
+                # Concatena todas as mensagens com espaço
+                # filter(None, ...) remove strings vazias
+                texto_final = ' '.join(filter(None, mensagens_lista))
+
+                print(f'\n⏰ Timer expirou para {numero}')
+                print(
+                    f'📦 Processando {len(mensagens_lista)} mensagem(ns)'
+                )
+                print(f'💬 Texto final: {texto_final}\n')
+
+                metrics.incr('flushes')
+                metrics.incr('messages', len(mensagens_lista))
+
+                # Chama a função que invoca o agente
+                try:
                     await callback(numero, texto_final)
+                except Exception as e:
+                    # Não perde as mensagens: voltam para o buffer
+                    # com um novo prazo de flush
+                    print(f'❌ Erro no callback para {numero}: {e}')
+                    metrics.incr('callback_errors')
+                    devolver_ao_buffer(id_reivindicacao)
+                    continue
+
+                confirmar_flush(id_reivindicacao)
 
-                    # Limpa o buffer do Redis
-                    redis_client.delete(chave_conteudo)
-                    print(f'🗑️ Buffer deletado para {numero}\n')
+            if reivindicados:
+                continue
 
-            # Pequeno delay para não sobrecarregar a CPU
-            await asyncio.sleep(0.01)
+            # Bloqueia até o próximo prazo ou até chegar uma mensagem nova
+            timeout = DISPATCHER_MAX_IDLE if espera is None else min(max(espera, 0.01), DISPATCHER_MAX_IDLE)
+            await asyncio.to_thread(redis_client.blpop, [CHAVE_DESPERTAR], timeout)
 
         except Exception as e:
-            print(f'❌ Erro no ouvinte: {e}')
+            print(f'❌ Erro no dispatcher do buffer: {e}')
             await asyncio.sleep(
                 1
             )  # Aguarda um pouco antes de tentar novamente
@@ -135,11 +298,11 @@ def iniciar_ouvinte_background(
     callback: Callable[[str, str], Awaitable[None]],
 ):
     """
-    Inicia o ouvinte de expiração em uma thread separada.
+    Inicia o dispatcher do buffer em uma thread separada.
 
     COMO FUNCIONA:
     - Cria uma thread daemon (encerra com a aplicação)
-    - Roda o loop de ouvinte dentro dessa thread
+    - Roda o loop do dispatcher dentro dessa thread
     - Permite que o FastAPI continue respondendo requisições normalmente
 
     Args:
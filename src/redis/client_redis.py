@@ -13,3 +13,12 @@ redis_client = redis.Redis(
     db=0,
     decode_responses=True,
 )
+
+# Mesmo Redis, sem decode: para valores binários (ex: vetores de embeddings)
+redis_client_bytes = redis.Redis(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    password=os.getenv('SENHA_REDIS'),
+    db=0,
+    decode_responses=False,
+)
@@ -1,12 +1,17 @@
+import json
 import os
+import time
+import uuid
 from src.db.crud import PostgreSQL
-from src.db.checkpointer import get_checkpointer
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage
-from rq import Queue, Retry
+from rq import Queue, Retry, get_current_job
+from rq.exceptions import InvalidJobOperation
+from rq.job import Job, JobStatus
 
 from redis import Redis
-from src.graph.workflow import workflow
+from src.graph.idempotency import deve_retomar
+from src.graph.runtime import AgentRuntime
 
 load_dotenv()
 
@@ -30,74 +35,224 @@ redis_conn = Redis(
 # Cria a fila de tarefas
 task_queue = Queue(connection=redis_conn)
 
+JOB_TIMEOUT = 300  # segundos
+MAX_TURNOS_POR_JOB = 5  # depois disso o job passa a vez para um job de continuação
+
+# Caixa de entrada por número: lista FIFO com os textos ainda não processados
+CHAVE_CAIXA = 'agent:inbox:'
+CAIXA_TTL = 86400  # segundos — segurança para caixas abandonadas
+
+# Composição do turno em andamento (id do primeiro item + quantidade de itens)
+CHAVE_TURNO = 'agent:turn:'
+MAX_ITENS_POR_TURNO = 20  # limite de flushes coalescidos em um único turno
+
+# Marca de que já existe um job (na fila ou rodando) dono do número.
+# Garante no máximo um job por conversa em todo o cluster de workers.
+# Valor: '<job_id>:<timestamp do enqueue>'
+CHAVE_DONO = 'agent:owner:'
+DONO_TTL = JOB_TIMEOUT + 60  # expira sozinha se o worker morrer
+DONO_CARENCIA = 30  # segundos em que um dono sem job no RQ ainda está sendo enfileirado
+
+# Status de job que ainda vai (ou está) processando a conversa
+STATUS_VIVOS = {JobStatus.QUEUED, JobStatus.STARTED, JobStatus.SCHEDULED, JobStatus.DEFERRED}
+
+# Compara o dono com um job id (o valor guarda também o timestamp)
+_E_DONO_LUA = """
+    local function e_dono(valor, job_id)
+        return valor and string.sub(valor, 1, #job_id + 1) == job_id .. ':'
+    end
+"""
+
+
+# RPUSH na caixa do número e tenta assumir a posse da conversa.
+# Retorna {1, novo dono} se ninguém era dono (é preciso enfileirar um job),
+# {0, dono atual} caso contrário.
+_ENTREGAR_LUA = redis_conn.register_script(
+    """
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    if redis.call('SET', KEYS[2], ARGV[4], 'NX', 'EX', ARGV[3]) then
+        return {1, ARGV[4]}
+    end
+    return {0, redis.call('GET', KEYS[2])}
+    """
+)
+
+# Troca o dono só se ele ainda for o esperado (ARGV[1]; '' = sem dono)
+_TROCAR_DONO_LUA = redis_conn.register_script(
+    """
+    local atual = redis.call('GET', KEYS[1])
+    if (ARGV[1] == '' and not atual) or atual == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+)
+
+# Job começando um turno: renova a posse se ainda é o dono, ou a retoma se
+# ela expirou. Retorna 0 se outro job assumiu a conversa.
+_RENOVAR_DONO_LUA = redis_conn.register_script(
+    _E_DONO_LUA
+    + """
+    local atual = redis.call('GET', KEYS[1])
+    if e_dono(atual, ARGV[1]) then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return 1
+    end
+    if not atual then
+        redis.call('SET', KEYS[1], ARGV[1] .. ':' .. ARGV[3], 'EX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+)
+
+# Passa a posse do job atual (ARGV[1]) para o próximo (ARGV[2])
+_PASSAR_DONO_LUA = redis_conn.register_script(
+    _E_DONO_LUA
+    + """
+    if e_dono(redis.call('GET', KEYS[1]), ARGV[1]) then
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+)
+
+# Libera a posse só se a caixa estiver vazia (senão o dono continua processando)
+# e se ela ainda é deste job
+_LIBERAR_LUA = redis_conn.register_script(
+    _E_DONO_LUA
+    + """
+    if redis.call('LLEN', KEYS[1]) == 0 then
+        if e_dono(redis.call('GET', KEYS[2]), ARGV[1]) then
+            redis.call('DEL', KEYS[2])
+        end
+        return 1
+    end
+    return 0
+    """
+)
+
+
+def _valor_dono(job_id: str) -> str:
+    return f'{job_id}:{time.time():.0f}'
+
+
+def _dono_vivo(valor: str) -> bool:
+    """O job dono ainda vai processar a conversa (na fila, rodando ou em retry)?"""
+    job_id, _, desde = valor.rpartition(':')
+
+    try:
+        return Job(job_id, connection=redis_conn).get_status() in STATUS_VIVOS
+    except InvalidJobOperation:
+        # Posse recém-assumida e job ainda não gravado no RQ
+        return time.time() - float(desde or 0) < DONO_CARENCIA
+
 
 # ============================================================================
 # FUNÇÃO QUE SERÁ EXECUTADA PELO WORKER
 # ============================================================================
 
 
-def processar_agente(numero: str, texto_final: str):
+def montar_entrada(numero: str, texto_final: str, turn_id: str | None = None) -> tuple[dict, dict]:
+    # O id do turno também identifica a HumanMessage: se o turno for
+    # rodado de novo do início, o add_messages substitui em vez de duplicar
+    entrada = {
+        'number': numero,
+        'messages': [HumanMessage(content=texto_final, id=turn_id)],
+        'turn_id': turn_id,
+    }
+
+    config = {"configurable": {"thread_id": numero}}
+
+    return entrada, config
+
+
+def relatar_resultado(numero: str, resultado: dict) -> tuple[str | None, dict | None]:
+    """
+    Imprime as métricas da resposta final e devolve
+    (resposta_ia, kwargs para save_tokens ou None).
+    """
+    resposta_ia = None
+    tokens = None
+
+    if resultado.get('messages'):
+        ultima_mensagem = resultado['messages'][-1]
+
+        if hasattr(ultima_mensagem, 'content'):
+            resposta_ia = ultima_mensagem.content
+        else:
+            resposta_ia = 'Sem resposta'
+
+        metadata = getattr(ultima_mensagem, 'response_metadata', {})
+        token_usage = metadata.get('token_usage', {})
+
+        print(f'✅ [WORKER] Agente processou com sucesso para {numero}')
+        print(f'\n{"=" * 60}')
+        print(f'📝 Resposta IA: {resposta_ia}')
+        print('\n📊 Métricas:')
+        print(f'   • Tokens entrada: {token_usage.get("prompt_tokens", "N/A")}')
+        print(f'   • Tokens saída: {token_usage.get("completion_tokens", "N/A")}')
+        print(f'   • Total tokens: {token_usage.get("total_tokens", "N/A")}')
+        print(f'   • Tokens em cache: {(token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", "N/A")}')
+        print(
+            f'   • Tempo total: {metadata.get("total_time", "N/A"):.3f}s'
+            if isinstance(metadata.get('total_time'), (int, float))
+            else f'   • Tempo total: {metadata.get("total_time", "N/A")}'
+        )
+        print(f'   • Modelo: {metadata.get("model_name", "N/A")}')
+        print(f'   • Motivo finalização: {metadata.get("finish_reason", "N/A")}')
+        print(f'{"=" * 60}\n')
+
+        usage = getattr(ultima_mensagem, 'usage_metadata', None)
+
+        if usage:
+            tokens = {
+                'phone_number': numero,
+                'message_id': ultima_mensagem.id,
+                'input_tokens': usage.get('input_tokens', 0),
+                'output_tokens': usage.get('output_tokens', 0),
+                'total_tokens': usage.get('total_tokens', 0),
+                'cached_tokens': (usage.get('input_token_details') or {}).get('cache_read', 0) or 0,
+                'model_name': metadata.get('model_name'),
+                'provider': metadata.get('model_provider'),
+            }
+
+    return resposta_ia, tokens
+
+
+def processar_agente(numero: str, texto_final: str, turn_id: str | None = None):
     """
     Função que será executada em background pelo RQ Worker.
-    O graph é compilado aqui dentro para garantir que a conexão
-    do checkpointer seja aberta e fechada corretamente por invocação.
+    O graph compilado e o pool do checkpointer vêm do AgentRuntime,
+    que os mantém abertos durante toda a vida do worker.
+
+    Em um retry do mesmo turno, retoma do último checkpoint da thread
+    (só o nó que falhou roda de novo); efeitos colaterais já feitos
+    são pulados pelas marcas de src/graph/idempotency.py.
     """
     try:
         print(f'📦 [WORKER] Processando buffer para: {numero}')
         print(f'💬 [WORKER] Texto agrupado: {texto_final}')
 
-        entrada = {
-            'number': numero,
-            'messages': [HumanMessage(content=texto_final)],
-        }
+        entrada, config = montar_entrada(numero, texto_final, turn_id)
 
-        config = {"configurable": {"thread_id": numero}}
+        graph = AgentRuntime.get_graph()
 
-        with get_checkpointer() as checkpointer:
-            graph = workflow.compile(checkpointer=checkpointer)
+        if deve_retomar(graph.get_state(config), turn_id):
+            print(f'♻️ [WORKER] Retomando turno {turn_id} de {numero} do último checkpoint')
+            resultado = graph.invoke(None, config=config)
+        else:
             resultado = graph.invoke(entrada, config=config)
 
-        if resultado.get('messages'):
-            ultima_mensagem = resultado['messages'][-1]
-
-            if hasattr(ultima_mensagem, 'content'):
-                resposta_ia = ultima_mensagem.content
-            else:
-                resposta_ia = 'Sem resposta'
-
-            metadata = getattr(ultima_mensagem, 'response_metadata', {})
-            token_usage = metadata.get('token_usage', {})
-
-            print(f'✅ [WORKER] Agente processou com sucesso para {numero}')
-            print(f'\n{"=" * 60}')
-            print(f'📝 Resposta IA: {resposta_ia}')
-            print('\n📊 Métricas:')
-            print(f'   • Tokens entrada: {token_usage.get("prompt_tokens", "N/A")}')
-            print(f'   • Tokens saída: {token_usage.get("completion_tokens", "N/A")}')
-            print(f'   • Total tokens: {token_usage.get("total_tokens", "N/A")}')
-            print(
-                f'   • Tempo total: {metadata.get("total_time", "N/A"):.3f}s'
-                if isinstance(metadata.get('total_time'), (int, float))
-                else f'   • Tempo total: {metadata.get("total_time", "N/A")}'
-            )
-            print(f'   • Modelo: {metadata.get("model_name", "N/A")}')
-            print(f'   • Motivo finalização: {metadata.get("finish_reason", "N/A")}')
-            print(f'{"=" * 60}\n')
+        resposta_ia, tokens = relatar_resultado(numero, resultado)
 
-            usage = getattr(ultima_mensagem, 'usage_metadata', None)
-
-            if usage:
-                PostgreSQL.save_tokens(
-                    phone_number=numero,
-                    message_id=ultima_mensagem.id,
-                    input_tokens=usage.get('input_tokens', 0),
-                    output_tokens=usage.get('output_tokens', 0),
-                    total_tokens=usage.get('total_tokens', 0),
-                    model_name=metadata.get('model_name'),
-                    provider=metadata.get('model_provider'),
-                )
-                print('Tokens Salvos com Sucesso!!! \n')
-                print(f'{"=" * 60}\n')
+        if tokens:
+            PostgreSQL.save_tokens(**tokens)
+            print('Tokens Salvos com Sucesso!!! \n')
+            print(f'{"=" * 60}\n')
 
         return {'status': 'sucesso', 'numero': numero, 'resposta': resposta_ia}
 
@@ -107,18 +262,190 @@ def processar_agente(numero: str, texto_final: str):
         raise
 
 
+def _montar_turno(numero: str) -> dict | None:
+    """
+    Junta em um único turno todos os textos que estão na caixa do número.
+
+    Enquanto o job ainda não começou, cada flush novo só entra na caixa e
+    acaba coalescido aqui: uma chamada ao LLM e uma resposta no WhatsApp
+    em vez de várias. Textos que chegam com o turno já em andamento ficam
+    para o próximo turno (follow-up).
+
+    A composição do turno fica fixada em agent:turn:{numero} até ele
+    terminar, para que um retry do RQ reprocesse exatamente o mesmo turno.
+    """
+    chave_caixa = f'{CHAVE_CAIXA}{numero}'
+    chave_turno = f'{CHAVE_TURNO}{numero}'
+
+    fixado = redis_conn.get(chave_turno)
+    quantidade = json.loads(fixado)['count'] if fixado else MAX_ITENS_POR_TURNO
+
+    itens = [json.loads(item) for item in redis_conn.lrange(chave_caixa, 0, quantidade - 1)]
+    if not itens:
+        return None
+
+    turno = {
+        'id': itens[0]['id'],
+        'texto': ' '.join(filter(None, (item['texto'] for item in itens))),
+        'count': len(itens),
+    }
+
+    if not fixado:
+        redis_conn.set(chave_turno, json.dumps({'id': turno['id'], 'count': turno['count']}), ex=CAIXA_TTL)
+
+    if turno['count'] > 1:
+        print(f'🧩 [WORKER] {turno["count"]} flushes de {numero} coalescidos em um turno')
+
+    return turno
+
+
+def concluir_turno(numero: str, turno: dict):
+    pipe = redis_conn.pipeline(transaction=True)
+    pipe.ltrim(f'{CHAVE_CAIXA}{numero}', turno['count'], -1)
+    pipe.delete(f'{CHAVE_TURNO}{numero}')
+    pipe.execute()
+
+
+def proximo_turno(numero: str, job_id: str) -> dict | None:
+    """
+    Próximo turno da conversa, renovando a posse do número.
+    Retorna None (e libera a posse) quando a caixa está vazia, ou sem
+    processar nada se outro job assumiu a conversa.
+    """
+    chave_caixa = f'{CHAVE_CAIXA}{numero}'
+    chave_dono = f'{CHAVE_DONO}{numero}'
+
+    if not _RENOVAR_DONO_LUA(keys=[chave_dono], args=[job_id, DONO_TTL, f'{time.time():.0f}']):
+        print(f'⚠️ [WORKER] Job {job_id} não é mais dono da conversa de {numero}; encerrando')
+        return None
+
+    while True:
+        turno = _montar_turno(numero)
+
+        if turno is not None:
+            return turno
+
+        if _LIBERAR_LUA(keys=[chave_caixa, chave_dono], args=[job_id]):
+            return None
+
+
+def passar_a_vez(numero: str, job_id: str):
+    """Enfileira o job de continuação e passa a posse para ele."""
+    proximo_id = uuid.uuid4().hex
+
+    if _PASSAR_DONO_LUA(keys=[f'{CHAVE_DONO}{numero}'], args=[job_id, _valor_dono(proximo_id), DONO_TTL]):
+        enfileirar_job(numero, proximo_id)
+
+
+def turno_falhou(numero: str, turno: dict, ultima_tentativa: bool, job_id: str):
+    if not ultima_tentativa:
+        return
+
+    # Última tentativa: descarta o turno problemático para não
+    # travar a conversa e passa a vez para os próximos itens
+    print(f'⚠️ [WORKER] Descartando turno {turno["id"]} de {numero} após falhas')
+    concluir_turno(numero, turno)
+    if not _LIBERAR_LUA(keys=[f'{CHAVE_CAIXA}{numero}', f'{CHAVE_DONO}{numero}'], args=[job_id]):
+        passar_a_vez(numero, job_id)
+
+
+def processar_conversa(numero: str):
+    """
+    Job dono de uma conversa: processa a caixa de entrada do número
+    em ordem estrita, um turno por vez.
+
+    COMO FUNCIONA:
+    - Monta o turno com tudo o que está pendente na caixa (_montar_turno)
+      e roda processar_agente
+    - Só remove os itens depois do turno concluído: se o job falhar,
+      o retry do RQ retoma o mesmo turno do checkpoint, mantendo a ordem
+    - Quando a caixa esvazia, libera a posse da conversa
+    - Após MAX_TURNOS_POR_JOB turnos enfileira uma continuação
+      (sem soltar a posse) para não estourar o job_timeout
+
+    Números diferentes têm jobs diferentes e rodam em paralelo
+    em quantos workers/hosts existirem.
+    """
+    job = get_current_job()
+    job_id = job.id if job else uuid.uuid4().hex
+
+    for _ in range(MAX_TURNOS_POR_JOB):
+        turno = proximo_turno(numero, job_id)
+
+        if turno is None:
+            return {'status': 'sucesso', 'numero': numero}
+
+        try:
+            processar_agente(numero, turno['texto'], turno['id'])
+
+        except Exception:
+            turno_falhou(numero, turno, ultima_tentativa=job is None or not job.retries_left, job_id=job_id)
+            raise
+
+        concluir_turno(numero, turno)
+
+    # Ainda há turnos: continua em um novo job, que herda a posse
+    passar_a_vez(numero, job_id)
+    return {'status': 'continuacao', 'numero': numero}
+
+
+def enfileirar_job(numero: str, job_id: str):
+    return task_queue.enqueue(
+        processar_conversa,
+        numero,
+        job_id=job_id,
+        job_timeout=JOB_TIMEOUT,
+        retry=Retry(max=3),
+    )
+
+
 def enqueue_agent_processing(numero: str, texto_final: str):
+    """
+    Entrega o texto agrupado na caixa de entrada do número e garante
+    que exista exatamente um job cuidando dessa conversa.
+
+    - Se já existe um job dono do número (na fila ou rodando), o texto
+      só entra na caixa e será processado por ele, na ordem de chegada;
+      a posse é renovada, então um job parado na fila além do DONO_TTL
+      não perde a conversa para um segundo job
+    - Se o dono registrado não existe mais no RQ (worker morreu, job
+      perdido), assume no lugar dele
+    - Caso contrário, assume a posse e enfileira processar_conversa
+    """
     try:
         print(f'📤 Colocando tarefa na fila RQ para {numero}')
 
-        job = task_queue.enqueue(
-            processar_agente,
-            numero,
-            texto_final,
-            job_timeout=300,
-            retry=Retry(max=3),
+        chave_dono = f'{CHAVE_DONO}{numero}'
+        turno = json.dumps({'id': uuid.uuid4().hex, 'texto': texto_final})
+        job_id = uuid.uuid4().hex
+        novo_dono = _valor_dono(job_id)
+
+        assumiu, dono_atual = _ENTREGAR_LUA(
+            keys=[f'{CHAVE_CAIXA}{numero}', chave_dono],
+            args=[turno, CAIXA_TTL, DONO_TTL, novo_dono],
         )
 
+        if not assumiu:
+            if _dono_vivo(dono_atual):
+                # Job na fila: o texto será coalescido no próximo turno dele.
+                # Job já rodando: vira um turno de follow-up logo em seguida.
+                redis_conn.expire(chave_dono, DONO_TTL)
+                print(f'📥 Conversa de {numero} já tem job ativo; texto entregue na caixa\n')
+                return None
+
+            if not _TROCAR_DONO_LUA(keys=[chave_dono], args=[dono_atual or '', novo_dono, DONO_TTL]):
+                print(f'📥 Conversa de {numero} foi assumida por outro job; texto entregue na caixa\n')
+                return None
+
+            print(f'⚠️ Dono {dono_atual} de {numero} não existe mais no RQ; assumindo a conversa')
+
+        try:
+            job = enfileirar_job(numero, job_id)
+        except Exception:
+            # Sem job não há dono: libera para a próxima mensagem tentar de novo
+            _TROCAR_DONO_LUA(keys=[chave_dono], args=[novo_dono, '', 1])
+            raise
+
         print(f'✅ Tarefa enfileirada! Job ID: {job.id}\n')
         return job
 
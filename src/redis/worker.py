@@ -0,0 +1,45 @@
+import os
+
+from dotenv import load_dotenv
+from rq import Queue, SimpleWorker
+
+from redis import Redis
+from src.db.connection import close_pool
+from src.graph.runtime import AgentRuntime
+
+load_dotenv()
+
+# O RQ grava os jobs serializados em bytes: a conexão do worker
+# não pode usar decode_responses=True
+worker_conn = Redis(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    password=os.getenv('SENHA_REDIS'),
+    db=0,
+)
+
+
+def main():
+    """
+    Sobe um worker RQ que executa os jobs no próprio processo (SimpleWorker).
+
+    O `rq worker` padrão faz fork de um processo novo por job, o que joga fora
+    o graph compilado e o pool do checkpointer a cada mensagem. Aqui o
+    AgentRuntime é aquecido uma vez e reaproveitado por todos os jobs.
+
+    Rodar com:
+        python -m src.redis.worker
+    """
+    AgentRuntime.warmup()
+
+    worker = SimpleWorker([Queue(connection=worker_conn)], connection=worker_conn)
+
+    try:
+        worker.work(with_scheduler=True)
+    finally:
+        AgentRuntime.close()
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+
+# Os testes nunca chamam um provedor de verdade: com o provedor fake nada
+# precisa de OPENAI_API_KEY (chat, embeddings e transcrição).
+# Definido antes de qualquer import de src/, que lê o env no import.
+os.environ['LLM_PROVIDER'] = 'fake'
@@ -1,6 +1,7 @@
 import pytest
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
 
+from src.agent import agents
 from src.agent.agents import Agent
 
 
@@ -14,11 +15,15 @@ class FakeLLM:
 
     def invoke(self, messages):
         self.last_messages = messages
-        return HumanMessage(content="resposta fake")
-
-
-def fake_get_history(number):
-    return [HumanMessage(content="mensagem antiga")]
+        return AIMessage(
+            content="resposta fake",
+            usage_metadata={
+                "input_tokens": 100,
+                "output_tokens": 5,
+                "total_tokens": 105,
+                "input_token_details": {"cache_read": 80},
+            },
+        )
 
 
 def fake_context_1(state):
@@ -40,30 +45,34 @@ def test_system_prompt_is_built_correctly():
         name="teste",
         prompt="PROMPT BASE",
         llm=fake_llm,
-        get_history=fake_get_history,
         context_providers=[fake_context_1, fake_context_2],
     )
 
     state = {
         "number": "123",
-        "messages": [HumanMessage(content="mensagem nova")]
+        "messages": [
+            HumanMessage(content="mensagem antiga"),
+            HumanMessage(content="mensagem nova"),
+        ],
+        "summary": "RESUMO FAKE",
     }
 
     agent(state)
 
-    # Captura o SystemMessage enviado ao LLM
     sent_messages = fake_llm.last_messages
-    system_message = sent_messages[0]
 
-    assert isinstance(system_message, SystemMessage)
+    # Prefixo estável: só o prompt, sem nada que muda por paciente ou por minuto
+    assert isinstance(sent_messages[0], SystemMessage)
+    assert sent_messages[0].content == "PROMPT BASE"
 
-    system_content = system_message.content
+    # Histórico completo no meio
+    assert [m.content for m in sent_messages[1:3]] == ["mensagem antiga", "mensagem nova"]
 
-    # Verifica se tudo foi incluído
-    assert "PROMPT BASE" in system_content
-    assert "CONTEXTO 1" in system_content
-    assert "CONTEXTO 2" in system_content
+    # Sufixo volátil no fim, na ordem dos providers
+    contexto = sent_messages[-1]
+    assert isinstance(contexto, SystemMessage)
+    assert contexto.content.index("RESUMO FAKE") < contexto.content.index("CONTEXTO 1") < contexto.content.index("CONTEXTO 2")
+    assert len(sent_messages) == 4
 
-    # Verifica histórico completo
-    assert len(sent_messages) == 3
-    print(f'\n\n {system_content}')  # system + antiga + nova
\ No newline at end of file
+    # Tokens em cache registrados por agente
+    assert agents.metrics.snapshot()["counters"]["teste.cached_tokens"] >= 80
\ No newline at end of file
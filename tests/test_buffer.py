@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from src.redis import buffer
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+@pytest.fixture(autouse=True)
+def redis_fake(monkeypatch):
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(buffer, 'redis_client', fake)
+    for script in (buffer._ADICIONAR_LUA, buffer._REIVINDICAR_LUA, buffer._DEVOLVER_LUA, buffer._LEASES_VENCIDAS_LUA):
+        monkeypatch.setattr(script, 'registered_client', fake)
+    monkeypatch.setattr(buffer, 'BUFFER_TIMEOUT', 0)
+    return fake
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_claim_keeps_messages_until_confirmed(redis_fake):
+    buffer.adicionar_ao_buffer('5511', 'oi')
+    buffer.adicionar_ao_buffer('5511', 'tudo bem?')
+
+    [(numero, id_reivindicacao, mensagens)], _ = buffer.reivindicar_vencidos()
+    assert (numero, mensagens) == ('5511', ['oi', 'tudo bem?'])
+    assert redis_fake.exists(f'{buffer.CHAVE_REIVINDICACAO}{id_reivindicacao}')
+
+    buffer.confirmar_flush(id_reivindicacao)
+    assert not redis_fake.exists(f'{buffer.CHAVE_REIVINDICACAO}{id_reivindicacao}')
+    assert redis_fake.zcard(buffer.CHAVE_LEASES) == 0
+
+
+def test_crash_between_claim_and_enqueue_is_recovered(monkeypatch):
+    monkeypatch.setattr(buffer, 'BUFFER_LEASE', 0)
+    buffer.adicionar_ao_buffer('5511', 'primeira')
+    buffer.reivindicar_vencidos()  # dispatcher cai aqui, sem confirmar
+
+    buffer.adicionar_ao_buffer('5511', 'segunda')
+    assert buffer.recuperar_leases_vencidas() == 1
+
+    [(_, _, mensagens)], _ = buffer.reivindicar_vencidos()
+    assert mensagens == ['primeira', 'segunda']
+
+
+def test_failed_callback_returns_messages(monkeypatch):
+    monkeypatch.setattr(buffer, 'BUFFER_RETRY_DELAY', 0)
+    buffer.adicionar_ao_buffer('5511', 'oi')
+    [(_, id_reivindicacao, _)], _ = buffer.reivindicar_vencidos()
+
+    assert buffer.devolver_ao_buffer(id_reivindicacao)
+    assert buffer.recuperar_leases_vencidas() == 0
+
+    [(_, _, mensagens)], _ = buffer.reivindicar_vencidos()
+    assert mensagens == ['oi']
+
+
+def test_dispatcher_redelivers_when_callback_fails(monkeypatch):
+    monkeypatch.setattr(buffer, 'BUFFER_RETRY_DELAY', 0)
+    buffer.adicionar_ao_buffer('5511', 'oi')
+    buffer.adicionar_ao_buffer('5511', 'quero marcar')
+    entregas = []
+
+    async def callback(numero, texto_final):
+        entregas.append(texto_final)
+        if len(entregas) == 1:
+            raise ConnectionError('RQ fora do ar')
+        raise asyncio.CancelledError  # segunda entrega: encerra o dispatcher
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(buffer.ouvinte_de_expiracao(callback))
+
+    assert entregas == ['oi quero marcar', 'oi quero marcar']
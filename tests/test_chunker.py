@@ -0,0 +1,135 @@
+import random
+import time
+
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from src.agent import agents
+from src.agent.agents import Agent
+from src.evo.chunker import ChunkerStreaming, dividir_texto
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+
+def transmitir(texto: str, tamanho: int) -> list[str]:
+    """Alimenta o chunker com pedaços de `tamanho` chars, como o stream do LLM."""
+    chunker = ChunkerStreaming()
+    partes = []
+
+    for i in range(0, len(texto), tamanho):
+        partes += chunker.alimentar(texto[i:i + tamanho])
+
+    return partes + chunker.finalizar()
+
+
+class FakeStreamingLLM:
+    def __init__(self, texto: str):
+        self.texto = texto
+
+    def stream(self, messages):
+        for i in range(0, len(self.texto), 7):
+            yield AIMessageChunk(content=self.texto[i:i + 7])
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_dividir_texto_keeps_sender_rules():
+    frase = 'Frase longa o bastante para o teste. '
+    longo = frase * 10
+
+    texto = f'Olá!\n\nTudo bem?\n\n{longo}'
+    partes = dividir_texto(texto)
+
+    assert partes[:2] == ['Olá!', 'Tudo bem?']
+    assert partes[2:] == [frase.strip()] * 10
+
+
+def test_streaming_matches_full_text_split():
+    random.seed(42)
+    palavras = ['olá', 'Dr.', 'consulta', 'R$ 3.50', 'amanhã!', 'sim?', 'ok.', '\n', '\n\n', ' \n\n ']
+
+    for _ in range(500):
+        texto = ' '.join(random.choice(palavras) for _ in range(random.randint(0, 150)))
+
+        for tamanho in (1, 3, 16):
+            assert transmitir(texto, tamanho) == dividir_texto(texto)
+
+
+def test_streaming_emits_paragraph_before_generation_ends():
+    chunker = ChunkerStreaming()
+
+    assert chunker.alimentar('Primeiro parágrafo.') == []
+    assert chunker.alimentar('\n\nSegundo') == ['Primeiro parágrafo.']
+    assert chunker.finalizar() == ['Segundo']
+
+
+def test_agent_streams_parts_and_keeps_full_message(monkeypatch):
+    monkeypatch.setattr(agents, 'STREAM_TO_WHATSAPP', True)
+
+    texto = 'Oi, tudo bem?\n\nPosso ajudar com o agendamento.'
+    enviados = []
+
+    agent = Agent(
+        name='teste',
+        prompt='PROMPT BASE',
+        llm=FakeStreamingLLM(texto),
+        stream_sender=lambda number, text: enviados.append((number, text)),
+    )
+
+    resultado = agent({'number': '123', 'messages': [HumanMessage(content='oi')]})
+    message = resultado['messages'][0]
+
+    assert enviados == [('123', 'Oi, tudo bem?'), ('123', 'Posso ajudar com o agendamento.')]
+    assert message.content == texto
+    assert resultado['streamed'] == {'id': message.id, 'parts': 2}
+
+
+class LLMQueEsperaOEnvio:
+    """Só termina o stream depois de ver a primeira parte chegar ao WhatsApp."""
+
+    def __init__(self, enviados: list):
+        self.enviados = enviados
+        self.enviados_durante_o_stream = None
+
+    def stream(self, messages):
+        yield AIMessageChunk(content='Primeira parte.\n\n')
+        yield AIMessageChunk(content='Segunda')
+
+        prazo = time.monotonic() + 2
+        while not self.enviados and time.monotonic() < prazo:
+            time.sleep(0.01)
+        self.enviados_durante_o_stream = list(self.enviados)
+
+        yield AIMessageChunk(content=' parte.')
+
+
+def test_agent_sends_first_part_before_stream_ends(monkeypatch):
+    monkeypatch.setattr(agents, 'STREAM_TO_WHATSAPP', True)
+    enviados = []
+    llm = LLMQueEsperaOEnvio(enviados)
+
+    agent = Agent(name='teste', prompt='PROMPT BASE', llm=llm, stream_sender=lambda number, text: enviados.append(text))
+    resultado = agent({'number': '123', 'messages': [HumanMessage(content='oi')]})
+
+    assert llm.enviados_durante_o_stream == ['Primeira parte.']
+    assert enviados == ['Primeira parte.', 'Segunda parte.']
+    assert resultado['streamed']['parts'] == 2
+
+
+def test_agent_holds_tool_call_stream(monkeypatch):
+    monkeypatch.setattr(agents, 'STREAM_TO_WHATSAPP', True)
+    enviados = []
+
+    class LLMComTool:
+        def stream(self, messages):
+            yield AIMessageChunk(content='', tool_call_chunks=[{'name': 'buscar_rag', 'args': '{}', 'id': 't1', 'index': 0}])
+            yield AIMessageChunk(content='Texto junto da tool.\n\nMais texto.')
+
+    agent = Agent(name='teste', prompt='PROMPT BASE', llm=LLMComTool(), stream_sender=lambda number, text: enviados.append(text))
+    resultado = agent({'number': '123', 'messages': [HumanMessage(content='oi')]})
+
+    assert enviados == []
+    assert resultado['messages'][0].tool_calls[0]['name'] == 'buscar_rag'
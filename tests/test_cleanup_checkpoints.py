@@ -9,7 +9,7 @@ Rodar com:
 
 import uuid
 import pytest
-from src.db.connection import get_vector_conn
+from src.db.connection import get_vector_conn, release_vector_conn
 from src.db.checkpointer import setup_checkpointer, cleanup_old_checkpoints
 
 
@@ -78,7 +78,7 @@ def conn():
     connection = get_vector_conn()
     yield connection
     connection.rollback()
-    connection.close()
+    release_vector_conn(connection)
 
 
 # ──────────────────────────────────────────
@@ -0,0 +1,87 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.agent import context_window
+from src.agent.context_window import (
+    janela_de_contexto,
+    mensagens_para_compactar,
+    pendentes_de_resumo,
+    tokens_mensagem,
+)
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+@pytest.fixture(autouse=True)
+def sem_tiktoken(monkeypatch):
+    # Contagem determinística (~4 chars por token), sem baixar o encoding
+    monkeypatch.setattr(context_window, '_encoding', lambda: None)
+
+
+def conversa(turnos: int) -> list:
+    messages = []
+
+    for i in range(turnos):
+        messages.append(HumanMessage(content='x' * 396, id=f'h{i}'))
+        messages.append(AIMessage(
+            content='',
+            id=f'c{i}',
+            tool_calls=[{'id': f't{i}', 'name': 'buscar_rag', 'args': {}}],
+        ))
+        messages.append(ToolMessage(content='y' * 396, tool_call_id=f't{i}', id=f'r{i}'))
+        messages.append(AIMessage(content='z' * 396, id=f'a{i}'))
+
+    return messages
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_window_respects_budget_and_keeps_tool_pairs():
+    messages = conversa(5)
+    fora, janela = janela_de_contexto(messages, orcamento=1000)
+
+    assert fora + janela == messages
+    assert sum(tokens_mensagem(message) for message in janela) <= 1000
+    assert not isinstance(janela[0], ToolMessage)
+
+    ids = [message.id for message in janela]
+    for message in janela:
+        if isinstance(message, ToolMessage):
+            assert f'c{message.id[1:]}' in ids
+
+
+def test_window_always_keeps_last_message():
+    messages = [HumanMessage(content='x' * 10_000, id='h0')]
+
+    assert janela_de_contexto(messages, orcamento=10) == ([], messages)
+
+
+def test_pending_messages_follow_summary_marker():
+    messages = conversa(5)
+    fora, _ = janela_de_contexto(messages, orcamento=1000)
+
+    assert pendentes_de_resumo(messages, None, orcamento=1000) == fora
+    assert pendentes_de_resumo(messages, 'a1', orcamento=1000) == fora[8:]
+    assert pendentes_de_resumo(messages, messages[-1].id, orcamento=1000) == []
+
+    # Mensagens já resumidas que saíram do state: tudo que está fora é novo
+    assert pendentes_de_resumo(messages[8:], 'a1', orcamento=1000) == fora[8:]
+
+
+def test_compaction_removes_only_summarized_messages():
+    messages = conversa(10)
+
+    # Nada resumido: nada sai do checkpoint
+    assert mensagens_para_compactar(messages, None, manter=8) == []
+
+    # Resumido até o turno 3: sai até ali
+    assert mensagens_para_compactar(messages, 'a3', manter=8) == messages[:16]
+
+    # As `manter` mais recentes ficam, e o corte não deixa ToolMessage órfão
+    removidas = mensagens_para_compactar(messages, 'a9', manter=6)
+    assert removidas == messages[:33]
+    assert not isinstance(messages[len(removidas)], ToolMessage)
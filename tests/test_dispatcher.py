@@ -0,0 +1,94 @@
+import pytest
+import requests
+
+from src.evo import dispatcher
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+class FakeEvolution:
+    def __init__(self, falhas: dict | None = None):
+        self.enviados = []
+        self.falhas = falhas or {}
+
+    def _post_direto(self, endpoint, payload, instance=None):
+        erro = self.falhas.get(payload['text'])
+        if erro is not None:
+            raise erro
+        self.enviados.append((payload['number'], payload['text']))
+
+
+def erro_http(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f'{status}', response=response)
+
+
+@pytest.fixture(autouse=True)
+def redis_fake(monkeypatch):
+    monkeypatch.setattr(dispatcher, 'redis_client', fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(dispatcher, 'DISPATCH_RATE_GLOBAL', 100)
+    monkeypatch.setattr(dispatcher, 'DISPATCH_RATE_INSTANCE', 100)
+
+
+def enviar(numero: str, *textos: str):
+    for texto in textos:
+        dispatcher.enfileirar('/message/sendText', {'number': numero, 'text': texto}, instance='clinica')
+
+
+def drenar(evo, rodadas: int = 20):
+    """Roda o laço do dispatcher sem threads, ignorando backoff."""
+    for _ in range(rodadas):
+        numeros = dispatcher._reservar(
+            keys=[dispatcher.CHAVE_PRONTOS], args=['+inf', 10, 0], client=dispatcher.redis_client
+        )
+        for numero in numeros:
+            dispatcher.processar_numero(numero, evo)
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_messages_leave_in_order_per_number():
+    enviar('111', 'a1', 'a2', 'a3')
+    enviar('222', 'b1', 'b2')
+
+    evo = FakeEvolution()
+    drenar(evo)
+
+    assert [texto for numero, texto in evo.enviados if numero == '111'] == ['a1', 'a2', 'a3']
+    assert [texto for numero, texto in evo.enviados if numero == '222'] == ['b1', 'b2']
+    assert dispatcher.redis_client.zcard(dispatcher.CHAVE_PRONTOS) == 0
+
+
+def test_retry_keeps_order_and_dead_letters_client_errors():
+    evo = FakeEvolution(falhas={'a1': erro_http(503), 'a2': erro_http(400)})
+    enviar('111', 'a1', 'a2', 'a3')
+
+    dispatcher.processar_numero('111', evo)
+    assert evo.enviados == []  # a1 falhou e continua na frente
+
+    evo.falhas.pop('a1')
+    drenar(evo)
+
+    assert evo.enviados == [('111', 'a1'), ('111', 'a3')]
+    assert '"a2"' in dispatcher.redis_client.lindex(dispatcher.CHAVE_DLQ, 0)
+
+
+def test_rate_limit_defers_without_counting_attempt(monkeypatch):
+    monkeypatch.setattr(dispatcher, 'DISPATCH_RATE_INSTANCE', 1)
+    monkeypatch.setattr(dispatcher.time, 'time', lambda: 1000.5)  # mesma janela de 1s
+    enviar('111', 'a1')
+    enviar('222', 'b1')
+
+    evo = FakeEvolution()
+    dispatcher.processar_numero('111', evo)
+    dispatcher.processar_numero('222', evo)
+
+    assert evo.enviados == [('111', 'a1')]
+    assert dispatcher.redis_client.llen(f'{dispatcher.CHAVE_FILA}222') == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from src.agent import embeddings
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+class FakeRedis:
+    def __init__(self):
+        self.dados = {}
+
+    def mget(self, chaves):
+        return [self.dados.get(k) for k in chaves]
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor
+
+    def execute(self):
+        pass
+
+
+@pytest.fixture
+def api(monkeypatch):
+    chamadas = []
+
+    def fake_api(textos):
+        chamadas.append(textos)
+        return [[float(len(texto)), 0.5] for texto in textos]
+
+    monkeypatch.setattr(embeddings, '_da_api', fake_api)
+    monkeypatch.setattr(embeddings, 'redis_client_bytes', FakeRedis())
+    embeddings._memoria.clear()
+    embeddings.metrics.reset()
+    return chamadas
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_batch_calls_api_once_per_normalized_text(api):
+    vetores = embeddings.embed_batch(['Qual o endereço?', 'qual  o endereço? ', 'aceita unimed?'])
+
+    # A chave é do texto normalizado, mas a API recebe o texto original
+    assert api == [['Qual o endereço?', 'aceita unimed?']]
+    assert vetores[0] == vetores[1] == [16.0, 0.5]
+    assert embeddings.metrics.snapshot()['counters']['misses'] == 2
+
+
+def test_memory_then_redis_tiers(api):
+    embeddings.embed('aceita unimed?')
+    assert embeddings.embed('ACEITA UNIMED?') == [14.0, 0.5]
+
+    # Outro processo: memória vazia, o vetor vem do Redis em float32
+    embeddings._memoria.clear()
+    assert embeddings.embed('aceita unimed?') == [14.0, 0.5]
+
+    counters = embeddings.metrics.snapshot()['counters']
+    assert len(api) == 1
+    assert (counters['hits.memoria'], counters['hits.redis']) == (1, 1)
+    assert embeddings.metrics.ratio('hits', 'misses') == pytest.approx(2 / 3)
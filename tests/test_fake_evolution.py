@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from src.loadtest import fake_evolution
+from src.loadtest.fake_evolution import app, evento_audio, evento_texto
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(fake_evolution.config, 'latencia_ms', 0)
+    monkeypatch.setitem(fake_evolution.config, 'jitter_ms', 0)
+    monkeypatch.setitem(fake_evolution.config, 'taxa_erro', 0)
+    monkeypatch.setitem(fake_evolution.config, 'respeitar_delay', False)
+
+    with TestClient(app) as client:
+        client.post('/_fake/reset')
+        yield client
+
+
+def test_records_sent_messages_in_order(client):
+    for texto in ['primeira', 'segunda']:
+        response = client.post('/message/sendText/clinica', json={'number': '5511', 'text': texto, 'delay': 1200})
+        assert response.status_code == 201
+        assert response.json()['key']['fromMe'] is True
+
+    enviados = client.get('/_fake/enviados', params={'numero': '5511'}).json()
+
+    assert [registro['texto'] for registro in enviados] == ['primeira', 'segunda']
+    assert all(registro['entregue_em'] >= registro['recebido_em'] for registro in enviados)
+    assert client.get('/_fake/stats').json()['enviados'] == 2
+
+
+def test_error_injection_is_configurable(client):
+    assert client.post('/_fake/config', json={'taxa_erro': 1, 'status_erro': 429}).status_code == 200
+    assert client.post('/_fake/config', json={'nao_existe': 1}).status_code == 400
+
+    response = client.post('/message/sendMedia/clinica', json={'number': '5511', 'mediatype': 'document'})
+
+    assert response.status_code == 429
+    assert client.get('/_fake/stats').json()['erros'] == 1
+
+
+def test_synthetic_events_match_webhook_format():
+    texto = evento_texto('5511', 'oi', from_me=True)['data']
+    audio = evento_audio('5511')['data']
+
+    assert texto['key']['remoteJid'] == '5511@s.whatsapp.net' and texto['key']['fromMe'] is True
+    assert texto['message']['conversation'] == 'oi'
+    assert audio['messageType'] == 'audioMessage' and audio['message']['base64']
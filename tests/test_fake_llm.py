@@ -0,0 +1,104 @@
+import asyncio
+import random
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import tool
+
+from src.agent import llm_factory
+from src.agent.agents import Agent
+from src.agent.llm_factory import CassetteChatModel, FakeChatModel, sorteador_latencia
+from src.graph.states import NextAgent
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+@tool
+def buscar_rag(query: str) -> str:
+    """Busca na base de conhecimento."""
+    return 'trecho'
+
+
+ROTEIRO = {
+    **llm_factory.ROTEIRO_PADRAO,
+    'tools': [{'se': 'valor|conv[eê]nio', 'tool': 'buscar_rag', 'args': {'query': '{texto}'}}],
+    'respostas': [{'se': 'valor', 'resposta': 'A consulta custa R$ 200.'}],
+}
+
+
+@pytest.fixture(autouse=True)
+def fitas_limpas(monkeypatch):
+    monkeypatch.setattr(llm_factory, '_fitas', {})
+
+
+def estado(texto: str) -> dict:
+    return {'number': '5511', 'messages': [HumanMessage(content=texto, id='h1')]}
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_structured_output_follows_routes():
+    orquestrador = Agent(name='orquestrador', prompt='ROTEIE', llm=FakeChatModel(), structured_schema=NextAgent)
+
+    assert orquestrador(estado('quero marcar uma consulta'))['next_agent'].next_agent == 'agendamento'
+    assert orquestrador(estado('onde fica a clínica?'))['next_agent'].next_agent == 'rag'
+    assert asyncio.run(orquestrador.acall(estado('quero falar com atendente')))['next_agent'].next_agent == 'humano'
+
+
+def test_tool_call_once_per_turn_then_text():
+    llm = FakeChatModel(roteiro=ROTEIRO).bind_tools([buscar_rag])
+    messages = [SystemMessage(content='PROMPT'), HumanMessage(content='qual o valor?'), SystemMessage(content='CTX')]
+
+    chamada = llm.invoke(messages)
+    assert chamada.tool_calls[0]['name'] == 'buscar_rag'
+    assert chamada.tool_calls[0]['args'] == {'query': 'qual o valor?'}
+
+    messages[2:2] = [chamada, ToolMessage(content='trecho', tool_call_id=chamada.tool_calls[0]['id'])]
+    resposta = llm.invoke(messages)
+    assert not resposta.tool_calls
+    assert resposta.content == 'A consulta custa R$ 200.'
+
+    partes = list(FakeChatModel(roteiro=ROTEIRO).bind_tools([buscar_rag]).stream(messages[:2]))
+    assert partes[0].tool_call_chunks[0]['name'] == 'buscar_rag'
+
+
+def test_cassette_records_once_and_replays_offline(tmp_path):
+    caminho = str(tmp_path / 'llm.json')
+    gravador = CassetteChatModel(modelo=FakeChatModel(), caminho=caminho, modo='record')
+
+    gravada = gravador.invoke([SystemMessage(content='DATA/HORA ATUAL: 2026-01-05 10:00'), HumanMessage(content='oi')])
+
+    llm_factory._fitas.clear()
+    repetidor = CassetteChatModel(caminho=caminho, modo='replay')
+
+    # Outro minuto, mesmo pedido: repete sem provedor
+    repetida = repetidor.invoke([SystemMessage(content='DATA/HORA ATUAL: 2026-02-09 17:41'), HumanMessage(content='oi')])
+    assert repetida.content == gravada.content
+
+    with pytest.raises(LookupError):
+        repetidor.invoke([HumanMessage(content='pergunta nunca gravada')])
+
+
+def test_latency_distributions():
+    assert sorteador_latencia('fixa:0.5', random.Random(0))() == 0.5
+    uniforme = sorteador_latencia('uniforme:0.1,0.2', random.Random(1))
+    assert all(0.1 <= uniforme() <= 0.2 for _ in range(20))
+
+    with pytest.raises(ValueError):
+        sorteador_latencia('gama:1', random.Random(0))
+
+
+def test_fake_embedding_is_deterministic_and_plausible():
+    def cosseno(a, b):
+        return sum(x * y for x, y in zip(a, b))
+
+    valor = llm_factory.embedding_falso('Qual o valor da consulta?')
+
+    assert len(valor) == llm_factory.FAKE_EMBEDDING_DIMENSOES
+    assert valor == llm_factory.embedding_falso('Qual o valor da consulta?')
+    assert cosseno(valor, llm_factory.embedding_falso('qual o valor da consulta')) == pytest.approx(1.0)
+    assert cosseno(valor, llm_factory.embedding_falso('valor da consulta')) > cosseno(valor, llm_factory.embedding_falso('aceita unimed'))
@@ -0,0 +1,35 @@
+import random
+
+from src.loadtest.load_generator import _parser, montar_rajada, percentil, resumir
+
+
+def test_bursts_are_reproducible_and_start_without_pause():
+    args = _parser().parse_args(['--audio', '0', '--imagem', '0'])
+
+    primeira = montar_rajada(random.Random(7), '559900000001', 0, args)
+    segunda = montar_rajada(random.Random(7), '559900000001', 0, args)
+
+    textos = [evento['data']['message']['conversation'] for evento, _ in primeira]
+    assert textos == [evento['data']['message']['conversation'] for evento, _ in segunda]
+    assert 2 <= len(primeira) <= args.max_rajada
+    assert primeira[0][1] == 0.0
+
+
+def test_report_percentiles_and_buffer_deltas():
+    turnos = [{'mensagens': 2, 'ttfr': ttfr / 10, 'ttlr': ttfr / 5} for ttfr in range(1, 11)]
+    turnos.append({'mensagens': 1, 'sem_resposta': True})
+    amostras = [{'fila_rq': 0}, {'fila_rq': 4}, {'erro_redis': 'x'}]
+
+    resumo = resumir(
+        turnos,
+        amostras,
+        metricas_antes={'buffer': {'counters': {'flushes': 5, 'messages': 9}}},
+        metricas_depois={'buffer': {'counters': {'flushes': 15, 'messages': 30}}},
+        duracao=12.0,
+    )
+
+    assert percentil([3, 1, 2], 50) == 2
+    assert resumo['turnos'] == 11 and resumo['sem_resposta'] == 1
+    assert resumo['ttfr']['max_ms'] == 1000.0 and resumo['ttfr']['count'] == 10
+    assert resumo['buffer'] == {'flushes': 10, 'mensagens': 21, 'erros_callback': 0}
+    assert resumo['fila_rq']['max'] == 4
@@ -0,0 +1,111 @@
+import pytest
+
+from src.graph import router
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+CENTROIDES = {
+    'rag': [1.0, 0.0, 0.0],
+    'agendamento': [0.0, 1.0, 0.0],
+    'humano': [0.0, 0.0, 1.0],
+}
+
+EMBEDDINGS = {
+    'qual a especialidade da doutora?': [0.9, 0.1, 0.0],
+    'pode ser na quinta de manhã': [0.05, 0.95, 0.0],
+    'não aguento mais': [0.0, 0.1, 0.9],
+    'ok': [0.5, 0.5, 0.0],
+}
+
+
+@pytest.fixture(autouse=True)
+def classificador_fake(monkeypatch):
+    monkeypatch.setattr(router, 'PRE_ROUTER_ENABLED', True)
+    monkeypatch.setattr(router, 'get_centroides', lambda: CENTROIDES)
+    monkeypatch.setattr(router, 'embed', lambda texto: EMBEDDINGS[texto])
+    router.metrics.reset()
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+@pytest.mark.parametrize(
+    'texto, agente',
+    [
+        ('Quero MARCAR uma consulta', 'agendamento'),
+        ('preciso cancelar minha consulta de amanhã', 'agendamento'),
+        ('Qual o endereço de vocês?', 'rag'),
+        ('vocês aceitam meu convênio?', 'rag'),
+        ('quero falar com uma atendente', 'humano'),
+    ],
+)
+def test_rules_route_clear_cut_messages(texto, agente):
+    decisao = router.pre_rotear(texto)
+
+    assert decisao.next_agent == agente
+    assert router.metrics.snapshot()['counters']['hits.regras'] == 1
+
+
+def test_rules_for_different_agents_are_ambiguous():
+    assert router.classificar_por_regras('quero remarcar e saber o endereço') is None
+
+
+def test_embedding_routes_above_threshold():
+    decisao = router.pre_rotear('qual a especialidade da doutora?')
+
+    assert decisao.next_agent == 'rag'
+    assert router.metrics.snapshot()['counters']['hits.embedding'] == 1
+
+
+def test_low_confidence_falls_back_to_llm():
+    assert router.pre_rotear('ok') is None
+    assert router.metrics.ratio('hits', 'misses') == 0.0
+
+
+def test_embedding_never_routes_to_human_alone():
+    assert router.pre_rotear('não aguento mais') is None
+
+
+def test_without_centroids_falls_back_to_llm(monkeypatch):
+    monkeypatch.setattr(router, 'get_centroides', lambda: None)
+
+    assert router.pre_rotear('pode ser na quinta de manhã') is None
+    assert router.metrics.snapshot()['counters']['misses'] == 1
+
+
+def test_active_agent_skips_classifier_until_rules_say_otherwise():
+    decisao = router.pre_rotear('ok', agente_ativo='agendamento')
+    assert decisao.next_agent == 'agendamento'
+    assert router.metrics.snapshot()['counters']['hits.sticky'] == 1
+
+    decisao = router.pre_rotear('qual o endereço?', agente_ativo='agendamento')
+    assert decisao.next_agent == 'rag'
+
+
+def test_active_agent_expires():
+    state = {'active_agent': 'agendamento', 'active_agent_expires_at': 0}
+    assert router.agente_fixo(state) is None
+
+    state = router.atualizar_agente_fixo({'agent_name': 'agendamento'})
+    assert router.agente_fixo(state) == 'agendamento'
+    assert state['active_agent_turns'] == 1
+
+
+def test_hand_back_and_turn_limit_release_the_agent(monkeypatch):
+    monkeypatch.setattr(router, 'STICKY_MAX_TURNOS', 2)
+
+    state = {'agent_name': 'agendamento', 'active_agent': 'agendamento', 'active_agent_turns': 1}
+    assert router.atualizar_agente_fixo(state)['active_agent_turns'] == 2
+
+    state['active_agent_turns'] = 2
+    assert router.atualizar_agente_fixo(state)['active_agent'] is None
+
+    state['active_agent_turns'] = 1
+    state['hand_back'] = True
+    assert router.atualizar_agente_fixo(state)['active_agent'] is None
+
+    assert router.atualizar_agente_fixo({'agent_name': 'rag'})['active_agent'] is None
@@ -0,0 +1,104 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from src.agent.agents import Agent
+from src.graph import rag_cache
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+class FakeBanco:
+    def __init__(self):
+        self.guardadas = []
+        self.similaridade = 0.0
+
+    def get_rag_cache(self, embedding, fingerprint):
+        return {'answer': 'Rua das Flores, 100', 'similaridade': self.similaridade}
+
+    def save_rag_cache(self, **kwargs):
+        self.guardadas.append(kwargs)
+
+
+class FakeLLM:
+    def __init__(self):
+        self.recebidas = None
+
+    def invoke(self, messages):
+        self.recebidas = messages
+        return AIMessage(content='Fica na Rua das Flores, 100')
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    banco = FakeBanco()
+    monkeypatch.setattr(rag_cache, 'PostgreSQL', banco)
+    monkeypatch.setattr(rag_cache, 'RAG_CACHE_ENABLED', True)
+    monkeypatch.setattr(rag_cache, 'embed', lambda texto: [1.0, 0.0])
+    monkeypatch.setattr(rag_cache, 'fingerprint', lambda: 'v1')
+    return banco
+
+
+def turno_rag(pergunta: str, tools: list[str]) -> dict:
+    calls = [{'id': f't{i}', 'name': nome, 'args': {}} for i, nome in enumerate(tools)]
+    return {
+        'agent_name': 'rag',
+        'messages': [
+            HumanMessage(content=pergunta),
+            AIMessage(content='', tool_calls=calls),
+            *[ToolMessage(content='ok', tool_call_id=call['id']) for call in calls],
+            AIMessage(content='Fica na Rua das Flores, 100'),
+        ],
+    }
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_hit_only_above_threshold(banco):
+    banco.similaridade = 0.90
+    assert rag_cache.buscar_resposta('qual o endereço de vocês?') is None
+
+    banco.similaridade = 0.99
+    assert rag_cache.buscar_resposta('qual o endereço de vocês?') == 'Rua das Flores, 100'
+
+
+def test_follow_up_questions_skip_cache(banco):
+    banco.similaridade = 1.0
+
+    assert rag_cache.buscar_resposta('e para criança?') is None
+    assert rag_cache.buscar_resposta('aceita?') is None
+
+
+def test_stores_only_answers_grounded_on_rag(banco):
+    assert rag_cache.guardar_resposta(turno_rag('qual o endereço de vocês?', ['buscar_rag']))
+    assert banco.guardadas[0]['answer'] == 'Fica na Rua das Flores, 100'
+
+    assert not rag_cache.guardar_resposta(turno_rag('qual o endereço de vocês?', []))
+    assert not rag_cache.guardar_resposta(turno_rag('manda o endereço de vocês', ['buscar_rag', 'enviar_arquivo']))
+    assert not rag_cache.guardar_resposta({**turno_rag('qual o endereço de vocês?', ['buscar_rag']), 'agent_name': 'cache_rag'})
+
+
+def test_cacheable_turn_is_answered_without_patient_context(banco):
+    llm = FakeLLM()
+    agent = Agent(
+        name='rag',
+        prompt='PROMPT RAG',
+        llm=llm,
+        context_providers=[lambda state: f'O número do usuário é {state["number"]}'],
+        turno_isolado=rag_cache.turno_isolado,
+    )
+    historico = [HumanMessage(content='meu nome é Maria e tenho Unimed'), AIMessage(content='Anotado, Maria!')]
+    state = {'number': '5511', 'summary': 'Paciente Maria, convênio Unimed', 'messages': historico}
+
+    agent({**state, 'messages': [*historico, HumanMessage(content='qual o endereço de vocês?')]})
+    conteudo = ' '.join(str(message.content) for message in llm.recebidas)
+    assert 'Maria' not in conteudo and '5511' not in conteudo
+    assert [type(message) for message in llm.recebidas] == [SystemMessage, HumanMessage]
+
+    # Continuação da conversa: não é cacheável, usa o contexto completo
+    agent({**state, 'messages': [*historico, HumanMessage(content='e para criança?')]})
+    conteudo = ' '.join(str(message.content) for message in llm.recebidas)
+    assert 'Maria' in conteudo and '5511' in conteudo
@@ -0,0 +1,58 @@
+from src.db import retrieval
+from src.db.retrieval import buscar_trechos, fundir_rrf
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+def trechos(*ids):
+    return [{'id': id_, 'content': f'trecho {id_}', 'category': 'servicos'} for id_ in ids]
+
+
+class FakeBanco:
+    def __init__(self, vetoriais, lexicais):
+        self.vetoriais = vetoriais
+        self.lexicais = lexicais
+
+    def get_rag(self, query_embedding, categoria=None, limit=3):
+        return self.vetoriais[:limit]
+
+    def get_rag_lexical(self, query, categoria=None, limit=20):
+        if isinstance(self.lexicais, Exception):
+            raise self.lexicais
+        return self.lexicais[:limit]
+
+
+class SemIndice:
+    def buscar(self, **kwargs):
+        return None
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_rrf_rewards_agreement_between_lists():
+    fundidos = fundir_rrf([trechos('a', 'b', 'c'), trechos('c', 'd')], limit=3)
+
+    assert [t['id'] for t in fundidos] == ['c', 'a', 'b']
+    assert fundidos[0]['score'] == 1 / 63 + 1 / 61
+
+
+def test_exact_term_found_only_by_lexical_search_reaches_top_3(monkeypatch):
+    monkeypatch.setattr(retrieval, 'indice_rag', SemIndice())
+    monkeypatch.setattr(retrieval, 'RAG_HYBRID_ENABLED', True)
+    monkeypatch.setattr(retrieval, 'PostgreSQL', FakeBanco(trechos('a', 'b', 'c', 'unimed'), trechos('unimed')))
+
+    ids = [t['id'] for t in buscar_trechos('aceita unimed?', [0.1])]
+
+    assert ids[:2] == ['unimed', 'a']
+
+
+def test_lexical_failure_keeps_vector_results(monkeypatch):
+    monkeypatch.setattr(retrieval, 'indice_rag', SemIndice())
+    monkeypatch.setattr(retrieval, 'RAG_HYBRID_ENABLED', True)
+    monkeypatch.setattr(retrieval, 'PostgreSQL', FakeBanco(trechos('a', 'b', 'c', 'd'), RuntimeError('sem tsv')))
+
+    assert [t['id'] for t in buscar_trechos('endereço', [0.1])] == ['a', 'b', 'c']
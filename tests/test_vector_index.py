@@ -0,0 +1,89 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from src.db import vector_index
+from src.db.vector_index import IndiceRAG
+
+
+# -----------------------------
+# FAKES
+# -----------------------------
+
+def linhas_fake(total: int, inicio: int = 0) -> list[dict]:
+    random.seed(inicio)
+    base = datetime(2026, 1, 1)
+    return [
+        {
+            'id': str(i),
+            'content': f'trecho {i}',
+            'category': random.choice(['clinica', 'servicos', 'convenios']),
+            'embedding': [random.uniform(-1, 1) for _ in range(16)],
+            'created_at': base + timedelta(seconds=i),
+        }
+        for i in range(inicio, inicio + total)
+    ]
+
+
+def busca_exata(linhas, consulta, categoria, limit):
+    def cosseno(a, b):
+        return sum(x * y for x, y in zip(a, b)) / (math.dist(a, [0] * len(a)) * math.dist(b, [0] * len(b)))
+
+    candidatas = [linha for linha in linhas if categoria is None or linha['category'] == categoria]
+    candidatas.sort(key=lambda linha: -cosseno(linha['embedding'], consulta))
+    return [linha['content'] for linha in candidatas[:limit]]
+
+
+class FakeBanco:
+    def __init__(self, linhas):
+        self.linhas = linhas
+
+    def get_rag_rows(self, desde=None):
+        return [linha for linha in self.linhas if desde is None or linha['created_at'] >= desde]
+
+    def count_rag(self):
+        return len(self.linhas)
+
+
+# -----------------------------
+# TESTES
+# -----------------------------
+
+def test_not_loaded_falls_back_to_postgres():
+    assert IndiceRAG().buscar([1.0] * 16) is None
+
+
+def test_matches_exact_search_with_category_filter(monkeypatch):
+    banco = FakeBanco(linhas_fake(200))
+    monkeypatch.setattr(vector_index, 'PostgreSQL', banco)
+
+    indice = IndiceRAG()
+    indice._carregar_tudo()
+
+    consulta = [random.uniform(-1, 1) for _ in range(16)]
+    for categoria in (None, 'servicos'):
+        resultado = indice.buscar(consulta, categoria=categoria, limit=3)
+        assert [r['content'] for r in resultado] == busca_exata(banco.linhas, consulta, categoria, 3)
+
+    assert indice.buscar(consulta, categoria='inexistente') == []
+
+
+def test_incremental_refresh_and_full_reload(monkeypatch):
+    banco = FakeBanco(linhas_fake(50))
+    monkeypatch.setattr(vector_index, 'PostgreSQL', banco)
+
+    indice = IndiceRAG()
+    indice._carregar_tudo()
+
+    banco.linhas += linhas_fake(5, inicio=50)
+    indice._sincronizar({'INSERT'})
+    assert len(indice._snapshot.linhas) == 55
+
+    # DELETE sem NOTIFY: a conferência periódica percebe pela contagem
+    banco.linhas = banco.linhas[10:]
+    indice._sincronizar(set())
+    assert len(indice._snapshot.linhas) == 45